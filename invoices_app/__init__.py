@@ -34,6 +34,49 @@ INVOICE_STATUS = [
 
 INVOICE_STATUSES_DICT = {n:m for n, m in INVOICE_STATUS}
 
+# Code of each status by its untranslated name
+INVOICE_STATUS_CODES = {
+    INVOICE_STATUS_APPROVED: INVOICE_STATUS_APPROVED_CODE,
+    INVOICE_STATUS_PENDING: INVOICE_STATUS_PENDING_CODE,
+    INVOICE_STATUS_CHANGES_REQUEST: INVOICE_STATUS_CHANGES_REQUEST_CODE,
+    INVOICE_STATUS_REJECTED: INVOICE_STATUS_REJECTED_CODE,
+    INVOICE_STATUS_PAID: INVOICE_STATUS_PAID_CODE,
+    INVOICE_STATUS_IN_PROGRESS: INVOICE_STATUS_IN_PROGRESS_CODE,
+}
+
+# Bootstrap badge class of each status
+INVOICE_STATUS_BADGES = {
+    INVOICE_STATUS_APPROVED_CODE: 'badge-success',
+    INVOICE_STATUS_PENDING_CODE: 'badge-primary',
+    INVOICE_STATUS_CHANGES_REQUEST_CODE: 'badge-warning',
+    INVOICE_STATUS_REJECTED_CODE: 'badge-danger',
+    INVOICE_STATUS_PAID_CODE: 'badge-dark',
+    INVOICE_STATUS_IN_PROGRESS_CODE: 'badge-warning',
+}
+
+# Statuses an invoice can be changed from, by new status, as offered by the
+# invoice detail page. Checked by the bulk status change.
+INVOICE_STATUS_TRANSITIONS = {
+    INVOICE_STATUS_APPROVED_CODE: [INVOICE_STATUS_IN_PROGRESS_CODE],
+    INVOICE_STATUS_CHANGES_REQUEST_CODE: [INVOICE_STATUS_PENDING_CODE, INVOICE_STATUS_IN_PROGRESS_CODE],
+    INVOICE_STATUS_IN_PROGRESS_CODE: [INVOICE_STATUS_PENDING_CODE],
+    INVOICE_STATUS_PAID_CODE: [INVOICE_STATUS_APPROVED_CODE],
+    INVOICE_STATUS_REJECTED_CODE: [
+        INVOICE_STATUS_PENDING_CODE,
+        INVOICE_STATUS_CHANGES_REQUEST_CODE,
+        INVOICE_STATUS_IN_PROGRESS_CODE,
+    ],
+}
+
+# Invoices updated by each query of a bulk status change
+INVOICE_BULK_STATUS_BATCH_SIZE = 100
+
+# Fields whose changes are not shown in the invoice change log
+INVOICE_CHANGE_LOG_IGNORED_FIELDS = [
+    'new_comment_from_ap',
+    'new_comment_from_supplier',
+]
+
 INVOICE_SHOW_ONLY_NEW_MESSAGES = [
     (1, _('Show only invoices with new messages'))
 ]
@@ -43,8 +86,8 @@ INVOICE_FILE_FIELDS = ['invoice_file', 'po_file']
 EXPORT_TO_XLS_FULL = {
     'Invoice Number': 'invoice_number',
     'Invoice Date': 'invoice_date',
-    'Status': 'get_status_display',
-    'Tax Payer': 'taxpayer_name',
+    'Status': 'status',
+    'Tax Payer': 'taxpayer__business_name',
     'Due Date': 'invoice_due_date',
     'Date Received': 'invoice_date_received',
     'Currency': 'currency',
@@ -55,18 +98,91 @@ EXPORT_TO_XLS_FULL = {
     'PO Number': 'po_number'
 
 }
+EXPORT_TO_XLS_FULL_FORMATTERS = {
+    'status': lambda status: str(INVOICE_STATUSES_DICT.get(status, status)),
+}
 EXPORT_TO_XLS_TAXPAYER = {
     'Taxpayer ID': 'pk',
     'Business name': 'business_name',
-    'EB Entity to bill': 'get_eb_entity',
+    'EB Entity to bill': 'eb_entity_name',
     'Submission Date': 'taxpayer_date',
     'Status': 'taxpayer_state',
     'Workday Id': 'workday_id',
 }
+EXPORT_JOB_INVOICES = 'invoices'
+EXPORT_JOB_TAXPAYERS = 'taxpayers'
+
+EXPORT_JOB_KINDS = [
+    (EXPORT_JOB_INVOICES, _('Invoices')),
+    (EXPORT_JOB_TAXPAYERS, _('Taxpayers')),
+]
+
+EXPORT_JOB_STATUS_PENDING = 'PENDING'
+EXPORT_JOB_STATUS_RUNNING = 'RUNNING'
+EXPORT_JOB_STATUS_DONE = 'DONE'
+EXPORT_JOB_STATUS_FAILED = 'FAILED'
+
+EXPORT_JOB_STATUS = [
+    (EXPORT_JOB_STATUS_PENDING, _('Pending')),
+    (EXPORT_JOB_STATUS_RUNNING, _('Running')),
+    (EXPORT_JOB_STATUS_DONE, _('Done')),
+    (EXPORT_JOB_STATUS_FAILED, _('Failed')),
+]
+# Seconds an export job and its file are kept, expire_export_jobs deletes
+# them afterwards
+EXPORT_JOB_EXPIRE_SECONDS = 24 * 60 * 60
+
 INVOICE_DATE_FORMAT = _("MM/DD/YYYY")
 ENGLISH_LANGUAGE_CODE = _('en')
 
 DEFAULT_NUMBER_PAGINATION = 10
+
+# Results of each kind returned by the search endpoint
+SEARCH_RESULTS_LIMIT = 10
+
+# Bulk invoice upload: a ZIP with the invoice PDFs and a CSV manifest with
+# one row per invoice, invoice_file being the name of its PDF in the ZIP
+INVOICE_BULK_UPLOAD_MANIFEST = 'invoices.csv'
+INVOICE_BULK_UPLOAD_COLUMNS = (
+    'invoice_number',
+    'po_number',
+    'invoice_date',
+    'currency',
+    'net_amount',
+    'vat',
+    'total_amount',
+    'eb_entity',
+    'invoice_file',
+)
+INVOICE_BULK_UPLOAD_MAX_ROWS = 200
+INVOICE_BULK_UPLOAD_MAX_SIZE_FILE = 104857600
+INVOICE_BULK_UPLOAD_ALLOWED_FILE_EXTENSIONS = ['zip']
+
+INVOICE_BULK_UPLOAD_CREATED = 'created'
+INVOICE_BULK_UPLOAD_DUPLICATED = 'duplicated'
+INVOICE_BULK_UPLOAD_INVALID = 'invalid'
+
+INVOICE_BULK_UPLOAD_RESULTS = {
+    INVOICE_BULK_UPLOAD_CREATED: _('Created'),
+    INVOICE_BULK_UPLOAD_DUPLICATED: _('Already uploaded'),
+    INVOICE_BULK_UPLOAD_INVALID: _('Invalid'),
+}
+
+INVOICE_LIST_FIELDS = (
+    'currency',
+    'invoice_date',
+    'invoice_date_received',
+    'invoice_due_date',
+    'invoice_number',
+    'new_comment_from_ap',
+    'new_comment_from_supplier',
+    'po_number',
+    'status',
+    'total_amount',
+    'taxpayer__business_name',
+    'taxpayer__country',
+    'invoice_eb_entity__eb_name',
+)
 NO_WORKDAY_ID_ERROR = _("Please provide a Workday ID in order to approve an invoice")
 NO_COMMENT_ERROR = _('Please add a comment to request changes')
 
@@ -98,5 +214,15 @@ INVOICE_STATUS_PAID_UPPER = _('Your invoice #{} for Eventbrite has been paid')
 INVOICE_STATUS_PAID_EMAIL = _('Your invoice #{} for Eventbrite has been paid. '
                               'Please login into BriteSu to see any additional information.')
 
+INVOICE_STATUS_TRANSITION_ERROR = _('Invoice #{} can not be changed from {} to {}')
+INVOICE_WORKDAY_ID_EXISTS_ERROR = _('Workday ID {} already exist')
+INVOICE_BULK_STATUS_CHANGED = _('{} invoices changed to {}')
+INVOICE_BULK_STATUS_UPPER = _('Your invoices for Eventbrite are now {}')
+INVOICE_BULK_STATUS_EMAIL = _('The following invoices for Eventbrite are now {}: #{}. '
+                              'Please login into BriteSu to see any additional information.')
+INVOICE_BULK_STATUS_COMMENT_EMAIL = _('COMMENT: {}')
+INVOICE_FILE_DUPLICATED_WARNING = _('The PDF of invoice #{} was already uploaded with invoice #{}')
+INVOICE_FILE_DUPLICATED_OTHER_TAXPAYER_WARNING = _('The PDF of invoice #{} was already uploaded by another taxpayer')
+
 DISCLAIMER = _('"Please do not reply to this email. If you have any questions, please login into BriteSu and make a '
                'comment in the section related to your question."')
@@ -0,0 +1,210 @@
+"""
+Bulk invoice upload: a ZIP archive with the invoice PDFs and a CSV manifest
+with one row per invoice (see INVOICE_BULK_UPLOAD_COLUMNS).
+
+Reading the PDFs is CPU bound, so they are checked in a process pool. Each
+manifest row then goes through InvoiceForm, the same as an invoice uploaded
+with SupplierInvoiceCreateView, and the valid ones are inserted together.
+"""
+import csv
+from datetime import timedelta
+from io import TextIOWrapper
+import zipfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.utils.translation import ugettext_lazy as _
+
+from invoices_app import (
+    INVOICE_BULK_UPLOAD_COLUMNS,
+    INVOICE_BULK_UPLOAD_CREATED,
+    INVOICE_BULK_UPLOAD_DUPLICATED,
+    INVOICE_BULK_UPLOAD_INVALID,
+    INVOICE_BULK_UPLOAD_MANIFEST,
+    INVOICE_BULK_UPLOAD_MAX_ROWS,
+    INVOICE_MAX_SIZE_FILE,
+)
+from invoices_app.forms import InvoiceForm
+from invoices_app.models import Invoice, get_duplicated_file_warnings
+from utils.documents import store_documents
+from utils.file_validator import check_pdfs, validate_file
+
+
+def read_archive(archive):
+    """
+    The manifest rows of archive, as dicts with the manifest columns plus the
+    line of the row and the content of its PDF (None when the archive does
+    not have it).
+
+    PDFs are read up to INVOICE_MAX_SIZE_FILE, enough for validate_file to
+    reject the bigger ones without inflating them.
+    """
+    try:
+        zip_file = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise ValidationError(_('The file is not a valid ZIP archive'), code='invalid_archive')
+    with zip_file:
+        if INVOICE_BULK_UPLOAD_MANIFEST not in zip_file.namelist():
+            raise ValidationError(
+                _('The ZIP archive has no {} file').format(INVOICE_BULK_UPLOAD_MANIFEST),
+                code='missing_manifest',
+            )
+        with zip_file.open(INVOICE_BULK_UPLOAD_MANIFEST) as manifest:
+            try:
+                reader = csv.DictReader(TextIOWrapper(manifest, encoding='utf-8-sig'))
+                missing_columns = [
+                    column for column in INVOICE_BULK_UPLOAD_COLUMNS
+                    if column not in (reader.fieldnames or [])
+                ]
+                if missing_columns:
+                    raise ValidationError(
+                        _('The manifest is missing the columns: {}').format(', '.join(missing_columns)),
+                        code='missing_columns',
+                    )
+                rows = [
+                    dict(
+                        {column: (row[column] or '').strip() for column in INVOICE_BULK_UPLOAD_COLUMNS},
+                        line=reader.line_num,
+                    )
+                    for row in reader
+                ]
+            except (UnicodeDecodeError, csv.Error):
+                raise ValidationError(_('The manifest is not a valid UTF-8 CSV file'), code='invalid_manifest')
+        if not rows:
+            raise ValidationError(_('The manifest has no invoices'), code='empty_manifest')
+        if len(rows) > INVOICE_BULK_UPLOAD_MAX_ROWS:
+            raise ValidationError(
+                _('Upload at most {} invoices at once').format(INVOICE_BULK_UPLOAD_MAX_ROWS),
+                code='too_many_rows',
+            )
+        names = set(zip_file.namelist())
+        for row in rows:
+            row['content'] = None
+            if row['invoice_file'] in names:
+                with zip_file.open(row['invoice_file']) as invoice_file:
+                    row['content'] = invoice_file.read(INVOICE_MAX_SIZE_FILE)
+    return rows
+
+
+def _check_uploaded_files(uploaded_files):
+    """
+    Errors of each of uploaded_files: the ones of validate_file, then the
+    ones of check_pdfs, read by INVOICE_BULK_UPLOAD_WORKERS processes.
+    """
+    errors = [validate_file(uploaded_file, read_pdf=False)[1] for uploaded_file in uploaded_files]
+    valid_files = [uploaded_file for uploaded_file, file_errors in zip(uploaded_files, errors) if not file_errors]
+    pdf_errors = iter(check_pdfs(valid_files, settings.INVOICE_BULK_UPLOAD_WORKERS))
+    for file_errors in errors:
+        if not file_errors:
+            pdf_error = next(pdf_errors)
+            if pdf_error:
+                file_errors.append(pdf_error)
+    return errors
+
+
+def check_invoice_files(files):
+    """Errors of each (name, content) of files, see _check_uploaded_files"""
+    return _check_uploaded_files([
+        SimpleUploadedFile(name, content, 'application/pdf') for name, content in files
+    ])
+
+
+def _get_form_errors(form, skip_fields=()):
+    return [
+        '{}: {}'.format(field, error) if field != '__all__' else error
+        for field, errors in form.errors.items()
+        if field not in skip_fields
+        for error in errors
+    ]
+
+
+def _insert_invoices(invoices, user):
+    """
+    bulk_create the invoices with their historical records. SQLite does not
+    return the ids of bulk inserted rows, so they are read back by the unique
+    (taxpayer, invoice_number).
+    """
+    # bulk_create saves the files one by one, they are stored first with the
+    # same queries for any number of files
+    store_documents([invoice.invoice_file for invoice in invoices])
+    with transaction.atomic():
+        Invoice.objects.bulk_create(invoices)
+        if any(invoice.pk is None for invoice in invoices):
+            ids = dict(
+                Invoice.objects.filter(
+                    taxpayer_id=invoices[0].taxpayer_id,
+                    invoice_number__in=[invoice.invoice_number for invoice in invoices],
+                ).values_list('invoice_number', 'id')
+            )
+            for invoice in invoices:
+                invoice.pk = ids[invoice.invoice_number]
+        for invoice in invoices:
+            invoice._history_user = user
+        Invoice.history.bulk_history_create(invoices)
+
+
+def import_invoices(taxpayer, user, rows):
+    """
+    Create the invoices of taxpayer for the valid rows returned by
+    read_archive, skipping the invoice numbers it already has. Returns the
+    report of every row: its line, invoice number, result, errors and
+    warnings.
+    """
+    taxpayer = taxpayer.get_taxpayer_child()
+    eb_entities = {eb_entity.eb_name.lower(): eb_entity for eb_entity in taxpayer.eb_entities}
+    existing_numbers = set(
+        Invoice.objects.filter(
+            taxpayer_id=taxpayer.id,
+            invoice_number__in=[row['invoice_number'] for row in rows],
+        ).values_list('invoice_number', flat=True)
+    )
+    uploaded_files = {
+        row['line']: SimpleUploadedFile(row['invoice_file'], row['content'], 'application/pdf')
+        for row in rows if row['content'] is not None
+    }
+    file_errors = dict(zip(uploaded_files, _check_uploaded_files(list(uploaded_files.values()))))
+
+    report, invoices = [], []
+    for row in rows:
+        result = {'line': row['line'], 'invoice_number': row['invoice_number'], 'errors': [], 'warnings': []}
+        report.append(result)
+        if row['invoice_number'] in existing_numbers:
+            result['result'] = INVOICE_BULK_UPLOAD_DUPLICATED
+            continue
+
+        files = {}
+        if row['content'] is None:
+            result['errors'].append(_('The file {} is not in the ZIP archive').format(row['invoice_file']))
+        else:
+            result['errors'].extend(file_errors[row['line']])
+            files['invoice_file'] = uploaded_files[row['line']]
+        form = InvoiceForm(data=row, files=files)
+        # The file errors were already reported by _check_uploaded_files
+        result['errors'].extend(_get_form_errors(form, skip_fields=['invoice_file']))
+        eb_entity = eb_entities.get(row['eb_entity'].lower())
+        if row['eb_entity'] and not eb_entity:
+            result['errors'].append(_('The EB entity {} is not one of the taxpayer').format(row['eb_entity']))
+        if result['errors']:
+            result['result'] = INVOICE_BULK_UPLOAD_INVALID
+            continue
+
+        invoice = form.save(commit=False)
+        invoice.taxpayer_id = taxpayer.id
+        invoice.user = user
+        invoice.invoice_eb_entity = eb_entity
+        invoice.invoice_due_date = invoice.invoice_date + timedelta(days=taxpayer.payment_term)
+        invoices.append(invoice)
+        existing_numbers.add(row['invoice_number'])
+        result['result'] = INVOICE_BULK_UPLOAD_CREATED
+        result['invoice'] = invoice
+
+    if invoices:
+        _insert_invoices(invoices, user)
+        warnings = get_duplicated_file_warnings(invoices)
+        for result in report:
+            invoice = result.pop('invoice', None)
+            if invoice is not None and invoice.id in warnings:
+                result['warnings'].append(warnings[invoice.id])
+    return report
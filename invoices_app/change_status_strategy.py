@@ -1,18 +1,29 @@
+from collections import Counter
+import json
+
 from django.core.validators import validate_integer
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.db.models import Case, CharField, Q, Value, When
 from django.forms import ValidationError
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from invoices_app import (
+    INVOICE_BULK_STATUS_BATCH_SIZE,
     INVOICE_STATUS_APPROVED_CODE,
     INVOICE_STATUS_CHANGES_REQUEST_CODE,
     INVOICE_STATUS_PAID_CODE,
     INVOICE_STATUS_PENDING_CODE,
     INVOICE_STATUS_REJECTED_CODE,
+    INVOICE_STATUS_TRANSITION_ERROR,
+    INVOICE_STATUS_TRANSITIONS,
+    INVOICE_STATUSES_DICT,
+    INVOICE_WORKDAY_ID_EXISTS_ERROR,
     NO_COMMENT_ERROR,
     NO_WORKDAY_ID_ERROR,
     INVOICE_STATUS_IN_PROGRESS_CODE)
-from invoices_app.models import Invoice
+from invoices_app.models import Invoice, InvoiceChange
 from supplier_app.exceptions.taxpayer_exceptions import TaxpayerUniqueWorkdayId
+from utils.history import build_historical_record
 
 
 def change_status(invoice, status, *args):
@@ -47,3 +58,106 @@ def get_change_status_strategy(status):
         INVOICE_STATUS_IN_PROGRESS_CODE: strategy_change_to_in_progress,
     }
     return strategy_assignment[status]
+
+
+def validate_bulk_status_change(invoices, status, workday_ids=None, message=None):
+    """
+    Errors that keep invoices from changing to status, found before any of
+    them is changed. workday_ids has the Workday ID of each invoice by id,
+    needed to change them to in progress, and message is the comment needed
+    to request changes.
+
+    Call it in the transaction of bulk_change_status: the invoices and the
+    ones that have the Workday IDs are locked until it ends, and the status
+    of invoices is refreshed from the locked rows, so concurrent changes
+    can not both pass the checks.
+    """
+    workday_ids = workday_ids or {}
+    requested_workday_ids = [workday_id for workday_id in workday_ids.values() if workday_id]
+    competing = Q(id__in=[invoice.id for invoice in invoices])
+    if status == INVOICE_STATUS_IN_PROGRESS_CODE:
+        competing |= Q(workday_id__in=requested_workday_ids)
+    statuses, taken = {}, set()
+    locked = Invoice.objects.select_for_update().filter(competing).order_by('id')
+    for invoice_id, invoice_status, workday_id in locked.values_list('id', 'status', 'workday_id'):
+        statuses[invoice_id] = invoice_status
+        if workday_id in requested_workday_ids:
+            taken.add(workday_id)
+
+    errors = []
+    for invoice in invoices:
+        invoice.status = statuses.get(invoice.id, invoice.status)
+        if invoice.status not in INVOICE_STATUS_TRANSITIONS.get(status, []):
+            errors.append(INVOICE_STATUS_TRANSITION_ERROR.format(
+                invoice.invoice_number,
+                invoice.get_status_display(),
+                INVOICE_STATUSES_DICT[status],
+            ))
+    if status == INVOICE_STATUS_CHANGES_REQUEST_CODE and not message:
+        errors.append(NO_COMMENT_ERROR)
+    if status == INVOICE_STATUS_IN_PROGRESS_CODE:
+        if not all(workday_ids.get(invoice.id) for invoice in invoices):
+            errors.append(NO_WORKDAY_ID_ERROR)
+        counts = Counter(requested_workday_ids)
+        taken.update(workday_id for workday_id, count in counts.items() if count > 1)
+        errors.extend(INVOICE_WORKDAY_ID_EXISTS_ERROR.format(workday_id) for workday_id in sorted(taken))
+    return errors
+
+
+def bulk_change_status(invoices, status, user, workday_ids=None, message=None):
+    """
+    Change invoices, checked by validate_bulk_status_change in the same
+    transaction, to status in one transaction. The invoices are updated by batches of
+    INVOICE_BULK_STATUS_BATCH_SIZE and their historical records and change
+    log are bulk created, instead of saving them one by one.
+    """
+    history_date = timezone.now()
+    changes = {}
+    for invoice in invoices:
+        changes[invoice.id] = [['status', invoice.status, status]]
+        invoice.status = status
+        if status == INVOICE_STATUS_IN_PROGRESS_CODE:
+            changes[invoice.id].append(['workday_id', invoice.workday_id, workday_ids[invoice.id]])
+            invoice.workday_id = workday_ids[invoice.id]
+
+    with transaction.atomic():
+        for start in range(0, len(invoices), INVOICE_BULK_STATUS_BATCH_SIZE):
+            batch = invoices[start:start + INVOICE_BULK_STATUS_BATCH_SIZE]
+            values = {'status': status}
+            if status == INVOICE_STATUS_IN_PROGRESS_CODE:
+                values['workday_id'] = Case(
+                    *[When(id=invoice.id, then=Value(invoice.workday_id)) for invoice in batch],
+                    output_field=CharField()
+                )
+            Invoice.objects.filter(id__in=[invoice.id for invoice in batch]).update(**values)
+
+        history = Invoice.history.model.objects.bulk_create(
+            [
+                build_historical_record(invoice, user, message, history_date=history_date)
+                for invoice in invoices
+            ],
+            batch_size=INVOICE_BULK_STATUS_BATCH_SIZE,
+        )
+        # SQLite does not return the ids of bulk inserted rows
+        history_ids = {record.id: record.history_id for record in history}
+        if None in history_ids.values():
+            history_ids = dict(
+                Invoice.history.filter(
+                    id__in=list(changes),
+                    history_date=history_date,
+                ).values_list('id', 'history_id')
+            )
+        InvoiceChange.objects.bulk_create(
+            [
+                InvoiceChange(
+                    invoice_id=invoice.id,
+                    history_id=history_ids[invoice.id],
+                    user=user,
+                    change_date=history_date,
+                    changes=json.dumps(changes[invoice.id]),
+                    change_reason=message,
+                )
+                for invoice in invoices
+            ],
+            batch_size=INVOICE_BULK_STATUS_BATCH_SIZE,
+        )
@@ -0,0 +1,28 @@
+from django.utils import translation
+
+from invoices_app import (
+    INVOICE_STATUS_APPROVED_CODE,
+    INVOICE_STATUS_CHANGES_REQUEST_CODE,
+    INVOICE_STATUS_IN_PROGRESS_CODE,
+    INVOICE_STATUS_PAID_CODE,
+    INVOICE_STATUS_PENDING_CODE,
+    INVOICE_STATUS_REJECTED_CODE,
+)
+from utils.invoice_lookup import get_invoice_statuses
+
+# Codes used by the templates for the status options and conditions
+INVOICE_STATUS_CONTEXT = {
+    'INVOICE_STATUS_APPROVED': INVOICE_STATUS_APPROVED_CODE,
+    'INVOICE_STATUS_PENDING': INVOICE_STATUS_PENDING_CODE,
+    'INVOICE_STATUS_CHANGES_REQUEST': INVOICE_STATUS_CHANGES_REQUEST_CODE,
+    'INVOICE_STATUS_REJECTED': INVOICE_STATUS_REJECTED_CODE,
+    'INVOICE_STATUS_PAID': INVOICE_STATUS_PAID_CODE,
+    'INVOICE_STATUS_IN_PROGRESS': INVOICE_STATUS_IN_PROGRESS_CODE,
+}
+
+
+def invoice_statuses(request):
+    """The INVOICE_STATUS_* codes and the statuses in the active language"""
+    context = dict(INVOICE_STATUS_CONTEXT)
+    context['invoice_statuses'] = get_invoice_statuses(translation.get_language())
+    return context
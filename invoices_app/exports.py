@@ -0,0 +1,38 @@
+from invoices_app import (
+    EXPORT_JOB_INVOICES,
+    EXPORT_TO_XLS_FULL,
+    EXPORT_TO_XLS_FULL_FORMATTERS,
+)
+from invoices_app.filters import InvoiceFilter
+from invoices_app.models import Invoice
+from supplier_app.exports import TaxPayerExport
+from supplier_app.models import TaxPayer
+from utils.reports import ExcelReport, ExcelReportInputParams
+
+
+class InvoiceExport(ExcelReport):
+    kind = EXPORT_JOB_INVOICES
+    file_name = 'Invoices'
+    filterset_class = InvoiceFilter
+    history_models = (Invoice, TaxPayer)
+
+    def get_queryset(self):
+        return Invoice.objects.all()
+
+    def get_params(self, filterset):
+        return ExcelReportInputParams(
+            model=filterset.qs.order_by('id'),
+            tab_name='Invoices',
+            headers_attrs=EXPORT_TO_XLS_FULL,
+            formatters=EXPORT_TO_XLS_FULL_FORMATTERS,
+        )
+
+
+EXPORTS = {
+    InvoiceExport.kind: InvoiceExport,
+    TaxPayerExport.kind: TaxPayerExport,
+}
+
+
+def get_export(kind):
+    return EXPORTS[kind]()
@@ -14,10 +14,12 @@ from django.utils.translation import ugettext_lazy as _
 
 from invoices_app import INVOICE_STATUS, INVOICE_SHOW_ONLY_NEW_MESSAGES
 from invoices_app.models import Invoice
+from supplier_app.models import TaxPayer
 from utils.custom_filters import (
     NumericRangeWidget,
     DateRangeWidget
 )
+from utils.search import filter_by_search
 
 
 class InvoiceFilter(FilterSet):
@@ -31,7 +33,7 @@ class InvoiceFilter(FilterSet):
 
     total_amount = RangeFilter(widget=NumericRangeWidget(), label=_('Total Amount'))
     taxpayer__business_name = CharFilter(
-        lookup_expr='icontains',
+        method='filter_organization',
         widget=TextInput(attrs={
             'class': 'form-control',
             "list": "taxpayers",
@@ -68,3 +70,6 @@ class InvoiceFilter(FilterSet):
         form.base_fields['invoice_date'].widget = DateRangeWidget()
         form.base_fields['invoice_due_date'].widget = DateRangeWidget()
         return form
+
+    def filter_organization(self, queryset, name, value):
+        return queryset.filter(taxpayer__in=filter_by_search(TaxPayer.objects.all(), value).values('id'))
@@ -1,12 +1,15 @@
 from django import forms
+from django.core.validators import FileExtensionValidator
 
 from django.utils.translation import gettext_lazy as _
 
 from invoices_app import (
+    INVOICE_BULK_UPLOAD_ALLOWED_FILE_EXTENSIONS,
+    INVOICE_BULK_UPLOAD_MAX_SIZE_FILE,
     INVOICE_MAX_SIZE_FILE
 )
 from invoices_app.models import Invoice
-from utils.file_validator import validate_file
+from utils.file_validator import FileSizeValidator, validate_file
 
 
 class InvoiceForm(forms.ModelForm):
@@ -61,3 +64,18 @@ class InvoiceForm(forms.ModelForm):
             'workday_id': forms.TextInput(attrs={'class': 'form-control', 'placeholder': _('Workday ID')}),
         }
 
+    def clean_workday_id(self):
+        workday_id = self.cleaned_data['workday_id']
+        if workday_id and Invoice.objects.filter(workday_id=workday_id).exclude(id=self.instance.id).exists():
+            raise forms.ValidationError(_('Workday ID already exist'))
+        return workday_id
+
+
+class InvoiceBulkUploadForm(forms.Form):
+    archive = forms.FileField(
+        label=_('ZIP file'),
+        validators=[
+            FileExtensionValidator(allowed_extensions=INVOICE_BULK_UPLOAD_ALLOWED_FILE_EXTENSIONS),
+            FileSizeValidator(limit_size=INVOICE_BULK_UPLOAD_MAX_SIZE_FILE),
+        ],
+    )
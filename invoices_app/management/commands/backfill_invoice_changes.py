@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from invoices_app.models import Invoice, InvoiceChange
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Fill the invoice change log from the existing invoice history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of change log rows written per query',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        logged_history_ids = set(InvoiceChange.objects.values_list('history_id', flat=True))
+        # Records come grouped by invoice and in date order, so the previous
+        # record of each one is the one read just before it.
+        records = Invoice.history.filter(
+            id__in=Invoice.objects.values('id'),
+        ).order_by('id', 'history_date', 'history_id').iterator()
+        previous_record = None
+        batch = []
+        created = 0
+        for record in records:
+            if (
+                previous_record is not None and
+                previous_record.id == record.id and
+                record.history_id not in logged_history_ids
+            ):
+                invoice_change = InvoiceChange.from_history(record, previous_record)
+                if invoice_change:
+                    batch.append(invoice_change)
+            if len(batch) >= batch_size:
+                InvoiceChange.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+            previous_record = record
+        InvoiceChange.objects.bulk_create(batch)
+        created += len(batch)
+        self.stdout.write('{} invoice changes logged'.format(created))
@@ -0,0 +1,87 @@
+import json
+import subprocess
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from utils.benchmark import BenchmarkDataGenerator, get_query_plans, run_benchmark
+
+DEFAULT_COMPANIES = 50000
+DEFAULT_TAXPAYERS = 100000
+DEFAULT_INVOICES = 2000000
+DEFAULT_INVOICE_UPDATES = 1
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_REPEAT = 5
+
+
+def get_git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=settings.BASE_DIR,
+            stderr=subprocess.DEVNULL,
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a large supplier and invoice dataset and time the busiest views on it, '
+        'printing a JSON report to compare between commits'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=DEFAULT_COMPANIES)
+        parser.add_argument('--taxpayers', type=int, default=DEFAULT_TAXPAYERS)
+        parser.add_argument('--invoices', type=int, default=DEFAULT_INVOICES)
+        parser.add_argument(
+            '--invoice-updates',
+            type=int,
+            default=DEFAULT_INVOICE_UPDATES,
+            help='Status changes recorded in the history of every invoice',
+        )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--skip-generate',
+            action='store_true',
+            help='Time the views on the data already in the database',
+        )
+        parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Timed requests per view')
+        parser.add_argument('--output', help='File to write the report to, instead of the standard output')
+
+    def handle(self, *args, **options):
+        if not options['skip_generate']:
+            BenchmarkDataGenerator(
+                companies=options['companies'],
+                taxpayers=options['taxpayers'],
+                invoices=options['invoices'],
+                invoice_updates=options['invoice_updates'],
+                batch_size=options['batch_size'],
+                seed=options['seed'],
+                stdout=self.stderr,
+            ).generate()
+            call_command('backfill_invoice_changes', batch_size=options['batch_size'], stdout=self.stderr)
+
+        # The views are requested through the test client
+        with override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+            results = run_benchmark(options['repeat'])
+
+        report = json.dumps({
+            'git_revision': get_git_revision(),
+            'date': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'results': results,
+            'plans': get_query_plans(),
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report)
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,76 @@
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import translation
+
+from invoices_app.workday_import import (
+    WORKDAY_IMPORT_BATCH_SIZE,
+    WORKDAY_IMPORT_RESULTS,
+    WorkdayImport,
+    WorkdayImportError,
+    read_workday_export,
+)
+from users_app.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Assign the Workday IDs of a Workday export (CSV or XLSX), approving its taxpayers '
+        'and putting its invoices in progress'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file with the columns Workday ID, Taxpayer ID and Invoice Number')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would change',
+        )
+        parser.add_argument(
+            '--user',
+            help='Email of the AP user the changes are recorded for',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=WORKDAY_IMPORT_BATCH_SIZE,
+            help='Number of rows looked up or written per query',
+        )
+        parser.add_argument(
+            '--no-emails',
+            action='store_true',
+            help='Do not notify the suppliers and buyers',
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(email=options['user'])
+            except User.DoesNotExist:
+                raise CommandError('There is no user {}'.format(options['user']))
+        try:
+            workday_import = WorkdayImport(read_workday_export(options['path']), user, options['batch_size'])
+        except WorkdayImportError as error:
+            raise CommandError(str(error))
+        report = workday_import.match()
+
+        for result in report:
+            self.stdout.write('{line}: {identifier} {invoice_number} {workday_id} {result} {message}'.format(
+                **result
+            ).replace('  ', ' ').strip())
+        counts = Counter(result['result'] for result in report)
+        self.stdout.write(', '.join('{} {}'.format(counts[result], result) for result in WORKDAY_IMPORT_RESULTS))
+
+        if options['dry_run']:
+            self.stdout.write('Dry run, nothing was changed')
+            return
+        # Commands run without an active language, the notifications switch
+        # to the one of each user and back
+        with translation.override(settings.LANGUAGE_CODE):
+            workday_import.apply(notify=not options['no_emails'])
+        self.stdout.write('{} taxpayers approved, {} invoices in progress'.format(
+            len(workday_import.taxpayers),
+            len(workday_import.invoices),
+        ))
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.24 on 2026-10-18 09:35
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices_app', '0010_invoice_change'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='invoice',
+            index_together=set([('invoice_date',), ('status', 'invoice_date_received'), ('invoice_date_received', 'id'), ('invoice_due_date',)]),
+        ),
+        # Few invoices have unread comments, so these only index those rows
+        migrations.RunSQL(
+            sql=['CREATE INDEX invoice_new_comment_from_ap ON invoices_app_invoice '
+                 '(invoice_date_received, id) WHERE new_comment_from_ap'],
+            reverse_sql=['DROP INDEX invoice_new_comment_from_ap'],
+        ),
+        migrations.RunSQL(
+            sql=['CREATE INDEX invoice_new_comment_from_supplier ON invoices_app_invoice '
+                 '(invoice_date_received, id) WHERE new_comment_from_supplier'],
+            reverse_sql=['DROP INDEX invoice_new_comment_from_supplier'],
+        ),
+        # Not unique, the workday ids of the existing invoices were never
+        # checked, InvoiceForm rejects the ones already used
+        migrations.RunSQL(
+            sql=["CREATE INDEX invoice_workday_id ON invoices_app_invoice (workday_id) WHERE workday_id <> ''"],
+            reverse_sql=['DROP INDEX invoice_workday_id'],
+        ),
+    ]
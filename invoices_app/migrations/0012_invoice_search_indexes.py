@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.24 on 2026-10-18 09:42
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices_app', '0011_invoice_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='invoice',
+            index_together=set([('invoice_number',), ('invoice_date_received', 'id'), ('po_number',), ('invoice_due_date',), ('invoice_date',), ('status', 'invoice_date_received')]),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.24 on 2026-10-18 10:32
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations
+import utils.documents
+import utils.file_validator
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices_app', '0012_invoice_search_indexes'),
+    ]
+
+    operations = [
+        # The column does not change, SQLite would rebuild the tables and lose
+        # the indexes created with SQL
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='comment',
+                name='comment_file',
+                field=utils.documents.DocumentFileField(blank=True, upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf'])]),
+            ),
+            migrations.AlterField(
+                model_name='invoice',
+                name='invoice_file',
+                field=utils.documents.DocumentFileField(upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.FileSizeValidator(limit_size=5242880)], verbose_name='Invoice File'),
+            ),
+        ]),
+    ]
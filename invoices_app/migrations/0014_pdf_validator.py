@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.24 on 2026-10-18 10:47
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+import utils.documents
+import utils.file_validator
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices_app', '0013_document_file_fields'),
+    ]
+
+    operations = [
+        # The column does not change, SQLite would rebuild the tables and lose
+        # the indexes created with SQL
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='comment',
+                name='comment_file',
+                field=utils.documents.DocumentFileField(blank=True, upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.PdfValidator()]),
+            ),
+            migrations.AlterField(
+                model_name='historicalinvoice',
+                name='invoice_file',
+                field=models.TextField(max_length=100, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.FileSizeValidator(limit_size=5242880), utils.file_validator.PdfValidator()], verbose_name='Invoice File'),
+            ),
+            migrations.AlterField(
+                model_name='invoice',
+                name='invoice_file',
+                field=utils.documents.DocumentFileField(upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.FileSizeValidator(limit_size=5242880), utils.file_validator.PdfValidator()], verbose_name='Invoice File'),
+            ),
+        ]),
+    ]
@@ -1,17 +1,30 @@
+from collections import defaultdict
 from decimal import Decimal
+import json
 
 from django.conf import settings
 from django.core.validators import FileExtensionValidator, MinValueValidator
 from django.db import models
+from django.dispatch import receiver
 
 from django.utils.translation import ugettext_lazy as _
 from simple_history.models import HistoricalRecords
+from simple_history.signals import post_create_historical_record
 
 from invoices_app import (
     CURRENCIES,
+    EXPORT_JOB_KINDS,
+    EXPORT_JOB_STATUS,
+    EXPORT_JOB_STATUS_DONE,
+    EXPORT_JOB_STATUS_FAILED,
+    EXPORT_JOB_STATUS_PENDING,
     INVOICE_STATUS,
     INVOICE_STATUS_PENDING,
     INVOICE_ALLOWED_FILE_EXTENSIONS,
+    INVOICE_CHANGE_LOG_IGNORED_FIELDS,
+    INVOICE_FILE_DUPLICATED_OTHER_TAXPAYER_WARNING,
+    INVOICE_FILE_DUPLICATED_WARNING,
+    INVOICE_LIST_FIELDS,
     INVOICE_MAX_SIZE_FILE,
 )
 
@@ -20,14 +33,39 @@ from supplier_app.models import (
     TaxPayer,
 )
 
+from utils.documents import DocumentFileField
 from utils.invoice_lookup import invoice_status_lookup
-from utils.file_validator import FileSizeValidator
+from utils.file_validator import FileSizeValidator, PdfValidator
+
+
+class InvoiceQuerySet(models.QuerySet):
+
+    def for_list(self):
+        """
+        Join the taxpayer and EB entity and load only the columns shown in
+        the invoice list, so rendering a page does not query once per row.
+        """
+        return self.select_related(
+            'taxpayer',
+            'invoice_eb_entity',
+        ).only(*INVOICE_LIST_FIELDS)
 
 
 class Invoice(models.Model):
 
     class Meta:
         unique_together = ('taxpayer', 'invoice_number',)
+        # Partial indexes on the unread comment flags and the partial
+        # (non-unique) index on the workday id are created with SQL in
+        # migration 0011_invoice_filter_indexes.
+        index_together = [
+            ('status', 'invoice_date_received'),
+            ('invoice_date_received', 'id'),
+            ('invoice_date',),
+            ('invoice_due_date',),
+            ('invoice_number',),
+            ('po_number',),
+        ]
 
     taxpayer = models.ForeignKey(TaxPayer, on_delete=models.PROTECT)
     currency = models.CharField(max_length=200, choices=CURRENCIES, verbose_name=_('Currency'))
@@ -68,12 +106,13 @@ class Invoice(models.Model):
       settings.AUTH_USER_MODEL,
       on_delete=models.CASCADE
     )
-    invoice_file = models.FileField(
+    invoice_file = DocumentFileField(
         upload_to='file',
         verbose_name=_('Invoice File'),
         validators=[
             FileExtensionValidator(allowed_extensions=['pdf']),
             FileSizeValidator(limit_size=INVOICE_MAX_SIZE_FILE),
+            PdfValidator(),
         ]
     )
     workday_id = models.CharField(max_length=50, blank=True, null=True)
@@ -86,11 +125,39 @@ class Invoice(models.Model):
 
     history = HistoricalRecords()
 
+    objects = InvoiceQuerySet.as_manager()
+
     @property
     def taxpayer_name(self):
         return self.taxpayer.business_name
 
 
+def get_duplicated_file_warnings(invoices):
+    """
+    Warning of each invoice of invoices whose PDF was uploaded with another
+    invoice, by invoice id. Files are stored once per content (see
+    utils.documents), so the same PDF has the same name. The numbers of the
+    invoices of other taxpayers are not shown.
+    """
+    same_file_invoices = defaultdict(list)
+    for invoice in Invoice.objects.filter(
+        invoice_file__in={invoice.invoice_file.name for invoice in invoices},
+    ).only('invoice_number', 'invoice_file', 'taxpayer_id').order_by('id'):
+        same_file_invoices[invoice.invoice_file.name].append(invoice)
+    warnings = {}
+    for invoice in invoices:
+        others = [other for other in same_file_invoices[invoice.invoice_file.name] if other.id != invoice.id]
+        numbers = [other.invoice_number for other in others if other.taxpayer_id == invoice.taxpayer_id]
+        if numbers:
+            warnings[invoice.id] = INVOICE_FILE_DUPLICATED_WARNING.format(
+                invoice.invoice_number,
+                ', #'.join(numbers),
+            )
+        elif others:
+            warnings[invoice.id] = INVOICE_FILE_DUPLICATED_OTHER_TAXPAYER_WARNING.format(invoice.invoice_number)
+    return warnings
+
+
 class Comment(models.Model):
     user = models.ForeignKey(
       settings.AUTH_USER_MODEL,
@@ -103,7 +170,97 @@ class Comment(models.Model):
 
     message = models.CharField(max_length=200)
     comment_date_received = models.DateTimeField(auto_now_add=True)
-    comment_file = models.FileField(
+    comment_file = DocumentFileField(
         upload_to='file',
         blank=True,
-        validators=[FileExtensionValidator(allowed_extensions=['pdf'])])
+        validators=[FileExtensionValidator(allowed_extensions=['pdf']), PdfValidator()])
+
+
+class InvoiceChange(models.Model):
+    """
+    Changes made to an invoice by one of its historical records, stored as
+    a JSON list of [field, old value, new value]. Rows are written when the
+    historical record is created, so reading the log of an invoice does not
+    need to walk and diff its whole history.
+    """
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE)
+    history_id = models.IntegerField(unique=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    change_date = models.DateTimeField()
+    changes = models.TextField()
+    change_reason = models.TextField(blank=True, null=True)
+
+    class Meta:
+        index_together = ('invoice', 'change_date')
+
+    def get_changes(self):
+        return json.loads(self.changes)
+
+    @classmethod
+    def from_history(cls, record, previous_record):
+        """
+        Build the change made by record over previous_record, or return None
+        when nothing worth logging changed.
+        """
+        delta = record.diff_against(previous_record)
+        changes = [
+            [change.field, change.old, change.new]
+            for change in delta.changes
+            if change.field not in INVOICE_CHANGE_LOG_IGNORED_FIELDS
+        ]
+        if not changes and not record.history_change_reason:
+            return None
+        return cls(
+            invoice_id=record.id,
+            history_id=record.history_id,
+            user_id=record.history_user_id,
+            change_date=record.history_date,
+            changes=json.dumps(changes),
+            change_reason=record.history_change_reason,
+        )
+
+
+class ExportJob(models.Model):
+    kind = models.CharField(max_length=20, choices=EXPORT_JOB_KINDS)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    querystring = models.TextField(blank=True)
+    cache_key = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(
+        max_length=20,
+        choices=EXPORT_JOB_STATUS,
+        default=EXPORT_JOB_STATUS_PENDING,
+    )
+    row_count = models.PositiveIntegerField(default=0)
+    progress = models.PositiveSmallIntegerField(default=0)
+    result_file = models.FileField(upload_to='exports', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    @property
+    def is_finished(self):
+        return self.status in (EXPORT_JOB_STATUS_DONE, EXPORT_JOB_STATUS_FAILED)
+
+
+@receiver(post_create_historical_record, sender=Invoice.history.model)
+def log_invoice_change(sender, history_instance, **kwargs):
+    # The records are read back from the database, so the values compared
+    # are the stored ones and not whatever the saved instance was holding.
+    records = list(
+        sender.objects.filter(
+            id=history_instance.id,
+            history_date__lte=history_instance.history_date,
+        ).order_by('-history_date', '-history_id')[:2]
+    )
+    if len(records) < 2:
+        return
+    invoice_change = InvoiceChange.from_history(*records)
+    if invoice_change:
+        invoice_change.save()
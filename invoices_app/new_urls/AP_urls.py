@@ -2,16 +2,30 @@ from django.conf.urls import url, include
 
 from invoices_app.views import (
     InvoiceHistory,
+    bulk_change_invoice_status,
     change_invoice_status,
+    download_export_job,
+    export_job_detail,
     export_to_xlsx_invoice,
+    export_to_xlsx_invoice_job,
+    search,
 )
 
 invoice_pattern = [
     url(r'^change-status/(?P<pk>[0-9]+)/$', change_invoice_status, name='change-invoice-status'),
+    url(r'^change-status/$', bulk_change_invoice_status, name='bulk-change-invoice-status'),
     url(r'^history/(?P<pk>[0-9]+)/$', InvoiceHistory.as_view(), name='invoice-history'),
     url(r'^xls/$', export_to_xlsx_invoice, name='invoice-to-xls'),
+    url(r'^xls/job/$', export_to_xlsx_invoice_job, name='invoice-to-xls-job'),
+]
+
+export_pattern = [
+    url(r'^(?P<pk>[0-9]+)/$', export_job_detail, name='export-job-detail'),
+    url(r'^(?P<pk>[0-9]+)/download/$', download_export_job, name='export-job-download'),
 ]
 
 urlpatterns = [
-    url(r'^invoice/', include(invoice_pattern))
+    url(r'^invoice/', include(invoice_pattern)),
+    url(r'^export/', include(export_pattern)),
+    url(r'^search/$', search, name='search'),
 ]
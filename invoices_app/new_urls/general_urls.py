@@ -5,6 +5,8 @@ from invoices_app.views import (
     InvoiceListView,
     InvoiceUpdateView,
     SupplierInvoiceListView,
+    download_comment_file,
+    download_invoice_file,
     post_a_comment,
 )
 
@@ -12,6 +14,12 @@ from invoices_app.views import (
 invoice_pattern = [
     url(r'^$', InvoiceListView.as_view(), name='invoices-list'),
     url(r'^(?P<pk>[0-9]+)/post-comment$', post_a_comment, name='post-comment'),
+    url(r'^(?P<pk>[0-9]+)/file$', download_invoice_file, name='invoice-file'),
+    url(
+        r'^(?P<pk>[0-9]+)/comment/(?P<comment_id>[0-9]+)/file$',
+        download_comment_file,
+        name='invoice-comment-file'
+    ),
     url(
         r'^(?P<pk>[0-9]+)/update$',
         InvoiceUpdateView.as_view(),
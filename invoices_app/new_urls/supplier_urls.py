@@ -1,6 +1,9 @@
 from django.conf.urls import url
 
-from invoices_app.views import SupplierInvoiceCreateView
+from invoices_app.views import (
+    SupplierInvoiceBulkUploadView,
+    SupplierInvoiceCreateView,
+)
 
 urlpatterns = [
     url(
@@ -8,4 +11,9 @@ urlpatterns = [
         SupplierInvoiceCreateView.as_view(),
         name='invoice-create',
     ),
+    url(
+        r'^taxpayer/(?P<taxpayer_id>[0-9]+)/invoice/bulk/$',
+        SupplierInvoiceBulkUploadView.as_view(),
+        name='invoice-bulk-upload',
+    ),
 ]
@@ -0,0 +1,111 @@
+import re
+
+from django.db.models import Q
+from django.urls import reverse
+
+from invoices_app import INVOICE_STATUSES_DICT, SEARCH_RESULTS_LIMIT
+from invoices_app.models import Invoice
+from supplier_app.models import (
+    Company,
+    TaxPayer,
+    TaxPayerArgentina,
+    TaxPayerUnitedStates,
+)
+from utils.search import filter_by_search
+
+TAXPAYER_SEARCH_FIELDS = (
+    'id',
+    'business_name',
+    'country',
+    'taxpayer_state',
+)
+
+_IDENTIFIER_SEPARATORS_RE = re.compile(r'[\s.-]')
+
+
+def _get_taxpayer_result(taxpayer, identifier):
+    return {
+        'id': taxpayer['id'],
+        'business_name': taxpayer['business_name'],
+        'identifier': identifier,
+        'country': taxpayer['country'],
+        'state': taxpayer['taxpayer_state'],
+        'url': reverse('supplier-details', kwargs={'taxpayer_id': taxpayer['id']}),
+    }
+
+
+def search_taxpayers(text, limit=SEARCH_RESULTS_LIMIT):
+    """
+    Taxpayers whose CUIT or US taxpayer id is text come first, followed by
+    the ones whose business name matches it, best matches first.
+    """
+    results = []
+    identifier = _IDENTIFIER_SEPARATORS_RE.sub('', text)
+    if identifier.isdigit():
+        for model, field_name in ((TaxPayerArgentina, 'cuit'), (TaxPayerUnitedStates, 'taxpayer_id_number')):
+            for taxpayer in model.objects.filter(**{field_name: identifier}).values(*TAXPAYER_SEARCH_FIELDS):
+                results.append(_get_taxpayer_result(taxpayer, identifier))
+
+    found_ids = {result['id'] for result in results}
+    taxpayers = filter_by_search(TaxPayer.objects.all(), text, rank=True).order_by(
+        '-search_rank',
+        'business_name',
+    ).values(
+        *TAXPAYER_SEARCH_FIELDS,
+        'taxpayerargentina__cuit',
+        'taxpayerunitedstates__taxpayer_id_number',
+    )[:limit]
+    for taxpayer in taxpayers:
+        if taxpayer['id'] not in found_ids:
+            identifier = taxpayer['taxpayerargentina__cuit'] or taxpayer['taxpayerunitedstates__taxpayer_id_number']
+            results.append(_get_taxpayer_result(taxpayer, identifier))
+    return results[:limit]
+
+
+def search_companies(text, limit=SEARCH_RESULTS_LIMIT):
+    companies = filter_by_search(Company.objects.all(), text, rank=True).order_by('-search_rank', 'name')
+    return [
+        {'id': company_id, 'name': name}
+        for company_id, name in companies.values_list('id', 'name')[:limit]
+    ]
+
+
+def search_invoices(text, limit=SEARCH_RESULTS_LIMIT):
+    """
+    Invoices whose invoice number or PO number is text, the ones matching
+    by invoice number first and then the newest.
+    """
+    invoices = Invoice.objects.filter(
+        Q(invoice_number=text) | Q(po_number=text),
+    ).order_by('-invoice_date_received').values(
+        'id',
+        'invoice_number',
+        'po_number',
+        'status',
+        'taxpayer_id',
+        'taxpayer__business_name',
+    )[:limit]
+    invoices = sorted(invoices, key=lambda invoice: invoice['invoice_number'] != text)
+    return [
+        {
+            'id': invoice['id'],
+            'invoice_number': invoice['invoice_number'],
+            'po_number': invoice['po_number'],
+            'status': str(INVOICE_STATUSES_DICT.get(invoice['status'], invoice['status'])),
+            'taxpayer': invoice['taxpayer__business_name'],
+            'url': reverse('invoices-detail', kwargs={'taxpayer_id': invoice['taxpayer_id'], 'pk': invoice['id']}),
+        }
+        for invoice in invoices
+    ]
+
+
+def get_search_results(text, limit=SEARCH_RESULTS_LIMIT):
+    text = text.strip()
+    if not text:
+        return {'query': text, 'taxpayers': [], 'companies': [], 'invoices': []}
+    return {
+        'query': text,
+        'taxpayers': search_taxpayers(text, limit),
+        'companies': search_companies(text, limit),
+        'invoices': search_invoices(text, limit),
+    }
@@ -0,0 +1,128 @@
+from datetime import timedelta
+import logging
+from tempfile import TemporaryFile
+
+from celery import shared_task
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.http import QueryDict
+from django.utils import timezone
+
+from invoices_app import (
+    EXPORT_JOB_EXPIRE_SECONDS,
+    EXPORT_JOB_STATUS_DONE,
+    EXPORT_JOB_STATUS_FAILED,
+    EXPORT_JOB_STATUS_PENDING,
+    EXPORT_JOB_STATUS_RUNNING,
+)
+from invoices_app.exports import get_export
+from invoices_app.models import ExportJob
+from utils.reports import write_xls
+
+logger = logging.getLogger(__name__)
+
+
+def start_export_job(user, kind, querydict):
+    """
+    Create an export job for the given filter querystring.
+
+    If the user is already exporting the same filters and data, that job is
+    returned instead. If they were already exported and the data did not
+    change since then, the new job reuses that file and is finished right
+    away. Otherwise the report is built by run_export_job in the celery
+    worker.
+    """
+    export = get_export(kind)
+    cache_key = export.get_cache_key(export.get_filterset(querydict))
+    now = timezone.now()
+    running_job = ExportJob.objects.filter(
+        kind=kind,
+        user=user,
+        cache_key=cache_key,
+        status__in=[EXPORT_JOB_STATUS_PENDING, EXPORT_JOB_STATUS_RUNNING],
+        created_at__gte=now - timedelta(seconds=EXPORT_JOB_EXPIRE_SECONDS),
+    ).order_by('-id').first()
+    if running_job:
+        return running_job
+    export_job = ExportJob.objects.create(
+        kind=kind,
+        user=user,
+        querystring=querydict.urlencode(),
+        cache_key=cache_key,
+    )
+    # Only files in the first half of their life are reused, so
+    # expire_export_jobs can not delete one while a new job takes it
+    cached_job = ExportJob.objects.filter(
+        kind=kind,
+        cache_key=cache_key,
+        status=EXPORT_JOB_STATUS_DONE,
+        created_at__gte=now - timedelta(seconds=EXPORT_JOB_EXPIRE_SECONDS / 2),
+    ).exclude(result_file='').order_by('-finished_at').first()
+    if cached_job:
+        export_job.status = EXPORT_JOB_STATUS_DONE
+        export_job.progress = 100
+        export_job.row_count = cached_job.row_count
+        export_job.result_file = cached_job.result_file.name
+        export_job.finished_at = timezone.now()
+        export_job.save()
+    else:
+        run_export_job.apply_async([export_job.id])
+    return export_job
+
+
+@shared_task(ignore_result=True)
+def run_export_job(export_job_id):
+    export_job = ExportJob.objects.get(pk=export_job_id)
+    export = get_export(export_job.kind)
+    params = export.get_params(export.get_filterset(QueryDict(export_job.querystring)))
+    row_count = params.model.count()
+    ExportJob.objects.filter(pk=export_job.id).update(
+        status=EXPORT_JOB_STATUS_RUNNING,
+        row_count=row_count,
+    )
+
+    def update_progress(rows_written):
+        progress = int(rows_written * 100 / row_count) if row_count else 100
+        ExportJob.objects.filter(pk=export_job.id).update(progress=min(progress, 100))
+
+    try:
+        with TemporaryFile() as xls_file:
+            rows_written = write_xls(params, xls_file, update_progress)
+            xls_file.seek(0)
+            export_job.result_file.save(
+                '{}-{}.xlsx'.format(export.file_name, export_job.cache_key),
+                File(xls_file),
+                save=False,
+            )
+    except Exception:
+        ExportJob.objects.filter(pk=export_job.id).update(
+            status=EXPORT_JOB_STATUS_FAILED,
+            finished_at=timezone.now(),
+        )
+        raise
+    ExportJob.objects.filter(pk=export_job.id).update(
+        status=EXPORT_JOB_STATUS_DONE,
+        progress=100,
+        row_count=rows_written,
+        result_file=export_job.result_file.name,
+        finished_at=timezone.now(),
+    )
+
+
+@shared_task(ignore_result=True)
+def expire_export_jobs():
+    """
+    Delete the export jobs older than EXPORT_JOB_EXPIRE_SECONDS, and their
+    files once no newer job reusing them is left.
+    """
+    expired_jobs = ExportJob.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=EXPORT_JOB_EXPIRE_SECONDS),
+    )
+    file_names = set(expired_jobs.exclude(result_file='').values_list('result_file', flat=True))
+    deleted, _ = expired_jobs.delete()
+    file_names.difference_update(
+        ExportJob.objects.filter(result_file__in=file_names).values_list('result_file', flat=True)
+    )
+    for file_name in file_names:
+        default_storage.delete(file_name)
+    logger.info('Deleted %s expired export jobs and %s files', deleted, len(file_names))
@@ -0,0 +1,19 @@
+from django import template
+from django.utils.html import format_html
+
+from utils.invoice_lookup import get_invoice_status
+
+register = template.Library()
+
+
+@register.simple_tag
+def invoice_status_badge(code):
+    """Badge with the label of the status code, empty for unknown codes"""
+    invoice_status = get_invoice_status(code)
+    if invoice_status is None:
+        return ''
+    return format_html(
+        '<span class="badge {}">{}</span>',
+        invoice_status.badge,
+        invoice_status.label,
+    )
@@ -2,10 +2,8 @@ from os import (
     path,
     remove
 )
-from unittest.mock import MagicMock
-
 from django.contrib.auth.models import Group
-from django.core.files import File
+from django.core.cache import cache
 from django.test import (
     Client,
     TestCase
@@ -14,6 +12,7 @@ from django.core import mail
 from invoices_app.factory_boy import InvoiceFactory
 
 from supplier_app.constants.taxpayer_status import TAXPAYER_STATUS_APPROVED
+from supplier_app.tests import get_pdf_file_mock
 from supplier_app.tests.factory_boy import (
     AddressFactory,
     CompanyFactory,
@@ -30,6 +29,7 @@ from users_app.models import User
 class TestBase(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.ap_user = User.objects.create_user(email='ap@eventbrite.com')
         self.ap_group = Group.objects.get(name='ap_administrator')
         self.ap_user.groups.add(self.ap_group)
@@ -69,7 +69,7 @@ class TestBase(TestCase):
         self.taxpayer_post_data = TaxPayerArgentinaFactory(company=self.company_user_post_data)
 
         self.invoice_creation_empty_data = {}
-        self.file_mock = MagicMock(spec=File)
+        self.file_mock = get_pdf_file_mock()
         self.file_mock.name = 'lalaland.pdf'
         self.file_mock.size = 50
 
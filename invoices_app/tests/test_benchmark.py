@@ -0,0 +1,83 @@
+from io import StringIO
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from invoices_app.models import Invoice, InvoiceChange
+from supplier_app.models import (
+    Address,
+    BankAccount,
+    Company,
+    ContactInformation,
+    InvitingBuyer,
+    TaxPayer,
+    TaxPayerArgentina,
+    TaxPayerSummary,
+)
+from supplier_app.tests import use_temp_media_root
+from utils.benchmark import BenchmarkDataGenerator
+
+
+@override_settings(QUERY_BUDGETS={})
+class TestBenchmark(TestCase):
+
+    def _generate(self, **kwargs):
+        options = {'companies': 3, 'taxpayers': 5, 'invoices': 20, 'invoice_updates': 2}
+        options.update(kwargs)
+        BenchmarkDataGenerator(**options).generate()
+
+    def test_generate_creates_requested_volumes(self):
+        self._generate()
+        self.assertEqual(Company.objects.count(), 3)
+        self.assertEqual(InvitingBuyer.objects.count(), 3)
+        self.assertEqual(TaxPayerArgentina.objects.count(), 5)
+        self.assertEqual(TaxPayerSummary.objects.count(), 5)
+        self.assertEqual(Address.objects.count(), 5)
+        self.assertEqual(ContactInformation.objects.count(), 5)
+        self.assertEqual(BankAccount.objects.count(), 5)
+        self.assertEqual(Invoice.objects.count(), 20)
+
+    def test_generate_creates_history(self):
+        self._generate()
+        self.assertEqual(TaxPayer.history.count(), 5)
+        self.assertEqual(TaxPayerArgentina.history.count(), 5)
+        self.assertEqual(Invoice.history.filter(history_type='+').count(), 20)
+        self.assertEqual(Invoice.history.filter(history_type='~').count(), 40)
+
+    def test_generate_twice_adds_to_existing_data(self):
+        self._generate()
+        self._generate(seed=1)
+        self.assertEqual(TaxPayerArgentina.objects.count(), 10)
+        self.assertEqual(Invoice.objects.count(), 40)
+        # Sequences were moved past the generated ids
+        Company.objects.create(name='Company', description='Created after the benchmark data')
+
+    def test_benchmark_command_writes_report(self):
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+        use_temp_media_root(self)
+        call_command(
+            'benchmark',
+            companies=2,
+            taxpayers=3,
+            invoices=10,
+            repeat=1,
+            output=output.name,
+            stderr=StringIO(),
+        )
+        with open(output.name) as report_file:
+            report = json.load(report_file)
+        self.assertTrue(InvoiceChange.objects.exists())
+        self.assertEqual(report['repeat'], 1)
+        self.assertEqual(
+            {name: result.get('status_code') for name, result in report['results'].items()},
+            {name: 200 for name in report['results']},
+        )
+        self.assertIn('invoices-detail', report['results'])
+        self.assertIn('pdf-web', report['results'])
+        self.assertIn('p50_ms', report['results']['invoices-list'])
+        self.assertTrue(report['plans']['invoices-by-status'])
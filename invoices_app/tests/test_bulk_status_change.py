@@ -0,0 +1,161 @@
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from invoices_app import (
+    INVOICE_STATUS_APPROVED_CODE,
+    INVOICE_STATUS_CHANGES_REQUEST_CODE,
+    INVOICE_STATUS_IN_PROGRESS_CODE,
+    INVOICE_STATUS_PAID_CODE,
+    INVOICE_STATUS_PENDING_CODE,
+    INVOICE_STATUS_REJECTED_CODE,
+)
+from invoices_app.change_status_strategy import validate_bulk_status_change
+from invoices_app.factory_boy import InvoiceFactory
+from invoices_app.models import Invoice, InvoiceChange
+from invoices_app.tests.test_base import TestBase
+from supplier_app.tasks import drain_email_outbox
+from supplier_app.tests.factory_boy import CompanyUserPermissionFactory
+from users_app.factory_boy import UserFactory
+
+
+class TestBulkChangeInvoiceStatus(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('bulk-change-invoice-status')
+        self.client.force_login(self.ap_user)
+        self.invoices = [self.invoice] + [
+            InvoiceFactory(user=self.user, taxpayer=self.taxpayer, invoice_number='bulk-{}'.format(number))
+            for number in range(2)
+        ]
+
+    def _post(self, invoices, status, **kwargs):
+        data = {'invoices': [invoice.id for invoice in invoices], 'status': status}
+        data.update(kwargs)
+        return self.client.post(self.url, data)
+
+    def _get_statuses(self, invoices):
+        invoices = Invoice.objects.filter(id__in=[invoice.id for invoice in invoices]).order_by('id')
+        return list(invoices.values_list('status', flat=True))
+
+    def _get_workday_ids(self, invoices, prefix='WD'):
+        return {
+            'workday_id_{}'.format(invoice.id): '{}-{}'.format(prefix, invoice.id)
+            for invoice in invoices
+        }
+
+    def test_bulk_change_to_in_progress_sets_workday_ids(self):
+        response = self._post(self.invoices, INVOICE_STATUS_IN_PROGRESS_CODE, **self._get_workday_ids(self.invoices))
+        self.assertRedirects(response, reverse('invoices-list'), fetch_redirect_response=False)
+        for invoice in Invoice.objects.filter(id__in=[invoice.id for invoice in self.invoices]):
+            self.assertEqual(invoice.status, INVOICE_STATUS_IN_PROGRESS_CODE)
+            self.assertEqual(invoice.workday_id, 'WD-{}'.format(invoice.id))
+
+    def test_bulk_change_writes_history_and_change_log(self):
+        self._post(self.invoices, INVOICE_STATUS_REJECTED_CODE)
+        for invoice in self.invoices:
+            record = Invoice.history.filter(id=invoice.id).latest('history_date')
+            self.assertEqual(record.history_type, '~')
+            self.assertEqual(record.status, INVOICE_STATUS_REJECTED_CODE)
+            self.assertEqual(record.history_user, self.ap_user)
+            change = InvoiceChange.objects.get(history_id=record.history_id)
+            self.assertEqual(change.user, self.ap_user)
+            self.assertEqual(
+                change.get_changes(),
+                [['status', INVOICE_STATUS_PENDING_CODE, INVOICE_STATUS_REJECTED_CODE]],
+            )
+
+    def test_bulk_request_changes_keeps_the_comment(self):
+        self._post(self.invoices, INVOICE_STATUS_CHANGES_REQUEST_CODE, message='Fix the amounts')
+        self.assertEqual(self._get_statuses(self.invoices), [INVOICE_STATUS_CHANGES_REQUEST_CODE] * 3)
+        self.assertEqual(
+            set(InvoiceChange.objects.filter(invoice__in=self.invoices).values_list('change_reason', flat=True)),
+            {'Fix the amounts'},
+        )
+
+    def test_bulk_change_validates_every_invoice_before_changing_any(self):
+        Invoice.objects.filter(id=self.invoice.id).update(status=INVOICE_STATUS_APPROVED_CODE)
+        response = self._post(self.invoices, INVOICE_STATUS_PAID_CODE)
+        self.assertEqual(
+            [str(message) for message in get_messages(response.wsgi_request)],
+            [
+                'Invoice #bulk-0 can not be changed from PENDING to PAID',
+                'Invoice #bulk-1 can not be changed from PENDING to PAID',
+            ],
+        )
+        self.assertEqual(
+            self._get_statuses(self.invoices),
+            [INVOICE_STATUS_APPROVED_CODE, INVOICE_STATUS_PENDING_CODE, INVOICE_STATUS_PENDING_CODE],
+        )
+        self.assertFalse(InvoiceChange.objects.filter(invoice__in=self.invoices).exists())
+
+    def test_bulk_change_rejects_repeated_and_taken_workday_ids(self):
+        InvoiceFactory(user=self.user, taxpayer=self.taxpayer, invoice_number='taken', workday_id='WD-taken')
+        workday_ids = {
+            'workday_id_{}'.format(self.invoices[0].id): 'WD-taken',
+            'workday_id_{}'.format(self.invoices[1].id): 'WD-repeated',
+            'workday_id_{}'.format(self.invoices[2].id): 'WD-repeated',
+        }
+        response = self._post(self.invoices, INVOICE_STATUS_IN_PROGRESS_CODE, **workday_ids)
+        self.assertEqual(
+            [str(message) for message in get_messages(response.wsgi_request)],
+            ['Workday ID WD-repeated already exist', 'Workday ID WD-taken already exist'],
+        )
+        self.assertEqual(self._get_statuses(self.invoices), [INVOICE_STATUS_PENDING_CODE] * 3)
+
+    def test_validate_bulk_status_change_checks_the_locked_rows(self):
+        invoices = list(Invoice.objects.filter(id__in=[invoice.id for invoice in self.invoices]).order_by('id'))
+        # Changed by a concurrent request after the invoices were read
+        Invoice.objects.filter(id=invoices[0].id).update(status=INVOICE_STATUS_APPROVED_CODE)
+        InvoiceFactory(user=self.user, taxpayer=self.taxpayer, invoice_number='concurrent', workday_id='WD-1')
+        workday_ids = {invoice.id: 'WD-{}'.format(number) for number, invoice in enumerate(invoices)}
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                errors = validate_bulk_status_change(invoices, INVOICE_STATUS_IN_PROGRESS_CODE, workday_ids)
+        self.assertEqual(
+            errors,
+            [
+                'Invoice #{} can not be changed from APPROVED to IN PROGRESS'.format(self.invoice.invoice_number),
+                'Workday ID WD-1 already exist',
+            ],
+        )
+        self.assertEqual(invoices[0].status, INVOICE_STATUS_APPROVED_CODE)
+        self.assertEqual(len([query for query in queries if 'invoices_app_invoice' in query['sql']]), 1)
+
+    def test_bulk_change_sends_one_email_per_user_of_each_company(self):
+        CompanyUserPermissionFactory(company=self.company, user=UserFactory())
+        invoice_other_company = self.invoice_from_other_user
+        self._post(self.invoices + [invoice_other_company], INVOICE_STATUS_REJECTED_CODE)
+        drain_email_outbox()
+        self.assertEqual(len(mail.outbox), 3)
+        recipients = sorted(email.to[0] for email in mail.outbox)
+        self.assertIn(self.user.email, recipients)
+        self.assertIn(self.other_user.email, recipients)
+        email = [email for email in mail.outbox if email.to == [self.user.email]][0]
+        for invoice in self.invoices:
+            self.assertIn('#{}'.format(invoice.invoice_number), email.body)
+        self.assertNotIn(invoice_other_company.invoice_number, email.body)
+
+    def test_bulk_change_query_count_does_not_depend_on_invoices(self):
+        with CaptureQueriesContext(connection) as few_invoices:
+            self._post(self.invoices[:1], INVOICE_STATUS_IN_PROGRESS_CODE, **self._get_workday_ids(self.invoices[:1]))
+        more_invoices = [
+            InvoiceFactory(user=self.user, taxpayer=self.taxpayer, invoice_number='more-{}'.format(number))
+            for number in range(10)
+        ]
+        with CaptureQueriesContext(connection) as many_invoices:
+            self._post(more_invoices, INVOICE_STATUS_IN_PROGRESS_CODE, **self._get_workday_ids(more_invoices))
+        self.assertEqual(len(few_invoices.captured_queries), len(many_invoices.captured_queries))
+
+    def test_bulk_change_invalid_status(self):
+        response = self._post(self.invoices, 'NOT_STATUS')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_change_only_ap(self):
+        self.client.force_login(self.user)
+        response = self._post(self.invoices, INVOICE_STATUS_REJECTED_CODE)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self._get_statuses(self.invoices), [INVOICE_STATUS_PENDING_CODE] * 3)
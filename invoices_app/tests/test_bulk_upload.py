@@ -0,0 +1,182 @@
+import csv
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+import zipfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from invoices_app import (
+    INVOICE_BULK_UPLOAD_COLUMNS,
+    INVOICE_BULK_UPLOAD_CREATED,
+    INVOICE_BULK_UPLOAD_DUPLICATED,
+    INVOICE_BULK_UPLOAD_INVALID,
+    INVOICE_MAX_SIZE_FILE,
+)
+from invoices_app.bulk_upload import check_invoice_files
+from invoices_app.models import Invoice
+from invoices_app.tests.test_base import TestBase
+from supplier_app.constants.taxpayer_status import TAXPAYER_STATUS_PENDING
+from supplier_app.tests import get_pdf_content, use_temp_media_root
+from supplier_app.tests.factory_boy import TaxPayerEBEntityFactory
+
+
+class TestInvoiceBulkUpload(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        use_temp_media_root(self)
+        self.eb_entity = TaxPayerEBEntityFactory(taxpayer=self.taxpayer).eb_entity
+        self.url = reverse('invoice-bulk-upload', kwargs={'taxpayer_id': self.taxpayer.id})
+        self.client.force_login(self.user)
+
+    def _get_row(self, invoice_number, **kwargs):
+        row = {
+            'invoice_number': invoice_number,
+            'po_number': '98876',
+            'invoice_date': '2019-10-01',
+            'currency': 'ARS',
+            'net_amount': '4000',
+            'vat': '840',
+            'total_amount': '4840',
+            'eb_entity': self.eb_entity.eb_name,
+            'invoice_file': 'invoice-{}.pdf'.format(invoice_number),
+        }
+        row.update(kwargs)
+        return row
+
+    def _get_archive(self, rows, files=None, manifest_name='invoices.csv'):
+        if files is None:
+            files = {row['invoice_file']: get_pdf_content() for row in rows}
+        manifest = StringIO()
+        writer = csv.DictWriter(manifest, fieldnames=INVOICE_BULK_UPLOAD_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr(manifest_name, manifest.getvalue())
+            for name, content in files.items():
+                zip_file.writestr(name, content)
+        return SimpleUploadedFile('invoices.zip', archive.getvalue(), 'application/zip')
+
+    def _upload(self, archive):
+        return self.client.post(self.url, {'archive': archive})
+
+    def _get_results(self, response):
+        return [(result['invoice_number'], result['result']) for result in response.context['report']]
+
+    def test_upload_creates_invoices_with_history(self):
+        response = self._upload(self._get_archive([self._get_row('A-1'), self._get_row('A-2')]))
+        self.assertEqual(
+            self._get_results(response),
+            [('A-1', INVOICE_BULK_UPLOAD_CREATED), ('A-2', INVOICE_BULK_UPLOAD_CREATED)],
+        )
+        invoice = Invoice.objects.get(taxpayer=self.taxpayer, invoice_number='A-1')
+        self.assertEqual(invoice.user, self.user)
+        self.assertEqual(invoice.invoice_eb_entity, self.eb_entity)
+        self.assertEqual(invoice.invoice_due_date, date(2019, 10, 1) + timedelta(days=self.taxpayer.payment_term))
+        self.assertTrue(invoice.invoice_file.name.startswith('file/invoice-A-1'))
+        self.assertEqual(invoice.invoice_file.read(), get_pdf_content())
+        history = invoice.history.get()
+        self.assertEqual(history.history_type, '+')
+        self.assertEqual(history.history_user, self.user)
+
+    def test_upload_skips_duplicated_invoice_numbers(self):
+        response = self._upload(self._get_archive([
+            self._get_row(self.invoice.invoice_number),
+            self._get_row('A-1'),
+            self._get_row('A-1', invoice_file='other.pdf'),
+        ]))
+        self.assertEqual(
+            self._get_results(response),
+            [
+                (self.invoice.invoice_number, INVOICE_BULK_UPLOAD_DUPLICATED),
+                ('A-1', INVOICE_BULK_UPLOAD_CREATED),
+                ('A-1', INVOICE_BULK_UPLOAD_DUPLICATED),
+            ],
+        )
+        self.assertEqual(Invoice.objects.filter(taxpayer=self.taxpayer).count(), 2)
+
+    def test_upload_reports_invalid_rows(self):
+        rows = [
+            self._get_row('A-1', total_amount='0'),
+            self._get_row('A-2', eb_entity='Unknown entity'),
+            self._get_row('A-3', invoice_file='missing.pdf'),
+            self._get_row('A-4'),
+            self._get_row('A-5', invoice_file='invoice.txt'),
+        ]
+        files = {
+            'invoice-A-1.pdf': get_pdf_content(),
+            'invoice-A-2.pdf': get_pdf_content(),
+            'invoice-A-4.pdf': b'%PDF-1.4 broken',
+            'invoice.txt': b'text',
+        }
+        response = self._upload(self._get_archive(rows, files))
+        report = response.context['report']
+        self.assertEqual([result['result'] for result in report], [INVOICE_BULK_UPLOAD_INVALID] * 5)
+        self.assertEqual([result['line'] for result in report], [2, 3, 4, 5, 6])
+        self.assertIn('total_amount', report[0]['errors'][0])
+        self.assertIn('Unknown entity', report[1]['errors'][0])
+        self.assertIn('missing.pdf', report[2]['errors'][0])
+        self.assertEqual(report[3]['errors'], ['The file is not a valid PDF'])
+        self.assertEqual(report[4]['errors'], ['Only .pdf allowed'])
+        self.assertFalse(Invoice.objects.filter(invoice_number__startswith='A-').exists())
+
+    def test_upload_without_manifest(self):
+        response = self._upload(self._get_archive([self._get_row('A-1')], manifest_name='other.csv'))
+        self.assertFormError(response, 'form', 'archive', 'The ZIP archive has no invoices.csv file')
+
+    def test_upload_of_not_approved_taxpayer(self):
+        self.taxpayer.taxpayer_state = TAXPAYER_STATUS_PENDING
+        self.taxpayer.save()
+        response = self._upload(self._get_archive([self._get_row('A-1')]))
+        self.assertFormError(response, 'form', None, 'Taxpayer not approved yet')
+        self.assertFalse(Invoice.objects.filter(invoice_number='A-1').exists())
+
+    def test_upload_query_count_does_not_depend_on_rows(self):
+        # Every PDF is new, so each upload stores and indexes all of them
+        rows = [self._get_row('A-1')]
+        with CaptureQueriesContext(connection) as one_row:
+            self._upload(self._get_archive(rows, {row['invoice_file']: get_pdf_content(100) for row in rows}))
+        rows = [self._get_row('B-{}'.format(number)) for number in range(10)]
+        files = {row['invoice_file']: get_pdf_content(200 + number) for number, row in enumerate(rows)}
+        with CaptureQueriesContext(connection) as many_rows:
+            self._upload(self._get_archive(rows, files))
+        self.assertEqual(len(one_row.captured_queries), len(many_rows.captured_queries))
+
+    def test_other_supplier_can_not_upload(self):
+        self.client.force_login(self.other_user)
+        response = self._upload(self._get_archive([self._get_row('A-1')]))
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(INVOICE_BULK_UPLOAD_WORKERS=2)
+    def test_check_invoice_files_in_process_pool(self):
+        self.assertEqual(
+            [[str(error) for error in errors] for errors in check_invoice_files([
+                ('invoice.pdf', get_pdf_content()),
+                ('broken.pdf', b'broken'),
+                ('big.pdf', b'0' * INVOICE_MAX_SIZE_FILE),
+            ])],
+            [[], ['The file is not a valid PDF'], ['The file size is greater than 5MB.']],
+        )
+
+    def test_upload_warns_of_pdfs_of_other_invoices(self):
+        rows = [self._get_row('A-1'), self._get_row('A-2'), self._get_row('A-3')]
+        files = {
+            rows[0]['invoice_file']: get_pdf_content(),
+            rows[1]['invoice_file']: get_pdf_content(),
+            rows[2]['invoice_file']: get_pdf_content(100),
+        }
+        response = self._upload(self._get_archive(rows, files))
+        self.assertEqual(
+            [result['warnings'] for result in response.context['report']],
+            [
+                ['The PDF of invoice #A-1 was already uploaded with invoice #A-2'],
+                ['The PDF of invoice #A-2 was already uploaded with invoice #A-1'],
+                [],
+            ],
+        )
+        self.assertContains(response, 'The PDF of invoice #A-1 was already uploaded with invoice #A-2')
@@ -380,7 +380,8 @@ class CommentsTest(TestBase):
         ('test.pdf', 5242881, [
             'The file size is greater than {}MB.'.format(int(INVOICE_MAX_SIZE_FILE/(1024*1024)))]),
         ('test.xml', 5242881, [
-            'Only .pdf allowed', 'The file size is greater than {}MB.'.format(int(INVOICE_MAX_SIZE_FILE/(1024*1024)))])
+            'Only .pdf allowed', 'The file size is greater than {}MB.'.format(int(INVOICE_MAX_SIZE_FILE/(1024*1024)))]),
+        ('test.pdf', 20, ['The file is not a valid PDF']),
     ])
     def test_supplier_adds_an_invalid_file_in_a_comment(
         self,
@@ -412,7 +413,8 @@ class CommentsTest(TestBase):
     @parameterized.expand([
         ('test.xml', 20,),
         ('test.pdf', 5242881,),
-        ('test.xml', 5242881,)
+        ('test.xml', 5242881,),
+        ('test.pdf', 20,),
     ])
     def test_supplier_adds_an_invalid_file_in_a_comment_and_no_comment_is_created(
         self,
@@ -1,10 +1,13 @@
 from http import HTTPStatus
 
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.http import HttpResponseRedirect
+from django.test import override_settings
 from django.urls import reverse
 
-from invoices_app.models import Invoice
+from invoices_app.models import Comment, Invoice
 from invoices_app.tests.test_base import TestBase
+from supplier_app.tests import get_temp_dir, use_temp_media_root
 
 
 class DetailInvoiceTest(TestBase):
@@ -94,3 +97,63 @@ class DetailInvoiceTest(TestBase):
             )
         )
         self.assertFalse(Invoice.objects.get(pk=self.invoice.id).new_comment_from_ap)
+
+
+class InvoiceFileTest(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        use_temp_media_root(self)
+        self.invoice.invoice_file = SimpleUploadedFile('invoice.pdf', b'%PDF invoice')
+        self.invoice.save()
+        self.comment = Comment.objects.create(
+            user=self.user,
+            invoice=self.invoice,
+            message='Attached',
+            comment_file=SimpleUploadedFile('comment.pdf', b'%PDF comment'),
+        )
+        self.url = reverse('invoice-file', kwargs={'pk': self.invoice.id})
+
+    def test_supplier_gets_the_invoice_file(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF invoice')
+
+    def test_spooled_invoice_file_is_served_before_its_upload(self):
+        with override_settings(UPLOAD_SPOOL_DIR=get_temp_dir(self)):
+            self.invoice.invoice_file = SimpleUploadedFile('spooled.pdf', b'%PDF spooled')
+            self.invoice.save()
+            self.client.force_login(self.user)
+            response = self.client.get(self.url)
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF spooled')
+
+    def test_ap_gets_part_of_the_invoice_file(self):
+        self.client.force_login(self.ap_user)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-3')
+        self.assertEqual(HTTPStatus.PARTIAL_CONTENT, response.status_code)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+
+    def test_other_supplier_can_not_get_the_invoice_file(self):
+        self.client.force_login(self.other_user)
+        response = self.client.get(self.url)
+        self.assertEqual(HTTPStatus.FORBIDDEN, response.status_code)
+
+    def test_supplier_gets_the_comment_file(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse(
+            'invoice-comment-file',
+            kwargs={'pk': self.invoice.id, 'comment_id': self.comment.id},
+        ))
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF comment')
+
+    def test_comment_of_other_invoice_is_not_found(self):
+        self.client.force_login(self.ap_user)
+        response = self.client.get(reverse(
+            'invoice-comment-file',
+            kwargs={'pk': self.invoice_from_other_user.id, 'comment_id': self.comment.id},
+        ))
+        self.assertEqual(HTTPStatus.NOT_FOUND, response.status_code)
@@ -0,0 +1,159 @@
+from datetime import timedelta
+from http import HTTPStatus
+from io import BytesIO
+from unittest.mock import patch
+
+from django.core.files.storage import default_storage
+from django.http import QueryDict
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from invoices_app import (
+    EXPORT_JOB_EXPIRE_SECONDS,
+    EXPORT_JOB_INVOICES,
+    EXPORT_JOB_STATUS_DONE,
+    EXPORT_JOB_STATUS_PENDING,
+    INVOICE_STATUS_PENDING,
+    INVOICE_STATUS_REJECTED,
+)
+from invoices_app.exports import InvoiceExport
+from invoices_app.models import ExportJob
+from invoices_app.tasks import expire_export_jobs
+from invoices_app.tests.test_base import TestBase
+from supplier_app.tests import use_temp_media_root
+from utils.invoice_lookup import invoice_status_lookup
+from utils.reports import normalize_filter_params
+
+
+class TestExportJob(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        use_temp_media_root(self)
+        self.invoice_from_other_user.status = invoice_status_lookup(INVOICE_STATUS_REJECTED)
+        self.invoice_from_other_user.save()
+        self.pending_status = invoice_status_lookup(INVOICE_STATUS_PENDING)
+        self.pending_querystring = 'status={}'.format(self.pending_status)
+
+    def _create_job(self, querystring):
+        self.client.force_login(self.ap_user)
+        return self.client.get('{}?{}'.format(reverse('invoice-to-xls-job'), querystring))
+
+    def test_export_job_is_run_and_redirects_to_detail(self):
+        response = self._create_job(self.pending_querystring)
+        export_job = ExportJob.objects.get()
+        self.assertRedirects(response, reverse('export-job-detail', kwargs={'pk': export_job.id}))
+        self.assertEqual(export_job.kind, EXPORT_JOB_INVOICES)
+        self.assertEqual(export_job.status, EXPORT_JOB_STATUS_DONE)
+        self.assertEqual(export_job.row_count, 1)
+        self.assertEqual(export_job.progress, 100)
+        self.assertIsNotNone(export_job.finished_at)
+
+    def test_export_job_detail_returns_json_when_polling(self):
+        self._create_job(self.pending_querystring)
+        export_job = ExportJob.objects.get()
+        response = self.client.get(
+            reverse('export-job-detail', kwargs={'pk': export_job.id}),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.json(), {
+            'status': EXPORT_JOB_STATUS_DONE,
+            'progress': 100,
+            'row_count': 1,
+            'is_finished': True,
+            'download_url': reverse('export-job-download', kwargs={'pk': export_job.id}),
+        })
+
+    def test_export_job_download_contains_filtered_rows(self):
+        self._create_job(self.pending_querystring)
+        export_job = ExportJob.objects.get()
+        response = self.client.get(reverse('export-job-download', kwargs={'pk': export_job.id}))
+        self.assertTrue(response['Content-Disposition'].endswith('-Invoices.xlsx'))
+        rows = list(load_workbook(BytesIO(b''.join(response.streaming_content))).active.values)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][0], self.invoice.invoice_number)
+
+    def test_export_job_is_only_visible_to_its_owner(self):
+        self._create_job(self.pending_querystring)
+        export_job = ExportJob.objects.get()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('export-job-download', kwargs={'pk': export_job.id}))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_export_job_reuses_file_for_same_filters(self):
+        self._create_job(self.pending_querystring)
+        self._create_job('page=2&{}'.format(self.pending_querystring))
+        first_job, second_job = ExportJob.objects.order_by('id')
+        self.assertEqual(first_job.cache_key, second_job.cache_key)
+        self.assertEqual(second_job.status, EXPORT_JOB_STATUS_DONE)
+        self.assertEqual(second_job.result_file.name, first_job.result_file.name)
+
+    def test_export_job_cache_is_invalidated_when_invoices_change(self):
+        self._create_job(self.pending_querystring)
+        self.invoice.status = invoice_status_lookup(INVOICE_STATUS_REJECTED)
+        self.invoice.save()
+        self._create_job(self.pending_querystring)
+        first_job, second_job = ExportJob.objects.order_by('id')
+        self.assertNotEqual(first_job.cache_key, second_job.cache_key)
+        self.assertEqual(second_job.row_count, 0)
+
+    def test_export_job_is_pending_until_the_worker_runs_it(self):
+        self.client.force_login(self.ap_user)
+        with patch('invoices_app.tasks.run_export_job.apply_async') as apply_async:
+            self.client.get('{}?{}'.format(reverse('invoice-to-xls-job'), self.pending_querystring))
+        export_job = ExportJob.objects.get()
+        apply_async.assert_called_once_with([export_job.id])
+        self.assertEqual(export_job.status, EXPORT_JOB_STATUS_PENDING)
+
+    def test_export_job_being_run_is_reused(self):
+        with patch('invoices_app.tasks.run_export_job.apply_async') as apply_async:
+            first_response = self._create_job(self.pending_querystring)
+            second_response = self._create_job('page=2&{}'.format(self.pending_querystring))
+        export_job = ExportJob.objects.get()
+        apply_async.assert_called_once_with([export_job.id])
+        self.assertEqual(first_response.url, second_response.url)
+
+    def _expire(self, export_jobs):
+        created_at = timezone.now() - timedelta(seconds=EXPORT_JOB_EXPIRE_SECONDS + 1)
+        ExportJob.objects.filter(id__in=[export_job.id for export_job in export_jobs]).update(created_at=created_at)
+
+    def test_expire_export_jobs_deletes_old_jobs_and_their_files(self):
+        self._create_job(self.pending_querystring)
+        self._create_job('status={}'.format(invoice_status_lookup(INVOICE_STATUS_REJECTED)))
+        old_job, new_job = ExportJob.objects.order_by('id')
+        self._expire([old_job])
+        expire_export_jobs()
+        self.assertEqual(list(ExportJob.objects.all()), [new_job])
+        self.assertFalse(default_storage.exists(old_job.result_file.name))
+        self.assertTrue(default_storage.exists(new_job.result_file.name))
+
+    def test_expire_export_jobs_keeps_the_files_reused_by_newer_jobs(self):
+        self._create_job(self.pending_querystring)
+        self._create_job(self.pending_querystring)
+        old_job, new_job = ExportJob.objects.order_by('id')
+        self._expire([old_job])
+        expire_export_jobs()
+        self.assertEqual(list(ExportJob.objects.all()), [new_job])
+        self.assertTrue(default_storage.exists(new_job.result_file.name))
+
+    def test_normalize_filter_params_ignores_unknown_and_empty_params(self):
+        export = InvoiceExport()
+        filterset = export.get_filterset(
+            QueryDict('page=3&taxpayer__business_name=&status={}'.format(self.pending_status))
+        )
+        self.assertEqual(normalize_filter_params(filterset), {'status': [self.pending_status]})
+
+    def test_normalize_filter_params_keeps_the_valid_params_of_an_invalid_form(self):
+        export = InvoiceExport()
+        filterset = export.get_filterset(
+            QueryDict('status={}&invoice_date_after=garbage'.format(self.pending_status))
+        )
+        self.assertEqual(
+            normalize_filter_params(filterset),
+            {'status': [self.pending_status], '__errors__': ['invoice_date']},
+        )
+        self.assertNotEqual(
+            export.get_cache_key(filterset),
+            export.get_cache_key(export.get_filterset(QueryDict())),
+        )
@@ -1,11 +1,18 @@
 from datetime import date, timedelta
 from functools import reduce
 from http import HTTPStatus
+from io import BytesIO
+from openpyxl import load_workbook
 from parameterized import parameterized
+import factory
 from unittest.mock import patch
 
 
 from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.forms import Form
 from django.http import HttpRequest
@@ -15,11 +22,14 @@ from django.shortcuts import get_object_or_404
 from django.core import mail
 
 from supplier_app.constants.taxpayer_status import TAXPAYER_STATUS_PENDING
+from supplier_app.tasks import drain_email_outbox
+from supplier_app.tests import get_pdf_content, use_temp_media_root
 from supplier_app.tests.factory_boy import CompanyUserPermissionFactory
 from supplier_app.tests.factory_boy import TaxPayerEBEntityFactory
 from users_app.factory_boy import UserFactory
 
 from invoices_app import (
+    DEFAULT_NUMBER_PAGINATION,
     INVOICE_STATUS_APPROVED,
     INVOICE_STATUS_PENDING,
     INVOICE_STATUS_REJECTED,
@@ -39,6 +49,9 @@ from invoices_app.views import (
 )
 
 from utils.invoice_lookup import invoice_status_lookup
+from utils.send_email import build_mail_html
+
+INVOICE_LIST_QUERY_BUDGET = 13
 
 
 class TestInvoice(TestBase):
@@ -59,6 +72,22 @@ class TestInvoice(TestBase):
         )
         self.assertFalse(form.is_valid())
 
+    def test_invoice_form_rejects_repeated_workday_id(self):
+        self.invoice_from_other_user.workday_id = 'G-180'
+        self.invoice_from_other_user.save()
+        self.invoice_post_data['workday_id'] = 'G-180'
+        form = InvoiceForm(data=self.invoice_post_data, instance=self.invoice)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['workday_id'], ['Workday ID already exist'])
+
+    def test_invoice_form_keeps_own_workday_id(self):
+        self.invoice.workday_id = 'G-180'
+        self.invoice.save()
+        self.invoice_post_data['workday_id'] = 'G-180'
+        form = InvoiceForm(data=self.invoice_post_data, instance=self.invoice)
+        form.is_valid()
+        self.assertNotIn('workday_id', form.errors)
+
     @parameterized.expand([
         ('test.pdf', 20, True),
         ('test.xml', 20, False),
@@ -69,7 +98,7 @@ class TestInvoice(TestBase):
         form = InvoiceForm(
             data=self.invoice_post_data,
             files={
-                'invoice_file': SimpleUploadedFile(name_file, bytes(size_file)),
+                'invoice_file': SimpleUploadedFile(name_file, get_pdf_content() + bytes(size_file)),
             }
         )
         self.assertEqual(form.is_valid(), expected)
@@ -698,12 +727,12 @@ class TestInvoice(TestBase):
         request.user = self.user
 
         # When an email is sent when changing invoice status
-        with patch('invoices_app.views._send_email') as patch_send_email:
+        with patch('invoices_app.views.queue_email_messages') as patch_send_email:
             _send_email_when_change_invoice_status(request, self.invoice)
 
         # Then an email must be sent to user in his languages preferences
-        params, _ = patch_send_email.call_args
-        subject = params[0]
+        (messages, _change), _ = patch_send_email.call_args
+        subject, html_message, _ = messages[0]
 
         self.assertEqual(
             subject,
@@ -713,6 +742,32 @@ class TestInvoice(TestBase):
             )
         )
 
+    def test_send_email_when_change_invoice_status_renders_once_per_language(self):
+        self.invoice.status = '5'
+        self.user.preferred_language = 'es'
+        self.user.save()
+        for language in ('es', 'en'):
+            CompanyUserPermissionFactory(
+                company=self.company,
+                user=UserFactory(preferred_language=language),
+            )
+        request = HttpRequest()
+        request.user = self.ap_user
+
+        with patch('invoices_app.views.build_mail_html', wraps=build_mail_html) as patch_build_mail_html:
+            _send_email_when_change_invoice_status(request, self.invoice)
+        drain_email_outbox()
+
+        self.assertEqual(patch_build_mail_html.call_count, 2)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertTrue(all(len(email.to) == 1 for email in mail.outbox))
+        subjects = sorted(email.subject for email in mail.outbox)
+        self.assertEqual(subjects, sorted([
+            'La factura #{} para Eventbrite ha sido pagada'.format(self.invoice.invoice_number),
+            'La factura #{} para Eventbrite ha sido pagada'.format(self.invoice.invoice_number),
+            'Your invoice #{} for Eventbrite has been paid'.format(self.invoice.invoice_number),
+        ]))
+
     @parameterized.expand([
         ('en', ),
         ('es', ),
@@ -739,7 +794,7 @@ class TestInvoice(TestBase):
         request.user = self.logged_user
 
         # When an email is sent when changing invoice status
-        with patch('invoices_app.views._send_email'):
+        with patch('invoices_app.views.queue_email_messages'):
             _send_email_when_change_invoice_status(request, self.invoice)
 
         # Then session language of the logged user remain
@@ -771,12 +826,12 @@ class TestInvoice(TestBase):
         request.user = self.user
 
         # When an email is sent when posting a comment
-        with patch('invoices_app.views._send_email') as patch_send_email:
+        with patch('invoices_app.views.queue_email_messages') as patch_send_email:
             _send_email_when_posting_a_comment(request, self.invoice)
 
         # Then an email must be sent to user in his languages preferences
-        params, _ = patch_send_email.call_args
-        subject = params[0]
+        (messages, _change), _ = patch_send_email.call_args
+        subject, html_message, _ = messages[0]
 
         self.assertEqual(
             subject,
@@ -785,7 +840,7 @@ class TestInvoice(TestBase):
             )
         )
         self.assertTrue(
-            message.format(self.invoice.invoice_number, message) in params[1]
+            message.format(self.invoice.invoice_number, message) in html_message
         )
 
     @parameterized.expand([
@@ -815,7 +870,7 @@ class TestInvoice(TestBase):
         request.user = self.logged_user
 
         # When an email is sent when posting a comment
-        with patch('invoices_app.views._send_email'):
+        with patch('invoices_app.views.queue_email_messages'):
             _send_email_when_posting_a_comment(request, self.invoice)
 
         # Then session language of the logged user remain
@@ -828,6 +883,83 @@ class TestInvoice(TestBase):
         )
         self.assertTrue(response._headers['content-disposition'][1].endswith('.xlsx'))
 
+    def test_invoice_export_to_xls_is_streamed_with_filtered_rows(self):
+        self.client.force_login(self.ap_user)
+        self.invoice_from_other_user.status = invoice_status_lookup(INVOICE_STATUS_REJECTED)
+        self.invoice_from_other_user.save()
+        response = self.client.get(
+            '{}?status={}'.format(
+                reverse('invoice-to-xls'),
+                invoice_status_lookup(INVOICE_STATUS_PENDING),
+            )
+        )
+        self.assertTrue(response.streaming)
+        worksheet = load_workbook(BytesIO(b''.join(response.streaming_content))).active
+        rows = list(worksheet.values)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][:4], ('Invoice Number', 'Invoice Date', 'Status', 'Tax Payer'))
+        invoice_number, _, status, taxpayer_name = rows[1][:4]
+        self.assertEqual(invoice_number, self.invoice.invoice_number)
+        self.assertEqual(status, INVOICE_STATUS_PENDING)
+        self.assertEqual(taxpayer_name, self.taxpayer.business_name)
+
+    def _count_invoice_list_queries(self, user):
+        self.client.force_login(user)
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('invoices-list'))
+        return len(context.captured_queries), len(response.context['object_list'])
+
+    @parameterized.expand([
+        ('ap_user', ),
+        ('user', ),
+    ])
+    def test_invoice_list_query_count_does_not_depend_on_page_length(self, user_attr):
+        user = getattr(self, user_attr)
+        short_page_queries, short_page_length = self._count_invoice_list_queries(user)
+        InvoiceFactory.create_batch(
+            DEFAULT_NUMBER_PAGINATION,
+            user=self.user,
+            taxpayer=self.taxpayer,
+            invoice_number=factory.Sequence(lambda n: 'list-{}'.format(n)),
+        )
+        full_page_queries, full_page_length = self._count_invoice_list_queries(user)
+        self.assertLess(short_page_length, full_page_length)
+        self.assertEqual(short_page_queries, full_page_queries)
+        self.assertLessEqual(full_page_queries, INVOICE_LIST_QUERY_BUDGET)
+
+    def test_invoice_list_keyset_pagination_keeps_filters(self):
+        self.client.force_login(self.ap_user)
+        self.invoice_from_other_user.status = invoice_status_lookup(INVOICE_STATUS_REJECTED)
+        self.invoice_from_other_user.save()
+        InvoiceFactory.create_batch(
+            DEFAULT_NUMBER_PAGINATION + 2,
+            user=self.user,
+            taxpayer=self.taxpayer,
+            invoice_number=factory.Sequence(lambda n: 'page-{}'.format(n)),
+        )
+        pending_ids = list(Invoice.objects.filter(
+            status=invoice_status_lookup(INVOICE_STATUS_PENDING),
+        ).order_by('invoice_date_received', 'id').values_list('id', flat=True))
+        url = reverse('invoices-list')
+
+        first_page = self.client.get(url, {'status': invoice_status_lookup(INVOICE_STATUS_PENDING)})
+        page_obj = first_page.context['page_obj']
+        self.assertEqual(page_obj.count, len(pending_ids))
+        self.assertIsNone(page_obj.previous_querystring)
+        self.assertEqual([invoice.id for invoice in page_obj], pending_ids[:DEFAULT_NUMBER_PAGINATION])
+
+        second_page = self.client.get('{}?{}'.format(url, page_obj.next_querystring))
+        page_obj = second_page.context['page_obj']
+        self.assertIsNone(page_obj.next_querystring)
+        self.assertEqual([invoice.id for invoice in page_obj], pending_ids[DEFAULT_NUMBER_PAGINATION:])
+
+        previous_page = self.client.get('{}?{}'.format(url, page_obj.previous_querystring))
+        self.assertEqual(
+            [invoice.id for invoice in previous_page.context['page_obj']],
+            pending_ids[:DEFAULT_NUMBER_PAGINATION],
+        )
+
     def test_invoice_creation_when_taxpayer_is_not_approved(self):
         self.client.force_login(self.user)
         self.taxpayer.taxpayer_state = TAXPAYER_STATUS_PENDING
@@ -860,3 +992,43 @@ class TestInvoice(TestBase):
         )
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertNotContains(response, 'New Invoice')
+
+
+class TestInvoiceDuplicatedFile(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        use_temp_media_root(self)
+        self.client.force_login(self.user)
+
+    def _create_invoice(self, invoice_number, content=None):
+        data = self.get_invoice_post_data(invoice_file=SimpleUploadedFile('invoice.pdf', content or get_pdf_content()))
+        data['invoice_number'] = invoice_number
+        return self.client.post(
+            reverse('invoice-create', kwargs={'taxpayer_id': self.taxpayer.id}),
+            data,
+            follow=True,
+        )
+
+    def test_pdf_of_other_invoice_of_the_taxpayer_warns(self):
+        self._create_invoice('A-1')
+        response = self._create_invoice('A-2')
+        self.assertEqual(
+            [str(message) for message in response.context['messages']],
+            ['The PDF of invoice #A-2 was already uploaded with invoice #A-1'],
+        )
+        first, second = Invoice.objects.filter(invoice_number__in=['A-1', 'A-2']).order_by('id')
+        self.assertEqual(first.invoice_file.name, second.invoice_file.name)
+
+    def test_pdf_of_invoice_of_other_taxpayer_warns_without_its_number(self):
+        self.invoice_from_other_user.invoice_file.save('other.pdf', ContentFile(get_pdf_content()))
+        response = self._create_invoice('A-1')
+        self.assertEqual(
+            [str(message) for message in response.context['messages']],
+            ['The PDF of invoice #A-1 was already uploaded by another taxpayer'],
+        )
+
+    def test_new_pdf_does_not_warn(self):
+        self._create_invoice('A-1')
+        response = self._create_invoice('A-2', content=get_pdf_content(100))
+        self.assertEqual(list(response.context['messages']), [])
@@ -1,5 +1,9 @@
+from io import StringIO
+
+from django.core.management import call_command
 from django.urls import reverse
 
+from invoices_app.models import InvoiceChange
 from invoices_app.tests.test_base import TestBase
 from utils.history import invoice_history_comments
 
@@ -32,3 +36,30 @@ class TestInvoiceHistory(TestBase):
         )
         self.assertContains(response, old_po_number)
         self.assertContains(response, new_po_number)
+
+    def test_history_comments_are_read_with_one_query(self):
+        self.invoice.po_number = '4321'
+        self.invoice.save()
+        self.invoice.invoice_number = '4321'
+        self.invoice.save()
+        with self.assertNumQueries(1):
+            comments = invoice_history_comments(self.invoice)
+        self.assertEqual(len(comments), 2)
+
+    def test_backfill_invoice_changes(self):
+        self.invoice.po_number = '4321'
+        self.invoice.save()
+        self.invoice.changeReason = 'Wrong amount'
+        self.invoice.total_amount = '10'
+        self.invoice.save()
+        expected_messages = [comment.message for comment in invoice_history_comments(self.invoice)]
+        InvoiceChange.objects.all().delete()
+
+        call_command('backfill_invoice_changes', batch_size=1, stdout=StringIO())
+        call_command('backfill_invoice_changes', stdout=StringIO())
+
+        self.assertEqual(
+            [comment.message for comment in invoice_history_comments(self.invoice)],
+            expected_messages,
+        )
+        self.assertEqual(InvoiceChange.objects.filter(invoice=self.invoice).count(), 2)
@@ -0,0 +1,92 @@
+from django.urls import reverse
+
+from invoices_app.factory_boy import InvoiceFactory
+from invoices_app.tests.test_base import TestBase
+from supplier_app.tests.factory_boy import (
+    CompanyFactory,
+    TaxPayerArgentinaFactory,
+    TaxPayerUnitedStatedFactory,
+)
+
+
+class TestSearch(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.ap_user)
+
+    def _search(self, text):
+        response = self.client.get(reverse('search'), {'q': text})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_search_taxpayers_by_business_name(self):
+        taxpayer = TaxPayerArgentinaFactory(business_name='Panadería Ñandú S.A.')
+        TaxPayerArgentinaFactory(business_name='Ferretería Norte')
+        results = self._search('panaderia nandu')
+        self.assertEqual([result['id'] for result in results['taxpayers']], [taxpayer.id])
+        self.assertEqual(results['taxpayers'][0]['identifier'], taxpayer.cuit)
+        self.assertEqual(
+            results['taxpayers'][0]['url'],
+            reverse('supplier-details', kwargs={'taxpayer_id': taxpayer.id}),
+        )
+
+    def test_search_ranks_better_matches_first(self):
+        partial_match = TaxPayerArgentinaFactory(business_name='Sonido Andino Producciones Eventos')
+        best_match = TaxPayerArgentinaFactory(business_name='Sonido Andino')
+        results = self._search('sonido andino')
+        self.assertEqual(
+            [result['id'] for result in results['taxpayers']],
+            [best_match.id, partial_match.id],
+        )
+
+    def test_search_taxpayers_by_identifier(self):
+        taxpayer = TaxPayerArgentinaFactory(cuit='20123456789')
+        taxpayer_usa = TaxPayerUnitedStatedFactory(taxpayer_id_number='123456789')
+        self.assertEqual([result['id'] for result in self._search('20-12345678-9')['taxpayers']], [taxpayer.id])
+        self.assertEqual([result['id'] for result in self._search('123456789')['taxpayers']], [taxpayer_usa.id])
+
+    def test_search_companies(self):
+        company = CompanyFactory(name='Música en Vivo')
+        results = self._search('musica')
+        self.assertEqual(results['companies'], [{'id': company.id, 'name': company.name}])
+
+    def test_search_invoices_by_invoice_or_po_number(self):
+        invoice = InvoiceFactory(user=self.user, taxpayer=self.taxpayer, invoice_number='A-0001', po_number='555')
+        invoice_by_po = InvoiceFactory(
+            user=self.user,
+            taxpayer=self.taxpayer,
+            invoice_number='A-0002',
+            po_number='A-0001',
+        )
+        results = self._search('A-0001')
+        self.assertEqual([result['id'] for result in results['invoices']], [invoice.id, invoice_by_po.id])
+        self.assertEqual(
+            results['invoices'][0]['url'],
+            reverse('invoices-detail', kwargs={'taxpayer_id': self.taxpayer.id, 'pk': invoice.id}),
+        )
+
+    def test_search_empty_query_returns_nothing(self):
+        self.assertEqual(
+            self._search('  '),
+            {'query': '', 'taxpayers': [], 'companies': [], 'invoices': []},
+        )
+
+    def test_search_after_renaming_taxpayer(self):
+        old_business_name = self.taxpayer.business_name
+        self.taxpayer.business_name = 'Renamed Supplier'
+        self.taxpayer.save()
+        self.assertEqual([result['id'] for result in self._search('renamed')['taxpayers']], [self.taxpayer.id])
+        self.assertNotIn(self.taxpayer.id, [result['id'] for result in self._search(old_business_name)['taxpayers']])
+
+    def test_supplier_can_not_search(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('search'), {'q': self.taxpayer.business_name})
+        self.assertEqual(response.status_code, 302)
+
+    def test_invoices_list_filters_organization_without_accents(self):
+        self.taxpayer.business_name = 'Café Ñuñoa'
+        self.taxpayer.save()
+        response = self.client.get(reverse('invoices-list'), {'taxpayer__business_name': 'cafe nunoa'})
+        self.assertContains(response, self.invoice.po_number)
+        self.assertNotContains(response, self.invoice_from_other_user.invoice_number)
@@ -0,0 +1,202 @@
+import csv
+import json
+from io import StringIO
+from os import path
+
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from openpyxl import Workbook
+
+from invoices_app import (
+    INVOICE_STATUS_APPROVED_CODE,
+    INVOICE_STATUS_IN_PROGRESS_CODE,
+    INVOICE_STATUS_PENDING_CODE,
+)
+from invoices_app.factory_boy import InvoiceFactory
+from invoices_app.models import Invoice, InvoiceChange
+from invoices_app.tests.test_base import TestBase
+from invoices_app.workday_import import (
+    WORKDAY_IMPORT_ASSIGNED,
+    WORKDAY_IMPORT_CONFLICT,
+    WORKDAY_IMPORT_INVALID,
+    WORKDAY_IMPORT_NOT_FOUND,
+    WORKDAY_IMPORT_UNCHANGED,
+    WorkdayImport,
+    read_workday_export,
+)
+from supplier_app.constants.taxpayer_status import (
+    TAXPAYER_STATUS_APPROVED,
+    TAXPAYER_STATUS_PENDING,
+)
+from supplier_app.models import InvitingBuyer, OutboxEmail, TaxPayer
+from supplier_app.tasks import drain_email_outbox
+from supplier_app.tests import get_temp_dir
+from supplier_app.tests.factory_boy import TaxPayerUnitedStatedFactory
+
+HEADER = ['Workday ID', 'Taxpayer ID', 'Invoice Number']
+
+
+class TestWorkdayImport(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = get_temp_dir(self)
+        TaxPayer.objects.filter(id=self.taxpayer.id).update(taxpayer_state=TAXPAYER_STATUS_PENDING)
+        TaxPayer.objects.update(workday_id='')
+
+    def _write_csv(self, rows, header=HEADER):
+        file_path = path.join(self.directory, 'workday.csv')
+        with open(file_path, 'w', newline='') as export_file:
+            writer = csv.writer(export_file)
+            writer.writerow(header)
+            writer.writerows(rows)
+        return file_path
+
+    def _write_xlsx(self, rows):
+        file_path = path.join(self.directory, 'workday.xlsx')
+        workbook = Workbook()
+        workbook.active.append(HEADER)
+        for row in rows:
+            workbook.active.append(row)
+        workbook.save(file_path)
+        return file_path
+
+    def _import(self, file_path, *args):
+        out = StringIO()
+        call_command('import_workday_ids', file_path, '--user', self.ap_user.email, *args, stdout=out)
+        return out.getvalue()
+
+    def _match(self, rows):
+        workday_import = WorkdayImport(read_workday_export(self._write_csv(rows)), self.ap_user)
+        return [(result['line'], result['result']) for result in workday_import.match()]
+
+    def test_import_approves_taxpayers_with_history(self):
+        InvitingBuyer.objects.create(company=self.company, inviting_buyer=self.ap_user)
+        output = self._import(self._write_csv([['WD-1', self.taxpayer.cuit, '']]))
+        taxpayer = TaxPayer.objects.get(id=self.taxpayer.id)
+        self.assertEqual(taxpayer.workday_id, 'WD-1')
+        self.assertEqual(taxpayer.taxpayer_state, TAXPAYER_STATUS_APPROVED)
+        record = TaxPayer.history.filter(id=taxpayer.id).latest('history_date')
+        self.assertEqual(record.history_type, '~')
+        self.assertEqual(record.history_user, self.ap_user)
+        self.assertEqual(record.workday_id, 'WD-1')
+        self.assertEqual(record.taxpayer_state, TAXPAYER_STATUS_APPROVED)
+        self.assertIn('1 taxpayers approved, 0 invoices in progress', output)
+        self.assertEqual(
+            sorted(json.loads(email.recipients) for email in OutboxEmail.objects.all()),
+            sorted([[self.user.email], [self.ap_user.email]]),
+        )
+
+    def test_import_puts_invoices_in_progress(self):
+        self._import(self._write_csv([['WD-1', self.taxpayer.cuit, self.invoice.invoice_number]]))
+        invoice = Invoice.objects.get(id=self.invoice.id)
+        self.assertEqual(invoice.status, INVOICE_STATUS_IN_PROGRESS_CODE)
+        self.assertEqual(invoice.workday_id, 'WD-1')
+        change = InvoiceChange.objects.get(invoice=invoice)
+        self.assertEqual(change.user, self.ap_user)
+        self.assertEqual(
+            change.get_changes(),
+            [['status', INVOICE_STATUS_PENDING_CODE, INVOICE_STATUS_IN_PROGRESS_CODE], ['workday_id', None, 'WD-1']],
+        )
+        self.assertEqual(TaxPayer.objects.get(id=self.taxpayer.id).taxpayer_state, TAXPAYER_STATUS_PENDING)
+        drain_email_outbox()
+        self.assertEqual([email.to for email in mail.outbox], [[self.user.email]])
+
+    def test_import_from_xlsx(self):
+        taxpayer_usa = TaxPayerUnitedStatedFactory(
+            company=self.company,
+            country='USA',
+            taxpayer_id_number='123456789',
+            workday_id='',
+        )
+        self._import(self._write_xlsx([
+            ['WD-1', int(self.taxpayer.cuit), None],
+            ['WD-2', '12-3456789', None],
+        ]), '--no-emails')
+        self.assertEqual(
+            dict(TaxPayer.objects.filter(workday_id__startswith='WD-').values_list('id', 'workday_id')),
+            {self.taxpayer.id: 'WD-1', taxpayer_usa.id: 'WD-2'},
+        )
+        self.assertFalse(mail.outbox)
+
+    def test_dry_run_changes_nothing(self):
+        output = self._import(
+            self._write_csv([
+                ['WD-1', self.taxpayer.cuit, ''],
+                ['WD-2', self.taxpayer.cuit, self.invoice.invoice_number],
+            ]),
+            '--dry-run',
+        )
+        self.assertIn('2 assigned, 0 unchanged', output)
+        self.assertIn('Dry run', output)
+        self.assertEqual(TaxPayer.objects.get(id=self.taxpayer.id).taxpayer_state, TAXPAYER_STATUS_PENDING)
+        self.assertEqual(Invoice.objects.get(id=self.invoice.id).status, INVOICE_STATUS_PENDING_CODE)
+        self.assertFalse(InvoiceChange.objects.exists())
+        self.assertFalse(mail.outbox)
+
+    def test_match_reports_conflicts(self):
+        TaxPayer.objects.filter(id=self.taxpayer_for_other_user.id).update(workday_id='WD-taken')
+        second_invoice = InvoiceFactory(user=self.user, taxpayer=self.taxpayer, invoice_number='A-2')
+        third_invoice = InvoiceFactory(user=self.user, taxpayer=self.taxpayer, invoice_number='A-3')
+        self.assertEqual(
+            self._match([
+                ['WD-taken', self.taxpayer.cuit, ''],
+                ['WD-repeated', self.taxpayer.cuit, second_invoice.invoice_number],
+                ['WD-repeated', self.taxpayer.cuit, third_invoice.invoice_number],
+                ['WD-3', self.taxpayer_for_other_user.cuit, ''],
+                ['WD-4', self.taxpayer.cuit, self.invoice.invoice_number],
+                ['WD-5', self.taxpayer.cuit, self.invoice.invoice_number],
+            ]),
+            [
+                (2, WORKDAY_IMPORT_CONFLICT),
+                (3, WORKDAY_IMPORT_CONFLICT),
+                (4, WORKDAY_IMPORT_CONFLICT),
+                (5, WORKDAY_IMPORT_CONFLICT),
+                (6, WORKDAY_IMPORT_ASSIGNED),
+                (7, WORKDAY_IMPORT_CONFLICT),
+            ],
+        )
+
+    def test_match_reports_unknown_and_invalid_rows(self):
+        Invoice.objects.filter(id=self.invoice.id).update(status=INVOICE_STATUS_APPROVED_CODE)
+        TaxPayer.objects.filter(id=self.taxpayer_for_other_user.id).update(
+            workday_id='WD-done',
+            taxpayer_state=TAXPAYER_STATUS_APPROVED,
+        )
+        self.assertEqual(
+            self._match([
+                ['WD-1', '99999999999', ''],
+                ['WD-2', self.taxpayer.cuit, 'missing'],
+                ['', self.taxpayer.cuit, ''],
+                ['WD-3', self.taxpayer.cuit, self.invoice.invoice_number],
+                ['WD-done', self.taxpayer_for_other_user.cuit, ''],
+            ]),
+            [
+                (2, WORKDAY_IMPORT_NOT_FOUND),
+                (3, WORKDAY_IMPORT_NOT_FOUND),
+                (4, WORKDAY_IMPORT_INVALID),
+                (5, WORKDAY_IMPORT_INVALID),
+                (6, WORKDAY_IMPORT_UNCHANGED),
+            ],
+        )
+
+    def test_missing_columns(self):
+        with self.assertRaisesMessage(CommandError, 'The export is missing the columns: workday id'):
+            self._import(self._write_csv([['1234']], header=['Taxpayer ID']))
+
+    def test_import_query_count_does_not_depend_on_rows(self):
+        with CaptureQueriesContext(connection) as one_row:
+            self._import(self._write_csv([['WD-1', self.taxpayer.cuit, self.invoice.invoice_number]]), '--no-emails')
+        invoices = [
+            InvoiceFactory(user=self.user, taxpayer=self.taxpayer, invoice_number='more-{}'.format(number))
+            for number in range(10)
+        ]
+        with CaptureQueriesContext(connection) as many_rows:
+            self._import(self._write_csv([
+                ['WD-more-{}'.format(invoice.id), self.taxpayer.cuit, invoice.invoice_number]
+                for invoice in invoices
+            ]), '--no-emails')
+        self.assertEqual(len(one_row.captured_queries), len(many_rows.captured_queries))
@@ -2,31 +2,37 @@ from datetime import timedelta
 from itertools import chain
 import urllib
 
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.decorators import permission_required as permission_required_decorator
 from django.contrib import messages
 from django.contrib.auth.mixins import (
     PermissionRequiredMixin,
     UserPassesTestMixin,
 )
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.forms import ValidationError
 from django.http import (
+    Http404,
     HttpResponseBadRequest,
     HttpResponseRedirect,
+    JsonResponse,
 )
 from django.shortcuts import (
     get_object_or_404,
-    redirect
+    redirect,
+    render,
 )
 from django.urls import (
     reverse,
     reverse_lazy
 )
+from django.utils.http import is_safe_url
 from django.utils.translation import (
     ugettext_lazy as _,
     activate,
 )
-from django.views.generic import CreateView
+from django.views.decorators.http import require_POST
+from django.views.generic import CreateView, FormView
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import UpdateView
 from django.views.generic.list import ListView
@@ -41,8 +47,9 @@ from supplier_app import (
 from supplier_app.constants.taxpayer_status import TAXPAYER_STATUS_APPROVED
 from supplier_app.models import (
     Address,
-    EBEntity,
     TaxPayer,
+    get_eb_entity,
+    get_taxpayer_names,
 )
 
 from users_app import (
@@ -64,18 +71,22 @@ from users_app.mixins import (
 )
 from users_app.models import User
 
+from utils.file_response import stored_file_response
 from utils.file_validator import validate_file
 from utils.history import invoice_history_comments
 from utils.invoice_lookup import invoice_status_lookup
+from utils.pagination import KeysetPaginationMixin
 from utils.reports import (
-    generate_xls,
-    ExcelReportInputParams,
-    generate_response_xls,
+    XLSX_CONTENT_TYPE,
+    generate_streaming_response_xls,
 )
 from utils.send_email import (
     build_mail_html,
+    get_invoice_change_ids,
+    get_messages_by_language,
     get_user_emails_by_tax_payer_id,
-    send_email_notification
+    queue_email_messages,
+    send_bulk_status_change_emails,
 )
 
 from invoices_app import (
@@ -83,24 +94,21 @@ from invoices_app import (
     ENGLISH_LANGUAGE_CODE,
     EVENTBRITE_INVOICE_COMMENTED,
     EVENTBRITE_INVOICE_EDITED,
-    EXPORT_TO_XLS_FULL,
+    EXPORT_JOB_INVOICES,
+    EXPORT_JOB_STATUS_DONE,
     INVOICE_CHANGE_STATUS_TEXT_EMAIL,
     INVOICE_DATE_FORMAT,
     INVOICE_EDIT_INVOICE_UPPER_TEXT,
     INVOICE_STATUS,
     INVOICE_STATUSES_DICT,
-    INVOICE_STATUS_APPROVED,
     INVOICE_STATUS_CHANGES_REQUEST,
     INVOICE_STATUS_PENDING,
-    INVOICE_STATUS_PAID,
-    INVOICE_STATUS_REJECTED,
     INVOICE_MAX_SIZE_FILE,
     NEW_COMMENT_EMAIL_TEXT,
     NO_COMMENT_ERROR,
     NO_WORKDAY_ID_ERROR,
     THANK_YOU,
     DISCLAIMER,
-    INVOICE_STATUS_IN_PROGRESS,
     INVOICE_STATUS_APPROVED_UPPER,
     INVOICE_STATUS_APPROVED_EMAIL,
     INVOICE_STATUS_CHANGES_REQUEST_UPPER,
@@ -111,23 +119,40 @@ from invoices_app import (
     INVOICE_STATUS_PAID_EMAIL,
     INVOICE_STATUS_IN_PROGRESS_EMAIL,
     INVOICE_STATUS_PENDING_CODE,
+    INVOICE_STATUS_CHANGES_REQUEST_CODE,
+    INVOICE_BULK_UPLOAD_COLUMNS,
+    INVOICE_BULK_UPLOAD_CREATED,
+    INVOICE_BULK_UPLOAD_RESULTS,
+    INVOICE_BULK_STATUS_CHANGED,
     SINCERELY,
 )
 
 
-from invoices_app.change_status_strategy import get_change_status_strategy
+from invoices_app.bulk_upload import import_invoices, read_archive
+from invoices_app.change_status_strategy import (
+    bulk_change_status,
+    get_change_status_strategy,
+    validate_bulk_status_change,
+)
+from invoices_app.exports import InvoiceExport, get_export
 from invoices_app.filters import InvoiceFilter
-from invoices_app.forms import InvoiceForm
+from invoices_app.forms import InvoiceBulkUploadForm, InvoiceForm
 from invoices_app.models import (
     Invoice,
-    Comment
+    Comment,
+    ExportJob,
+    get_duplicated_file_warnings,
 )
+from invoices_app.search import get_search_results
+from invoices_app.tasks import start_export_job
 
 
-class InvoiceListView(PermissionRequiredMixin, PaginationMixin, FilterView):
+class InvoiceListView(PermissionRequiredMixin, KeysetPaginationMixin, FilterView):
     template_name = 'invoices_app/invoice-list.html'
     model = Invoice
     paginate_by = 10
+    keyset_ordering = ('invoice_date_received', 'id')
+    keyset_count = True
     filterset_class = InvoiceFilter
     permission_required = CAN_VIEW_INVOICES_PERM
 
@@ -138,68 +163,69 @@ class InvoiceListView(PermissionRequiredMixin, PaginationMixin, FilterView):
         else:
             return TaxPayer.objects.filter(
                 company__companyuserpermission__user=user
-            )
+            ).only('id', 'business_name', 'taxpayer_state')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        user = self.request.user
         context['filter_to_xls'] = urllib.parse.urlparse(self.request.get_raw_uri()).query
-        context['is_AP'] = self.request.user.is_AP
-        context['INVOICE_STATUS_APPROVED'] = invoice_status_lookup(INVOICE_STATUS_APPROVED)
-        context['INVOICE_STATUS_PENDING'] = invoice_status_lookup(INVOICE_STATUS_PENDING)
-        context['INVOICE_STATUS_CHANGES_REQUEST'] = invoice_status_lookup(INVOICE_STATUS_CHANGES_REQUEST)
-        context['INVOICE_STATUS_REJECTED'] = invoice_status_lookup(INVOICE_STATUS_REJECTED)
-        context['INVOICE_STATUS_PAID'] = invoice_status_lookup(INVOICE_STATUS_PAID)
-        context['INVOICE_STATUS_IN_PROGRESS'] = invoice_status_lookup(INVOICE_STATUS_IN_PROGRESS)
+        context['is_AP'] = user.is_AP
+        context['is_supplier'] = not context['is_AP'] and user.is_supplier
         context['date_format'] = DATE_FORMAT
         all_taxpayers = self.get_taxpayers()
         context['all_taxpayers'] = all_taxpayers
-        if not self.request.user.is_AP:
+        if user.has_perm(CAN_VIEW_ALL_TAXPAYERS_PERM):
+            context['taxpayer_names'] = get_taxpayer_names()
+        else:
+            context['taxpayer_names'] = [taxpayer.business_name for taxpayer in all_taxpayers]
+        if not context['is_AP']:
             context['has_approved_taxpayer'] = any(taxpayer.taxpayer_state == 'APPROVED' for taxpayer in all_taxpayers)
-        
+
         return context
 
     def get_queryset(self):
         user = self.request.user
         if user.has_perm(CAN_VIEW_ALL_INVOICES_PERM):
-            queryset = Invoice.objects.filter().defer('invoice_file').order_by('id')
+            queryset = Invoice.objects.for_list()
         else:
-            queryset = Invoice.objects.filter(
+            queryset = Invoice.objects.for_list().filter(
                 taxpayer__company__companyuserpermission__user=user
-            ).defer('invoice_file')
+            )
         return queryset
 
 
 class SupplierInvoiceListView(
     PermissionRequiredMixin,
     TaxPayerPermissionMixin,
-    PaginationMixin,
+    KeysetPaginationMixin,
     ListView
 ):
 
     template_name = 'invoices_app/supplier-invoice-list.html'
     model = Invoice
     paginate_by = 10
+    keyset_ordering = ('invoice_date_received', 'id')
     fields = ['id', 'invoice_date', 'invoice_number', 'po_number', 'currency', 'total_amount', 'status']
     permission_required = CAN_VIEW_SUPPLIER_INVOICES_PERM
 
     def get_queryset(self):
         tax_payer = get_object_or_404(TaxPayer, id=self.kwargs['taxpayer_id'])
-        queryset = Invoice.objects.filter(taxpayer=tax_payer.id).defer('invoice_file').order_by('id')
+        queryset = Invoice.objects.filter(taxpayer=tax_payer.id).defer('invoice_file')
         return queryset
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['taxpayer'] = TaxPayer.objects.get(id=self.kwargs['taxpayer_id'])
-        context['INVOICE_STATUS_APPROVED'] = invoice_status_lookup(INVOICE_STATUS_APPROVED)
-        context['INVOICE_STATUS_PENDING'] = invoice_status_lookup(INVOICE_STATUS_PENDING)
-        context['INVOICE_STATUS_CHANGES_REQUEST'] = invoice_status_lookup(INVOICE_STATUS_CHANGES_REQUEST)
-        context['INVOICE_STATUS_REJECTED'] = invoice_status_lookup(INVOICE_STATUS_REJECTED)
-        context['INVOICE_STATUS_PAID'] = invoice_status_lookup(INVOICE_STATUS_PAID)
-        context['INVOICE_STATUS_IN_PROGRESS'] = invoice_status_lookup(INVOICE_STATUS_IN_PROGRESS)
         context['date_format'] = DATE_FORMAT
         return context
 
 
+def _warn_duplicated_file(request, invoice):
+    warning = get_duplicated_file_warnings([invoice]).get(invoice.id)
+    if warning:
+        messages.warning(request, warning)
+
+
 class SupplierInvoiceCreateView(PermissionRequiredMixin, TaxPayerPermissionMixin, CreateView):
     model = Invoice
     form_class = InvoiceForm
@@ -225,9 +251,9 @@ class SupplierInvoiceCreateView(PermissionRequiredMixin, TaxPayerPermissionMixin
             return super().form_invalid(form)
 
         invoice = form.save(commit=False)
-        EBEntity.objects.get(pk=form.cleaned_data['eb_entity'])
-        invoice.invoice_eb_entity = EBEntity.objects.get(pk=form.cleaned_data['eb_entity'])
+        invoice.invoice_eb_entity = get_eb_entity(form.cleaned_data['eb_entity'])
         invoice.save()
+        _warn_duplicated_file(self.request, invoice)
 
         return HttpResponseRedirect(self.get_success_url())
 
@@ -253,6 +279,46 @@ class SupplierInvoiceCreateView(PermissionRequiredMixin, TaxPayerPermissionMixin
         return form
 
 
+class SupplierInvoiceBulkUploadView(PermissionRequiredMixin, TaxPayerPermissionMixin, FormView):
+    form_class = InvoiceBulkUploadForm
+    template_name = 'invoices_app/invoices_bulk_upload.html'
+    permission_required = CAN_CREATE_INVOICES_PERM
+    raise_exception = True
+
+    def get_taxpayer(self):
+        if not hasattr(self, 'taxpayer'):
+            self.taxpayer = get_object_or_404(TaxPayer, id=self.kwargs['taxpayer_id']).get_taxpayer_child()
+        return self.taxpayer
+
+    def form_valid(self, form):
+        taxpayer = self.get_taxpayer()
+        if taxpayer.taxpayer_state != TAXPAYER_STATUS_APPROVED:
+            form.add_error(None, _('Taxpayer not approved yet'))
+            return self.form_invalid(form)
+        try:
+            rows = read_archive(form.cleaned_data['archive'])
+        except ValidationError as error:
+            form.add_error('archive', error)
+            return self.form_invalid(form)
+        report = import_invoices(taxpayer, self.request.user, rows)
+        return self.render_to_response(self.get_context_data(form=self.form_class(), report=report))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['taxpayer'] = self.get_taxpayer()
+        context['is_AP'] = self.request.user.is_AP
+        context['eb_entities'] = context['taxpayer'].eb_entities
+        context['columns'] = INVOICE_BULK_UPLOAD_COLUMNS
+        if 'report' in context:
+            for result in context['report']:
+                result['result_display'] = INVOICE_BULK_UPLOAD_RESULTS[result['result']]
+            context['created_count'] = len([
+                result for result in context['report']
+                if result['result'] == INVOICE_BULK_UPLOAD_CREATED
+            ])
+        return context
+
+
 class InvoiceUpdateView(PermissionRequiredMixin, IsUserCompanyInvoice, UserPassesTestMixin, UpdateView):
     model = Invoice
     form_class = InvoiceForm
@@ -283,7 +349,10 @@ class InvoiceUpdateView(PermissionRequiredMixin, IsUserCompanyInvoice, UserPasse
 
     def form_valid(self, form):
         form.instance.status = invoice_status_lookup(INVOICE_STATUS_PENDING)
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        if 'invoice_file' in form.changed_data:
+            _warn_duplicated_file(self.request, self.object)
+        return response
 
     def user_has_permission(self):
         if not self.request.user.has_perm(CAN_CHANGE_INVOICE_STATUS_PERM):
@@ -326,12 +395,6 @@ class InvoiceHistory(PermissionRequiredMixin, PaginationMixin, ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['date_format'] = str(DATE_FORMAT)
-        context['INVOICE_STATUS_APPROVED'] = invoice_status_lookup(INVOICE_STATUS_APPROVED)
-        context['INVOICE_STATUS_PENDING'] = invoice_status_lookup(INVOICE_STATUS_PENDING)
-        context['INVOICE_STATUS_CHANGES_REQUEST'] = invoice_status_lookup(INVOICE_STATUS_CHANGES_REQUEST)
-        context['INVOICE_STATUS_REJECTED'] = invoice_status_lookup(INVOICE_STATUS_REJECTED)
-        context['INVOICE_STATUS_PAID'] = invoice_status_lookup(INVOICE_STATUS_PAID)
-        context['INVOICE_STATUS_IN_PROGRESS'] = invoice_status_lookup(INVOICE_STATUS_IN_PROGRESS)
         return context
 
 
@@ -390,6 +453,49 @@ def change_invoice_status(request, pk):
     )
 
 
+@permission_required_decorator(CAN_CHANGE_INVOICE_STATUS_PERM, raise_exception=True)
+@require_POST
+def bulk_change_invoice_status(request):
+    status = request.POST.get('status')
+    invoice_ids = request.POST.getlist('invoices')
+
+    if status not in INVOICE_STATUSES_DICT.keys() or not all(invoice_id.isdigit() for invoice_id in invoice_ids):
+        return HttpResponseBadRequest()
+
+    invoices = Invoice.objects.filter(id__in=invoice_ids).select_related('taxpayer__company')
+    if not request.user.has_perm(CAN_VIEW_ALL_INVOICES_PERM):
+        invoices = invoices.filter(taxpayer__company_id__in=request.user.company_ids)
+    invoices = list(invoices.order_by('id'))
+    if len(invoices) != len(set(invoice_ids)):
+        return HttpResponseBadRequest()
+
+    redirect_to = request.POST.get('next')
+    if not is_safe_url(redirect_to, allowed_hosts={request.get_host()}):
+        redirect_to = reverse('invoices-list')
+    if not invoices:
+        messages.error(request, _('Select the invoices to change'))
+        return redirect(redirect_to)
+
+    workday_ids = {
+        invoice.id: request.POST.get('workday_id_{}'.format(invoice.id), '').strip()
+        for invoice in invoices
+    }
+    message = request.POST.get('message') if status == INVOICE_STATUS_CHANGES_REQUEST_CODE else None
+    with transaction.atomic():
+        errors = validate_bulk_status_change(invoices, status, workday_ids, message)
+        if not errors:
+            bulk_change_status(invoices, status, request.user, workday_ids, message)
+    if errors:
+        for error in errors:
+            messages.error(request, error)
+        return redirect(redirect_to)
+
+    messages.success(request, INVOICE_BULK_STATUS_CHANGED.format(len(invoices), INVOICE_STATUSES_DICT[status]))
+    if status != INVOICE_STATUS_PENDING_CODE:
+        send_bulk_status_change_emails(invoices, message)
+    return redirect(redirect_to)
+
+
 class InvoiceDetailView(PermissionRequiredMixin, IsUserCompanyInvoice, DetailView):
     model = Invoice
     template_name = 'invoices_app/invoice_detail.html'
@@ -422,16 +528,10 @@ class InvoiceDetailView(PermissionRequiredMixin, IsUserCompanyInvoice, DetailVie
                 invoice.new_comment_from_ap = False
                 invoice.save()
         context['invoice'] = invoice
-        father_taxpayer = get_object_or_404(TaxPayer, id=self.kwargs['taxpayer_id'])
+        taxpayer = get_object_or_404(TaxPayer, id=self.kwargs['taxpayer_id']).get_taxpayer_child()
         context['is_AP'] = self.request.user.is_AP
-        context['taxpayer'] = father_taxpayer.get_taxpayer_child()
-        context['address'] = Address.objects.get(taxpayer=father_taxpayer.get_taxpayer_child())
-        context['INVOICE_STATUS_APPROVED'] = invoice_status_lookup(INVOICE_STATUS_APPROVED)
-        context['INVOICE_STATUS_PENDING'] = invoice_status_lookup(INVOICE_STATUS_PENDING)
-        context['INVOICE_STATUS_CHANGES_REQUEST'] = invoice_status_lookup(INVOICE_STATUS_CHANGES_REQUEST)
-        context['INVOICE_STATUS_REJECTED'] = invoice_status_lookup(INVOICE_STATUS_REJECTED)
-        context['INVOICE_STATUS_PAID'] = invoice_status_lookup(INVOICE_STATUS_PAID)
-        context['INVOICE_STATUS_IN_PROGRESS'] = invoice_status_lookup(INVOICE_STATUS_IN_PROGRESS)
+        context['taxpayer'] = taxpayer
+        context['address'] = Address.objects.get(taxpayer=taxpayer)
         context['comments'] = self.get_comments(invoice)
         context['date_format'] = DATE_FORMAT
         return context
@@ -491,27 +591,83 @@ def post_a_comment(request, pk):
 
 @permission_required_decorator(CAN_VIEW_INVOICES_PERM)
 def export_to_xlsx_invoice(request):
+    export = InvoiceExport()
+    params = export.get_params(export.get_filterset(request.GET))
+    return generate_streaming_response_xls(params, export.file_name)
 
-    queryset = InvoiceFilter(request.GET, queryset=Invoice.objects.all()).qs
-    params = ExcelReportInputParams(
-        model=queryset,
-        tab_name='Invoices',
-        headers_attrs=EXPORT_TO_XLS_FULL,
+
+@permission_required_decorator(CAN_VIEW_INVOICES_PERM)
+def export_to_xlsx_invoice_job(request):
+    export_job = start_export_job(request.user, EXPORT_JOB_INVOICES, request.GET)
+    return redirect(reverse('export-job-detail', kwargs={'pk': export_job.id}))
+
+
+@permission_required_decorator((CAN_VIEW_ALL_TAXPAYERS_PERM, CAN_VIEW_ALL_INVOICES_PERM))
+def search(request):
+    return JsonResponse(get_search_results(request.GET.get('q', '')))
+
+
+@login_required
+def export_job_detail(request, pk):
+    export_job = get_object_or_404(ExportJob, pk=pk, user=request.user)
+    if request.is_ajax():
+        return JsonResponse({
+            'status': export_job.status,
+            'progress': export_job.progress,
+            'row_count': export_job.row_count,
+            'is_finished': export_job.is_finished,
+            'download_url': reverse(
+                'export-job-download',
+                kwargs={'pk': export_job.id},
+            ) if export_job.status == EXPORT_JOB_STATUS_DONE else None,
+        })
+    return render(request, 'invoices_app/export-job.html', {'export_job': export_job})
+
+
+@login_required
+def download_export_job(request, pk):
+    export_job = get_object_or_404(
+        ExportJob,
+        pk=pk,
+        user=request.user,
+        status=EXPORT_JOB_STATUS_DONE,
     )
-    xls_file = generate_xls(params)
+    result_file = export_job.result_file
+    return stored_file_response(
+        request,
+        result_file.storage,
+        result_file.name,
+        content_type=XLSX_CONTENT_TYPE,
+        filename='{date}-{file_name}.xlsx'.format(
+            date=export_job.created_at.strftime('%Y-%m-%d'),
+            file_name=get_export(export_job.kind).file_name,
+        ),
+        as_attachment=True,
+    )
+
 
-    return generate_response_xls(xls_file, 'Invoices')
+@permission_required_decorator(CAN_VIEW_INVOICES_PERM, raise_exception=True)
+@is_invoice_for_user()
+def download_invoice_file(request, pk):
+    invoice_file = get_object_or_404(Invoice.objects.only('invoice_file'), pk=pk).invoice_file
+    return stored_file_response(request, invoice_file.storage, invoice_file.name)
+
+
+@permission_required_decorator(CAN_VIEW_INVOICES_PERM, raise_exception=True)
+@is_invoice_for_user()
+def download_comment_file(request, pk, comment_id):
+    comment = get_object_or_404(Comment.objects.only('comment_file'), pk=comment_id, invoice_id=pk)
+    if not comment.comment_file:
+        raise Http404()
+    return stored_file_response(request, comment.comment_file.storage, comment.comment_file.name)
 
 
 def _send_email_when_posting_a_comment(request, invoice):
     recipient_list = get_user_emails_by_tax_payer_id(invoice.taxpayer.id)
-    users = User.objects.filter(email__in=recipient_list)
-
-    for user in users:
-        activate(user.preferred_language)
+    users = User.objects.filter(email__in=recipient_list).only('email', 'preferred_language')
 
+    def build_message():
         subject = EVENTBRITE_INVOICE_COMMENTED.format(invoice.invoice_number)
-
         upper_text = NEW_COMMENT_EMAIL_TEXT.format(
             invoice.invoice_number,
             request.POST['message']
@@ -522,17 +678,20 @@ def _send_email_when_posting_a_comment(request, invoice):
             THANK_YOU,
             DISCLAIMER,
         )
-        _send_email(subject, message, [user.email])
+        return subject, message
 
+    queue_email_messages(
+        get_messages_by_language(users, build_message),
+        ('invoice_comment', invoice.id, get_invoice_change_ids([invoice]).get(invoice.id)),
+    )
     activate(request.user.preferred_language)
 
 
 def _send_email_when_change_invoice_status(request, invoice):
     recipient_list = get_user_emails_by_tax_payer_id(invoice.taxpayer.id)
-    users = User.objects.filter(email__in=recipient_list)
+    users = User.objects.filter(email__in=recipient_list).only('email', 'preferred_language')
 
-    for user in users:
-        activate(user.preferred_language)
+    def build_message():
         subject, upper_text, lower_text = get_upper_and_email_text(invoice, request.POST.get('message'))
         message = build_mail_html(
                 invoice.taxpayer.business_name,
@@ -540,20 +699,15 @@ def _send_email_when_change_invoice_status(request, invoice):
                 lower_text,
                 DISCLAIMER,
             )
-        _send_email(subject, message, [user.email])
+        return subject, message
 
+    queue_email_messages(
+        get_messages_by_language(users, build_message),
+        ('invoice_status', invoice.id, get_invoice_change_ids([invoice]).get(invoice.id)),
+    )
     activate(request.user.preferred_language)
 
 
-def _send_email(
-    subject,
-    message,
-    recipient_list
-):
-    if subject and message and recipient_list:
-        send_email_notification.apply_async([subject, message, recipient_list])
-
-
 def get_upper_and_email_text(invoice: Invoice, message = None):
     email_cases = {
         "1": [
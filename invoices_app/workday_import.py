@@ -0,0 +1,301 @@
+"""
+Workday ID reconciliation: a Workday export, CSV or XLSX, with the Workday
+ID given to each taxpayer or invoice (see WORKDAY_IMPORT_COLUMNS).
+
+A row with an invoice number puts that invoice of the taxpayer in progress
+with the Workday ID, a row without one approves the taxpayer with it. Every
+row is matched against in-memory indexes built with a few queries, so the
+rows can be checked, and reported in a dry run, before writing anything,
+and the changes are then written in batches.
+"""
+import csv
+from collections import Counter
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Case, CharField, F, Value, When
+from django.utils.translation import ugettext_lazy as _
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from invoices_app import (
+    INVOICE_STATUS_IN_PROGRESS_CODE,
+    INVOICE_STATUS_PENDING_CODE,
+    INVOICE_STATUS_TRANSITION_ERROR,
+    INVOICE_STATUS_TRANSITIONS,
+    INVOICE_STATUSES_DICT,
+)
+from invoices_app.change_status_strategy import bulk_change_status
+from invoices_app.models import Invoice
+from supplier_app.constants.taxpayer_status import TAXPAYER_STATUS_APPROVED
+from supplier_app.models import TaxPayer
+from supplier_app.tasks import queue_registration_pdf
+from utils.history import build_historical_record
+from utils.send_email import buyer_notification, send_bulk_status_change_emails, taxpayer_notification
+
+# Header of each column in the export, matched ignoring case, and the key
+# of its value in the rows
+WORKDAY_IMPORT_COLUMNS = {
+    'workday id': 'workday_id',
+    'taxpayer id': 'identifier',
+    'invoice number': 'invoice_number',
+}
+WORKDAY_IMPORT_REQUIRED_COLUMNS = ('workday_id', 'identifier')
+WORKDAY_IMPORT_BATCH_SIZE = 500
+
+WORKDAY_IMPORT_ASSIGNED = 'assigned'
+WORKDAY_IMPORT_UNCHANGED = 'unchanged'
+WORKDAY_IMPORT_CONFLICT = 'conflict'
+WORKDAY_IMPORT_NOT_FOUND = 'not found'
+WORKDAY_IMPORT_INVALID = 'invalid'
+WORKDAY_IMPORT_RESULTS = (
+    WORKDAY_IMPORT_ASSIGNED,
+    WORKDAY_IMPORT_UNCHANGED,
+    WORKDAY_IMPORT_CONFLICT,
+    WORKDAY_IMPORT_NOT_FOUND,
+    WORKDAY_IMPORT_INVALID,
+)
+
+
+class WorkdayImportError(Exception):
+    pass
+
+
+def _get_cell_text(value):
+    if value is None:
+        return ''
+    # Spreadsheets keep long identifiers as numbers
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _read_csv(path):
+    with open(path, encoding='utf-8-sig', newline='') as export_file:
+        try:
+            yield from csv.reader(export_file)
+        except (UnicodeDecodeError, csv.Error):
+            raise WorkdayImportError(_('{} is not a valid UTF-8 CSV file').format(path))
+
+
+def _read_xlsx(path):
+    try:
+        # A read-only workbook streams the rows instead of loading the sheet
+        workbook = load_workbook(path, read_only=True, data_only=True)
+    except (InvalidFileException, KeyError, OSError):
+        raise WorkdayImportError(_('{} is not a valid XLSX file').format(path))
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_workday_export(path):
+    """
+    Yield the rows of the Workday export at path as dicts with the keys of
+    WORKDAY_IMPORT_COLUMNS plus the line of the row.
+    """
+    rows = _read_xlsx(path) if path.lower().endswith('.xlsx') else _read_csv(path)
+    header = [_get_cell_text(value).lower() for value in next(rows, None) or []]
+    positions = {
+        WORKDAY_IMPORT_COLUMNS[column]: position
+        for position, column in enumerate(header)
+        if column in WORKDAY_IMPORT_COLUMNS
+    }
+    missing_columns = [
+        column for column, key in WORKDAY_IMPORT_COLUMNS.items()
+        if key in WORKDAY_IMPORT_REQUIRED_COLUMNS and key not in positions
+    ]
+    if missing_columns:
+        raise WorkdayImportError(_('The export is missing the columns: {}').format(', '.join(missing_columns)))
+    for line, values in enumerate(rows, start=2):
+        values = [_get_cell_text(value) for value in values]
+        if not any(values):
+            continue
+        row = {
+            key: values[position] if position < len(values) else ''
+            for key, position in positions.items()
+        }
+        row.setdefault('invoice_number', '')
+        row['line'] = line
+        yield row
+
+
+def _normalize_identifier(identifier):
+    return identifier.replace('-', '').replace('.', '').replace(' ', '')
+
+
+def _chunks(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class WorkdayImport:
+    """
+    Match the rows of read_workday_export with match(), which returns the
+    report of every row, and write the assigned ones with apply().
+    """
+
+    def __init__(self, rows, user=None, batch_size=WORKDAY_IMPORT_BATCH_SIZE):
+        self.rows = list(rows)
+        self.user = user
+        self.batch_size = batch_size
+        self.taxpayers = []
+        self.invoices = []
+        self.workday_ids = {}
+
+    def _get_taxpayers_by_identifier(self):
+        identifiers = {_normalize_identifier(row['identifier']) for row in self.rows if row['identifier']}
+        taxpayers = {}
+        for chunk in _chunks(identifiers, self.batch_size):
+            for lookup in ('taxpayerargentina__cuit', 'taxpayerunitedstates__taxpayer_id_number'):
+                queryset = TaxPayer.objects.filter(**{lookup + '__in': chunk}).annotate(identifier=F(lookup))
+                taxpayers.update((taxpayer.identifier, taxpayer) for taxpayer in queryset)
+        return taxpayers
+
+    def _get_invoices(self, taxpayers):
+        numbers = {row['invoice_number'] for row in self.rows if row['invoice_number']}
+        taxpayer_ids = [taxpayer.id for taxpayer in taxpayers.values()]
+        invoices = {}
+        if not numbers or not taxpayer_ids:
+            return invoices
+        for chunk in _chunks(numbers, self.batch_size):
+            queryset = Invoice.objects.filter(
+                taxpayer_id__in=taxpayer_ids,
+                invoice_number__in=chunk,
+            ).select_related('taxpayer__company')
+            invoices.update(((invoice.taxpayer_id, invoice.invoice_number), invoice) for invoice in queryset)
+        return invoices
+
+    def _get_workday_id_owners(self, model):
+        workday_ids = {row['workday_id'] for row in self.rows if row['workday_id']}
+        owners = {}
+        for chunk in _chunks(workday_ids, self.batch_size):
+            owners.update(model.objects.filter(workday_id__in=chunk).values_list('workday_id', 'id'))
+        return owners
+
+    def _check_target(self, row, target, owners, workday_id_counts, matched, is_done):
+        workday_id = row['workday_id']
+        if workday_id_counts[(type(target), workday_id)] > 1:
+            return WORKDAY_IMPORT_CONFLICT, _('Workday ID {} is repeated in the export').format(workday_id)
+        if target.id in matched:
+            return WORKDAY_IMPORT_CONFLICT, _('Matched by the row in line {}').format(matched[target.id])
+        matched[target.id] = row['line']
+        if owners.get(workday_id, target.id) != target.id:
+            return WORKDAY_IMPORT_CONFLICT, _('Workday ID {} already exist').format(workday_id)
+        if target.workday_id and target.workday_id != workday_id:
+            return WORKDAY_IMPORT_CONFLICT, _('It already has the Workday ID {}').format(target.workday_id)
+        if target.workday_id == workday_id and is_done:
+            return WORKDAY_IMPORT_UNCHANGED, ''
+        return WORKDAY_IMPORT_ASSIGNED, ''
+
+    def match(self):
+        """
+        Report of every row: its line, taxpayer ID, invoice number, Workday
+        ID, result and message. The taxpayers to approve and the invoices to
+        put in progress are kept for apply().
+        """
+        taxpayers = self._get_taxpayers_by_identifier()
+        invoices = self._get_invoices(taxpayers)
+        taxpayer_owners = self._get_workday_id_owners(TaxPayer)
+        invoice_owners = self._get_workday_id_owners(Invoice)
+        workday_id_counts = Counter(
+            (Invoice if row['invoice_number'] else TaxPayer, row['workday_id'])
+            for row in self.rows
+        )
+        matched_taxpayers, matched_invoices = {}, {}
+        self.taxpayers, self.invoices, self.workday_ids = [], [], {}
+
+        report = []
+        for row in self.rows:
+            result = {
+                'line': row['line'],
+                'identifier': row['identifier'],
+                'invoice_number': row['invoice_number'],
+                'workday_id': row['workday_id'],
+            }
+            report.append(result)
+            taxpayer = taxpayers.get(_normalize_identifier(row['identifier']))
+            invoice = taxpayer and invoices.get((taxpayer.id, row['invoice_number']))
+            if not row['workday_id'] or not row['identifier']:
+                result['result'] = WORKDAY_IMPORT_INVALID
+                result['message'] = _('The Workday ID and the taxpayer ID are required')
+            elif not taxpayer:
+                result['result'] = WORKDAY_IMPORT_NOT_FOUND
+                result['message'] = _('There is no taxpayer {}').format(row['identifier'])
+            elif row['invoice_number'] and not invoice:
+                result['result'] = WORKDAY_IMPORT_NOT_FOUND
+                result['message'] = _('The taxpayer has no invoice #{}').format(row['invoice_number'])
+            elif invoice:
+                result['result'], result['message'] = self._check_target(
+                    row,
+                    invoice,
+                    invoice_owners,
+                    workday_id_counts,
+                    matched_invoices,
+                    invoice.status != INVOICE_STATUS_PENDING_CODE,
+                )
+                if (
+                    result['result'] == WORKDAY_IMPORT_ASSIGNED and
+                    invoice.status not in INVOICE_STATUS_TRANSITIONS[INVOICE_STATUS_IN_PROGRESS_CODE]
+                ):
+                    result['result'] = WORKDAY_IMPORT_INVALID
+                    result['message'] = INVOICE_STATUS_TRANSITION_ERROR.format(
+                        invoice.invoice_number,
+                        INVOICE_STATUSES_DICT[invoice.status],
+                        INVOICE_STATUSES_DICT[INVOICE_STATUS_IN_PROGRESS_CODE],
+                    )
+                if result['result'] == WORKDAY_IMPORT_ASSIGNED:
+                    self.invoices.append(invoice)
+                    self.workday_ids[invoice.id] = row['workday_id']
+            else:
+                result['result'], result['message'] = self._check_target(
+                    row,
+                    taxpayer,
+                    taxpayer_owners,
+                    workday_id_counts,
+                    matched_taxpayers,
+                    taxpayer.taxpayer_state == TAXPAYER_STATUS_APPROVED,
+                )
+                if result['result'] == WORKDAY_IMPORT_ASSIGNED:
+                    taxpayer.workday_id = row['workday_id']
+                    self.taxpayers.append(taxpayer)
+        return report
+
+    def _approve_taxpayers(self):
+        for taxpayers in _chunks(self.taxpayers, self.batch_size):
+            TaxPayer.objects.filter(id__in=[taxpayer.id for taxpayer in taxpayers]).update(
+                workday_id=Case(
+                    *[When(id=taxpayer.id, then=Value(taxpayer.workday_id)) for taxpayer in taxpayers],
+                    output_field=CharField(),
+                ),
+                taxpayer_state=TAXPAYER_STATUS_APPROVED,
+            )
+            for taxpayer in taxpayers:
+                taxpayer.taxpayer_state = TAXPAYER_STATUS_APPROVED
+            TaxPayer.history.model.objects.bulk_create(
+                [build_historical_record(taxpayer, self.user) for taxpayer in taxpayers],
+                batch_size=self.batch_size,
+            )
+
+    def apply(self, notify=True):
+        """
+        Approve the taxpayers and put the invoices in progress with their
+        Workday IDs, all or nothing. With notify, the suppliers and buyers
+        are emailed the same as when they are changed one by one. The
+        registration PDFs of the taxpayers are rendered once committed.
+        """
+        with transaction.atomic():
+            if self.taxpayers:
+                self._approve_taxpayers()
+            if self.invoices:
+                bulk_change_status(self.invoices, INVOICE_STATUS_IN_PROGRESS_CODE, self.user, self.workday_ids)
+            for taxpayer in self.taxpayers:
+                transaction.on_commit(partial(queue_registration_pdf, taxpayer.id))
+            if notify:
+                for taxpayer in self.taxpayers:
+                    taxpayer_notification(taxpayer, 'taxpayer_approval')
+                    buyer_notification(taxpayer, 'buyer_notification')
+                if self.invoices:
+                    send_bulk_status_change_emails(self.invoices)
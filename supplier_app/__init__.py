@@ -2,6 +2,7 @@ from collections import namedtuple
 
 from django.utils.translation import ugettext_lazy as _
 
+default_app_config = 'supplier_app.apps.SupplierAppConfig'
 
 CURRENT_STATUS = 1
 UNUSED_STATUS = 2
@@ -24,3 +25,51 @@ PAYMENT_TYPES = [
 ]
 
 DATE_FORMAT = _("M d, Y")
+
+OUTBOX_STATUS_PENDING = 'PENDING'
+OUTBOX_STATUS_SENT = 'SENT'
+OUTBOX_STATUS_FAILED = 'FAILED'
+
+OUTBOX_STATUS = [
+    DBTuple(OUTBOX_STATUS_PENDING, _("Pending")),
+    DBTuple(OUTBOX_STATUS_SENT, _("Sent")),
+    DBTuple(OUTBOX_STATUS_FAILED, _("Failed")),
+]
+
+# Emails sent per run of the outbox drain task
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 6
+# Seconds to wait before the first retry, doubled on every later attempt
+OUTBOX_RETRY_BASE_DELAY = 60
+# Seconds a drain run keeps the emails it picked before another run can take them
+OUTBOX_LEASE_SECONDS = 5 * 60
+
+DOCUMENT_STATUS_PENDING = 'PENDING'
+DOCUMENT_STATUS_STORED = 'STORED'
+DOCUMENT_STATUS_FAILED = 'FAILED'
+
+DOCUMENT_STATUS = [
+    DBTuple(DOCUMENT_STATUS_PENDING, _("Pending upload")),
+    DBTuple(DOCUMENT_STATUS_STORED, _("Stored")),
+    DBTuple(DOCUMENT_STATUS_FAILED, _("Upload failed")),
+]
+
+# Spooled documents pushed to the storage per run of the upload task
+DOCUMENT_UPLOAD_BATCH_SIZE = 20
+DOCUMENT_UPLOAD_MAX_ATTEMPTS = 8
+# Seconds to wait before the first retry, doubled on every later attempt
+DOCUMENT_UPLOAD_RETRY_BASE_DELAY = 30
+# Seconds an upload run keeps the documents it picked before another run can take them
+DOCUMENT_UPLOAD_LEASE_SECONDS = 10 * 60
+# Seconds a document must stay unused before it is pruned, longer than any
+# request that may be saving a row with it
+DOCUMENT_PRUNE_GRACE_SECONDS = 24 * 60 * 60
+
+# Directory of the default storage keeping the rendered registration PDFs
+REGISTRATION_PDF_DIRECTORY = 'registration_pdfs'
+REGISTRATION_PDF_TEMPLATE = 'supplier_app/html-to-pdf-page.html'
+# Seconds a queued render blocks queueing the same PDF again
+REGISTRATION_PDF_RENDER_LOCK_TIMEOUT = 5 * 60
+# Taxpayers read, and their missing registration PDFs rendered, at a time
+# while streaming a PDF pack
+REGISTRATION_PDF_PACK_CHUNK_SIZE = 20
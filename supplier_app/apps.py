@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class SupplierAppConfig(AppConfig):
     name = 'supplier_app'
+
+    def ready(self):
+        from utils.reference_data import connect_reference_data_signals
+        connect_reference_data_signals()
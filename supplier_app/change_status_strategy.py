@@ -1,4 +1,5 @@
 from django.contrib import messages
+from django.db import transaction
 
 from supplier_app.models import TaxPayer
 
@@ -18,6 +19,7 @@ from supplier_app.constants.custom_messages import (
     TAXPAYER_REQUEST_CHANGE_MESSAGE,
     TAXPAYER_IN_PROGRESS_MESSAGE
 )
+from supplier_app.tasks import queue_registration_pdf
 from utils.send_email import taxpayer_notification, buyer_notification
 
 
@@ -69,6 +71,7 @@ class StrategyApprove(StrategyStatusChange):
             raise NoWorkdayIDException()
         taxpayer.approve_taxpayer()
         taxpayer.save()
+        transaction.on_commit(lambda: queue_registration_pdf(taxpayer.id))
 
     def show_message(request):
         messages.success(request, TAXPAYER_APPROVE_MESSAGE)
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 BANK_INFO = {
     "BANCO DE GALICIA Y BUENOS AIRES S.A.U.": 7,
     "BANCO DE LA NACION ARGENTINA": 11,
@@ -79,5 +81,6 @@ BANK_INFO = {
 }
 
 
+@lru_cache(maxsize=None)
 def get_bank_info_choices():
     return [(v, k) for k, v in BANK_INFO.items()]
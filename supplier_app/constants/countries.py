@@ -1,4 +1,5 @@
 from collections import namedtuple
+from functools import lru_cache
 from django.utils.translation import ugettext_lazy as _
 
 DBTuple = namedtuple('DBTuple', 'value verbose_name')
@@ -9,5 +10,8 @@ COUNTRIES = {
 }
 
 
+# The country names are lazy, so the cached choices are still translated
+# to the language of each request
+@lru_cache(maxsize=None)
 def get_countries_choices():
     return [(country.value, country.verbose_name) for country in COUNTRIES.values()]
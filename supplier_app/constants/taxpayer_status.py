@@ -1,4 +1,5 @@
 from collections import namedtuple
+from functools import lru_cache
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -39,5 +40,7 @@ TAXPAYER_STATUS = {
 }
 
 
+# Cached with the lazy status names, translated when they are rendered
+@lru_cache(maxsize=None)
 def get_taxpayer_status_choices():
     return [value['choices'] for value in TAXPAYER_STATUS.values()]
@@ -0,0 +1,31 @@
+from django.db.models import OuterRef, Subquery
+
+from invoices_app import EXPORT_JOB_TAXPAYERS, EXPORT_TO_XLS_TAXPAYER
+from supplier_app.constants.eb_entities_status import CURRENT_STATUS
+from supplier_app.filters import TaxPayerFilter
+from supplier_app.models import TaxPayer, TaxPayerEBEntity
+from utils.reports import ExcelReport, ExcelReportInputParams
+
+
+class TaxPayerExport(ExcelReport):
+    kind = EXPORT_JOB_TAXPAYERS
+    file_name = 'Taxpayer'
+    filterset_class = TaxPayerFilter
+    history_models = (TaxPayer,)
+
+    def get_queryset(self):
+        return TaxPayer.objects.all()
+
+    def get_params(self, filterset):
+        current_eb_entity = TaxPayerEBEntity.objects.filter(
+            taxpayer=OuterRef('pk'),
+            status=CURRENT_STATUS,
+        ).values('eb_entity__eb_name')[:1]
+        queryset = filterset.qs.annotate(
+            eb_entity_name=Subquery(current_eb_entity),
+        ).order_by('id')
+        return ExcelReportInputParams(
+            model=queryset,
+            tab_name='Taxpayer',
+            headers_attrs=EXPORT_TO_XLS_TAXPAYER,
+        )
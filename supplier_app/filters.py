@@ -1,4 +1,4 @@
-from django.forms import CheckboxSelectMultiple, Select
+from django.forms import CheckboxSelectMultiple, Select, TextInput
 from django_filters import (
     CharFilter,
     DateFromToRangeFilter,
@@ -10,6 +10,7 @@ from django.utils.translation import ugettext_lazy as _
 from supplier_app.constants.taxpayer_status import get_taxpayer_status_choices
 from supplier_app.models import TaxPayer
 from utils.custom_filters import DateRangeWidget
+from utils.search import filter_by_search
 
 
 class TaxPayerFilter(FilterSet):
@@ -27,16 +28,25 @@ class TaxPayerFilter(FilterSet):
         ),
         label=_("Country")
     )
+    business_name = CharFilter(
+        method='filter_business_name',
+        widget=TextInput(attrs={'class': 'form-control'}),
+        label=_("Search"),
+    )
 
     class Meta:
         model = TaxPayer
         fields = (
             'taxpayer_state',
             'taxpayer_date',
-            'country'
+            'country',
+            'business_name',
         )
 
     def get_form_class(self):
         form = super(FilterSet, self).get_form_class()
         form.base_fields['taxpayer_date'].widget = DateRangeWidget()
         return form
+
+    def filter_business_name(self, queryset, name, value):
+        return queryset.filter(id__in=filter_by_search(TaxPayer.objects.all(), value).values('id'))
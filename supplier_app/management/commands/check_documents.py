@@ -0,0 +1,61 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from supplier_app import DOCUMENT_STATUS_FAILED, DOCUMENT_STATUS_PENDING
+from supplier_app.models import Document
+from utils.documents import (
+    get_document_references,
+    index_documents,
+    prune_documents,
+    verify_documents,
+)
+
+
+class Command(BaseCommand):
+    help = 'Report the uploaded documents stored once per content and the rows using them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--index',
+            action='store_true',
+            help='Index the files uploaded before the document index',
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Check the indexed files are stored with the same content',
+        )
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help='Delete the indexed files no row or history uses for a day, and mark the ones unused now',
+        )
+
+    def handle(self, *args, **options):
+        if options['index']:
+            indexed, duplicated = index_documents(default_storage)
+            self.stdout.write('{} files indexed'.format(len(indexed)))
+            for name, sha256 in duplicated:
+                self.stdout.write('{} has the content of an indexed file ({})'.format(name, sha256))
+        if options['verify']:
+            for document in verify_documents(default_storage):
+                self.stdout.write('{} is missing or changed, expected {}'.format(document.name, document.sha256))
+        if options['prune']:
+            pruned = prune_documents(default_storage)
+            self.stdout.write('{} unused files deleted'.format(len(pruned)))
+
+        references = get_document_references()
+        documents = list(Document.objects.values_list('name', 'size'))
+        self.stdout.write('{} documents, {} bytes, {} references, {} unused'.format(
+            len(documents),
+            sum(size for _, size in documents),
+            sum(references[name] for name, _ in documents),
+            len([name for name, _ in documents if not references[name]]),
+        ))
+        statuses = dict(Document.objects.values_list('status').annotate(Count('id')).order_by())
+        if statuses.get(DOCUMENT_STATUS_PENDING) or statuses.get(DOCUMENT_STATUS_FAILED):
+            self.stdout.write('{} uploads pending, {} failed'.format(
+                statuses.get(DOCUMENT_STATUS_PENDING, 0),
+                statuses.get(DOCUMENT_STATUS_FAILED, 0),
+            ))
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.24 on 2026-10-18 09:35
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplier_app', '0028_outbox_email'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='taxpayer',
+            index_together=set([('taxpayer_state', 'taxpayer_date')]),
+        ),
+        # Taxpayers get their workday id when approved, the rest keep ''. Not
+        # unique, the approval checks it and the existing rows may repeat one
+        migrations.RunSQL(
+            sql=["CREATE INDEX taxpayer_workday_id ON supplier_app_taxpayer (workday_id) WHERE workday_id <> ''"],
+            reverse_sql=['DROP INDEX taxpayer_workday_id'],
+        ),
+    ]
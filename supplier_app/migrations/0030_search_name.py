@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.24 on 2026-10-18 09:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from utils.search import normalize_search_text
+
+
+def set_search_names(apps, schema_editor):
+    for model_name, field_name in (('Company', 'name'), ('TaxPayer', 'business_name')):
+        model = apps.get_model('supplier_app', model_name)
+        for pk, name in model.objects.values_list('id', field_name).iterator():
+            model.objects.filter(id=pk).update(search_name=normalize_search_text(name))
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # SQLite gets FTS5 tables after migrate instead, see utils.search
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in ('supplier_app_company', 'supplier_app_taxpayer'):
+        schema_editor.execute(
+            'CREATE INDEX {table}_search_name_trgm ON {table} USING gin (search_name gin_trgm_ops)'.format(table=table)
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in ('supplier_app_company', 'supplier_app_taxpayer'):
+        schema_editor.execute('DROP INDEX {table}_search_name_trgm'.format(table=table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplier_app', '0029_taxpayer_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='search_name',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='taxpayer',
+            name='search_name',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        # SQLite remakes the table to add the column, dropping the index
+        # created in 0029_taxpayer_filter_indexes
+        migrations.RunSQL(
+            sql=["CREATE INDEX IF NOT EXISTS taxpayer_workday_id ON supplier_app_taxpayer (workday_id) "
+                 "WHERE workday_id <> ''"],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunPython(set_search_names, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
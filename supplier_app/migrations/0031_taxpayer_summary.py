@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.24 on 2026-10-18 09:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from supplier_app.constants.eb_entities_status import CURRENT_STATUS
+
+
+def create_taxpayer_summaries(apps, schema_editor):
+    TaxPayer = apps.get_model('supplier_app', 'TaxPayer')
+    TaxPayerEBEntity = apps.get_model('supplier_app', 'TaxPayerEBEntity')
+    TaxPayerSummary = apps.get_model('supplier_app', 'TaxPayerSummary')
+
+    eb_entities = {}
+    current_eb_entities = TaxPayerEBEntity.objects.filter(status=CURRENT_STATUS).order_by('id').values_list(
+        'taxpayer_id',
+        'eb_entity__eb_name',
+    )
+    for taxpayer_id, eb_name in current_eb_entities.iterator():
+        eb_entities.setdefault(taxpayer_id, []).append(eb_name)
+
+    taxpayers = TaxPayer.objects.values_list(
+        'id',
+        'taxpayerargentina__cuit',
+        'taxpayerunitedstates__taxpayer_id_number',
+    )
+    TaxPayerSummary.objects.bulk_create(
+        (
+            TaxPayerSummary(
+                taxpayer_id=taxpayer_id,
+                identifier=cuit or taxpayer_id_number or '',
+                eb_entities=', '.join(eb_entities.get(taxpayer_id, [])),
+            )
+            for taxpayer_id, cuit, taxpayer_id_number in taxpayers.iterator()
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplier_app', '0030_search_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaxPayerSummary',
+            fields=[
+                ('taxpayer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='supplier_app.TaxPayer')),
+                ('identifier', models.CharField(blank=True, max_length=12)),
+                ('eb_entities', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_taxpayer_summaries, migrations.RunPython.noop),
+    ]
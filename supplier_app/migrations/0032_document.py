@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.24 on 2026-10-18 10:32
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+import utils.documents
+import utils.file_validator
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplier_app', '0031_taxpayer_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Document',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(db_index=True, max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        # The column does not change, SQLite would rebuild the tables and lose
+        # the indexes created with SQL
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='bankaccount',
+                name='bank_cbu_file',
+                field=utils.documents.DocumentFileField(upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.FileSizeValidator(code='invalid_file_size', limit_size=26214400)], verbose_name='Bank account certificate'),
+            ),
+            migrations.AlterField(
+                model_name='taxpayerargentina',
+                name='afip_no_retention_taxes_file',
+                field=utils.documents.DocumentFileField(blank=True, null=True, upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.FileSizeValidator(code='invalid_file_size', limit_size=26214400)], verbose_name='AFIP No Retention'),
+            ),
+            migrations.AlterField(
+                model_name='taxpayerargentina',
+                name='afip_registration_file',
+                field=utils.documents.DocumentFileField(upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.FileSizeValidator(code='invalid_file_size', limit_size=26214400)], verbose_name='AFIP registration certificate'),
+            ),
+            migrations.AlterField(
+                model_name='taxpayerargentina',
+                name='iibb_no_retention_taxes_file',
+                field=utils.documents.DocumentFileField(blank=True, null=True, upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.FileSizeValidator(code='invalid_file_size', limit_size=26214400)], verbose_name='IIBB No Retention'),
+            ),
+            migrations.AlterField(
+                model_name='taxpayerargentina',
+                name='iibb_registration_file',
+                field=utils.documents.DocumentFileField(blank=True, null=True, upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.FileSizeValidator(code='invalid_file_size', limit_size=26214400)], verbose_name='IIBB registration certificate'),
+            ),
+            migrations.AlterField(
+                model_name='taxpayerargentina',
+                name='witholding_suss_file',
+                field=utils.documents.DocumentFileField(blank=True, null=True, upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.FileSizeValidator(code='invalid_file_size', limit_size=26214400)], verbose_name='Certificate of no SUSS withholding'),
+            ),
+            migrations.AlterField(
+                model_name='taxpayerargentina',
+                name='witholding_taxes_file',
+                field=utils.documents.DocumentFileField(blank=True, null=True, upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.FileSizeValidator(code='invalid_file_size', limit_size=26214400)], verbose_name='Certificate of no income withholding'),
+            ),
+            migrations.AlterField(
+                model_name='taxpayerunitedstates',
+                name='w9_file',
+                field=utils.documents.DocumentFileField(upload_to='file', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf']), utils.file_validator.FileSizeValidator(code='invalid_file_size', limit_size=26214400)], verbose_name='W9 certificate'),
+            ),
+        ]),
+    ]
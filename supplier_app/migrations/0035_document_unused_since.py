@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.24 on 2026-10-18 11:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplier_app', '0034_document_upload_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='unused_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,4 +1,6 @@
+from collections import defaultdict
 import hashlib
+import json
 import uuid
 
 from django.conf import settings
@@ -8,7 +10,10 @@ from django.core.validators import (
     MinLengthValidator,
     RegexValidator,
 )
-from django.db import models
+from django.db import connections, models
+from django.db.models import Case, Value, When
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from simple_history.models import HistoricalRecords
@@ -21,6 +26,10 @@ from supplier_app import (
     PAYMENT_TYPES,
     TAXPAYER_CERTIFICATE_MAX_SIZE_FILE,
     TAXPAYER_ALLOWED_FILE_EXTENSIONS,
+    OUTBOX_STATUS,
+    OUTBOX_STATUS_PENDING,
+    DOCUMENT_STATUS,
+    DOCUMENT_STATUS_STORED,
 )
 from supplier_app.constants.payment_usa import (
     get_transaction_type_usa_info_choices,
@@ -47,7 +56,10 @@ from supplier_app.constants.payment_ar import (
     get_account_type_info_choices,
 )
 from supplier_app.constants.usa_taxpayer_id_type import get_usa_taxpayer_id_info_choices
-from utils.file_validator import FileSizeValidator
+from utils.documents import DocumentFileField
+from utils.file_validator import FileSizeValidator, PdfValidator
+from utils.reference_data import cached_reference_data
+from utils.search import create_sqlite_search_tables, normalize_search_text
 
 
 class EBEntity(models.Model):
@@ -69,10 +81,15 @@ class EBEntity(models.Model):
 class Company(models.Model):
     name = models.CharField(max_length=200, verbose_name=_("Name"))
     description = models.TextField()
+    search_name = models.CharField(max_length=200, blank=True, editable=False)
 
     def __str__(self):
         return self.name.capitalize()
 
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_search_text(self.name)
+        super().save(*args, **kwargs)
+
 
 class EBEntityCompany(models.Model):
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
@@ -121,6 +138,27 @@ class CompanyUniqueToken(models.Model):
         return hashlib.sha256(salt.encode('utf-8')).hexdigest()
 
 
+class TaxPayerQuerySet(models.QuerySet):
+
+    def get_children(self):
+        """
+        The taxpayers of the queryset as instances of their country model, in
+        the same order, with one query per country instead of one per row.
+        """
+        taxpayers = list(self)
+        ids_by_country = defaultdict(list)
+        for taxpayer in taxpayers:
+            if not isinstance(taxpayer, COUNTRIES[taxpayer.country]):
+                ids_by_country[taxpayer.country].append(taxpayer.id)
+        children = {}
+        for country, ids in ids_by_country.items():
+            children.update(COUNTRIES[country].objects.in_bulk(ids))
+        for taxpayer in taxpayers:
+            if taxpayer.id in children:
+                taxpayer._taxpayer_child = children[taxpayer.id]
+        return [taxpayer.get_taxpayer_child() for taxpayer in taxpayers]
+
+
 class TaxPayer(models.Model):
 
     workday_id = models.CharField(max_length=50)
@@ -139,11 +177,25 @@ class TaxPayer(models.Model):
     taxpayer_date = models.DateField(auto_now_add=True, verbose_name=_("Creation date"))
     new_comment_from_supplier = models.BooleanField(default=False)
     new_comment_from_ap = models.BooleanField(default=False)
-    history = HistoricalRecords(inherit=True)
+    search_name = models.CharField(max_length=200, blank=True, editable=False)
+    history = HistoricalRecords(inherit=True, excluded_fields=['search_name'])
+
+    objects = TaxPayerQuerySet.as_manager()
+
+    class Meta:
+        # The partial (non-unique) index on non-empty workday ids is created
+        # with SQL in migration 0029_taxpayer_filter_indexes.
+        index_together = [
+            ('taxpayer_state', 'taxpayer_date'),
+        ]
 
     def __str__(self):
         return self.business_name
 
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_search_text(self.business_name)
+        super().save(*args, **kwargs)
+
     @property
     def taxpayer_identifier(self):
         return self.get_taxpayer_child().get_taxpayer_identifier()
@@ -162,7 +214,16 @@ class TaxPayer(models.Model):
         return TAXPAYER_STATUS[self.taxpayer_state.title()]['css-class']
 
     def get_taxpayer_child(self):
-        return COUNTRIES[self.country].objects.get(pk=self.id)
+        """
+        The taxpayer as an instance of its country model. It is queried once
+        per instance, TaxPayerQuerySet.get_children loads it for many.
+        """
+        child_model = COUNTRIES[self.country]
+        if isinstance(self, child_model):
+            return self
+        if not hasattr(self, '_taxpayer_child'):
+            self._taxpayer_child = child_model.objects.get(pk=self.id)
+        return self._taxpayer_child
 
     def approve_taxpayer(self):
         self.taxpayer_state = TAXPAYER_STATUS['Approved']['choices'].value
@@ -265,7 +326,7 @@ class TaxPayerArgentina(TaxPayer):
         choices=PAYMENT_TERMS,
         verbose_name=_("Payment term")
     )
-    afip_registration_file = models.FileField(
+    afip_registration_file = DocumentFileField(
         upload_to='file',
         blank=False,
         verbose_name=_('AFIP registration certificate'),
@@ -275,10 +336,11 @@ class TaxPayerArgentina(TaxPayer):
                 limit_size=TAXPAYER_CERTIFICATE_MAX_SIZE_FILE,
                 code='invalid_file_size',
                 ),
+            PdfValidator(),
             ],
         )
     # Constancia de no Retencion
-    afip_no_retention_taxes_file = models.FileField(
+    afip_no_retention_taxes_file = DocumentFileField(
         upload_to='file',
         blank=True,
         null=True,
@@ -289,10 +351,11 @@ class TaxPayerArgentina(TaxPayer):
                 limit_size=TAXPAYER_CERTIFICATE_MAX_SIZE_FILE,
                 code='invalid_file_size',
             ),
+            PdfValidator(),
         ],
     )
     # IIBB Constancia de Inscripcion
-    iibb_registration_file = models.FileField(
+    iibb_registration_file = DocumentFileField(
         upload_to='file',
         blank=True,
         null=True,
@@ -303,10 +366,11 @@ class TaxPayerArgentina(TaxPayer):
                 limit_size=TAXPAYER_CERTIFICATE_MAX_SIZE_FILE,
                 code='invalid_file_size',
             ),
+            PdfValidator(),
         ],
     )
     # Constancia de no Retencion IIBB
-    iibb_no_retention_taxes_file = models.FileField(
+    iibb_no_retention_taxes_file = DocumentFileField(
         upload_to='file',
         blank=True,
         null=True,
@@ -317,9 +381,10 @@ class TaxPayerArgentina(TaxPayer):
                 limit_size=TAXPAYER_CERTIFICATE_MAX_SIZE_FILE,
                 code='invalid_file_size',
             ),
+            PdfValidator(),
         ],
     )
-    witholding_taxes_file = models.FileField(
+    witholding_taxes_file = DocumentFileField(
         upload_to='file',
         blank=True,
         null=True,
@@ -330,9 +395,10 @@ class TaxPayerArgentina(TaxPayer):
                 limit_size=TAXPAYER_CERTIFICATE_MAX_SIZE_FILE,
                 code='invalid_file_size',
             ),
+            PdfValidator(),
         ],
     )
-    witholding_suss_file = models.FileField(
+    witholding_suss_file = DocumentFileField(
         upload_to='file',
         blank=True,
         null=True,
@@ -343,6 +409,7 @@ class TaxPayerArgentina(TaxPayer):
                 limit_size=TAXPAYER_CERTIFICATE_MAX_SIZE_FILE,
                 code='invalid_file_size',
             ),
+            PdfValidator(),
         ],
     )
 
@@ -378,7 +445,7 @@ class TaxPayerUnitedStates(TaxPayer):
         choices=PAYMENT_TERMS,
         verbose_name=_("Payment term")
     )
-    w9_file = models.FileField(
+    w9_file = DocumentFileField(
         upload_to='file',
         blank=False,
         verbose_name=_('W9 certificate'),
@@ -388,6 +455,7 @@ class TaxPayerUnitedStates(TaxPayer):
                 limit_size=TAXPAYER_CERTIFICATE_MAX_SIZE_FILE,
                 code='invalid_file_size',
                 ),
+            PdfValidator(),
             ],
         )
 
@@ -401,6 +469,22 @@ COUNTRIES = {
 }
 
 
+class TaxPayerSummary(models.Model):
+    """
+    The columns of the AP taxpayer list that live in other tables, one row
+    per taxpayer so the list is loaded with a single join. Kept up to date
+    by the signals at the end of this module.
+    """
+    taxpayer = models.OneToOneField(
+        TaxPayer,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='summary',
+    )
+    identifier = models.CharField(max_length=12, blank=True)
+    eb_entities = models.TextField(blank=True)
+
+
 class Address(models.Model):
     street = models.CharField(
         max_length=100,
@@ -465,7 +549,7 @@ class BankAccount(models.Model):
         on_delete=models.CASCADE,
         default=None
     )
-    bank_cbu_file = models.FileField(
+    bank_cbu_file = DocumentFileField(
         upload_to='file',
         blank=False,
         verbose_name=_('Bank account certificate'),
@@ -475,6 +559,7 @@ class BankAccount(models.Model):
                 limit_size=BANK_ACCOUNT_MAX_SIZE_FILE,
                 code='invalid_file_size',
             ),
+            PdfValidator(),
         ],
     )
     bank_transaction_type = models.IntegerField(
@@ -575,3 +660,164 @@ class TaxpayerComment(models.Model):
 
     class Meta:
         ordering = ['-comment_date_received']
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent. Rows are written in the same transaction
+    as the change that triggers them and sent later by drain_email_outbox,
+    so a rolled back change never sends its email.
+    """
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    recipients = models.TextField()
+    status = models.CharField(
+        max_length=10,
+        choices=OUTBOX_STATUS,
+        default=OUTBOX_STATUS_PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    smtp_host = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        index_together = [
+            ('status', 'next_attempt_at'),
+            ('smtp_host', 'sent_at'),
+        ]
+
+    def get_recipients(self):
+        return json.loads(self.recipients)
+
+
+class Document(models.Model):
+    """
+    A file stored by a DocumentFileField, by the SHA-256 of its content. The
+    rows using it keep its name, see utils.documents.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, db_index=True)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Pending documents are in the upload spool, upload_pending_documents
+    # pushes them to the storage
+    status = models.CharField(
+        max_length=10,
+        choices=DOCUMENT_STATUS,
+        default=DOCUMENT_STATUS_STORED,
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # First time prune_documents found it unused, None while it is used
+    unused_since = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = [
+            ('status', 'next_attempt_at'),
+        ]
+
+
+@cached_reference_data('taxpayer_names', ['supplier_app.TaxPayer'])
+def get_taxpayer_names():
+    """
+    Return the business names of every taxpayer, sorted and without repeats.
+
+    The list feeds the organization datalist of the invoice filters.
+    """
+    return list(
+        TaxPayer.objects.order_by('business_name').values_list('business_name', flat=True).distinct()
+    )
+
+
+@cached_reference_data('company_names', ['supplier_app.Company'])
+def get_company_names():
+    return list(Company.objects.order_by('name').values_list('name', flat=True))
+
+
+@cached_reference_data('eb_entities', ['supplier_app.EBEntity'])
+def get_eb_entities():
+    return list(EBEntity.objects.order_by('id'))
+
+
+def get_eb_entity(pk):
+    """The EB entity with pk, read from get_eb_entities"""
+    for eb_entity in get_eb_entities():
+        if str(eb_entity.pk) == str(pk):
+            return eb_entity
+    raise EBEntity.DoesNotExist('EBEntity matching query does not exist.')
+
+
+@receiver(post_migrate)
+def create_search_tables(sender, using, **kwargs):
+    # PostgreSQL gets its search indexes from the migrations, SQLite needs
+    # them back after every migrate (see create_sqlite_search_tables)
+    if sender.name == 'supplier_app' and connections[using].vendor == 'sqlite':
+        create_sqlite_search_tables(using)
+
+
+def get_current_eb_entity_names(taxpayer_id):
+    return get_current_eb_entity_names_by_taxpayer([taxpayer_id])[taxpayer_id]
+
+
+def get_current_eb_entity_names_by_taxpayer(taxpayer_ids):
+    names = defaultdict(list)
+    taxpayer_eb_entities = TaxPayerEBEntity.objects.filter(
+        taxpayer_id__in=taxpayer_ids,
+        status=CURRENT_STATUS,
+    ).order_by('id').values_list('taxpayer_id', 'eb_entity__eb_name')
+    for taxpayer_id, eb_name in taxpayer_eb_entities:
+        names[taxpayer_id].append(eb_name)
+    return {taxpayer_id: ', '.join(names[taxpayer_id]) for taxpayer_id in taxpayer_ids}
+
+
+def update_summary_eb_entities(*taxpayer_ids):
+    """Recompute the eb_entities of the summaries of taxpayer_ids in one update"""
+    if not taxpayer_ids:
+        return
+    names = get_current_eb_entity_names_by_taxpayer(taxpayer_ids)
+    TaxPayerSummary.objects.filter(taxpayer_id__in=taxpayer_ids).update(
+        eb_entities=Case(
+            *[When(taxpayer_id=taxpayer_id, then=Value(eb_names)) for taxpayer_id, eb_names in names.items()],
+            output_field=models.TextField(),
+        ),
+    )
+
+
+def save_taxpayer_summary(sender, instance, created, raw=False, **kwargs):
+    # Saving the base TaxPayer (as the status changes do) can not change the
+    # identifier, which belongs to the country models
+    if raw or not (created or sender in COUNTRIES.values()):
+        return
+    identifier = instance.get_taxpayer_identifier() if sender in COUNTRIES.values() else ''
+    TaxPayerSummary.objects.update_or_create(
+        taxpayer_id=instance.id,
+        defaults={
+            'identifier': identifier,
+            'eb_entities': get_current_eb_entity_names(instance.id),
+        },
+    )
+
+
+for taxpayer_model in [TaxPayer, *COUNTRIES.values()]:
+    post_save.connect(save_taxpayer_summary, sender=taxpayer_model)
+
+
+@receiver([post_save, post_delete], sender=TaxPayerEBEntity)
+def update_summary_on_taxpayer_eb_entity_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_summary_eb_entities(instance.taxpayer_id)
+
+
+@receiver(post_save, sender=EBEntity)
+def update_summary_on_eb_entity_rename(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    update_summary_eb_entities(*TaxPayerEBEntity.objects.filter(
+        eb_entity=instance,
+        status=CURRENT_STATUS,
+    ).values_list('taxpayer_id', flat=True).distinct())
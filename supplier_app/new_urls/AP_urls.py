@@ -10,7 +10,10 @@ from supplier_app.views import (
     BuyerTaxpayersList,
     CompanyManage,
     change_user_status,
-    export_to_xlsx_taxpayer)
+    export_taxpayer_pdf_pack,
+    export_to_xlsx_taxpayer,
+    export_to_xlsx_taxpayer_job,
+)
 
 from users_app.views import (
     AdminList,
@@ -36,7 +39,9 @@ taxpayer_pattern = [
 admins_pattern = [
     url(r'^$', AdminList.as_view(), name='manage-admins'),
     url(r'^create/$', CreateAdmin.as_view(), name='create-admin'),
+    url(r'^xls_taxpayer/job/$', export_to_xlsx_taxpayer_job, name='taxpayer-to-xls-job'),
     url(r'^xls_taxpayer/', export_to_xlsx_taxpayer, name='taxpayer-to-xls'),
+    url(r'^pdf_taxpayer/$', export_taxpayer_pdf_pack, name='taxpayer-pdf-pack'),
     url(r'^(?P<pk>[0-9]+)/change-ap-permission$', change_ap_permission, name='change-ap-permission'),
 ]
 
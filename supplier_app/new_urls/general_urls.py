@@ -7,7 +7,8 @@ from supplier_app.views import (
     SupplierDetailsView,
     TaxpayerCommentView,
     EditContactInformationView,
-    GeneratePdf
+    GeneratePdf,
+    TaxpayerFileView,
 )
 
 taxpayer_pattern = [
@@ -34,6 +35,7 @@ taxpayer_pattern = [
     ),
     url(r'^edit/$', EditTaxpayerView.as_view(), name='taxpayer-update'),
     url(r'^pdf/', GeneratePdf.as_view(), name='pdf-web'),
+    url(r'^file/(?P<field_name>\w+)/$', TaxpayerFileView.as_view(), name='taxpayer-file'),
 ]
 
 urlpatterns = [
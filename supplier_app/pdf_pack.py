@@ -0,0 +1,107 @@
+"""
+PDF pack: a ZIP with the registration PDF and the stored files (AFIP, W9,
+CBU...) of every taxpayer of a TaxPayerFilter, for audits.
+
+The ZIP is written while the response streams it, one file at a time, and
+the taxpayers are read REGISTRATION_PDF_PACK_CHUNK_SIZE at a time, so the
+memory used does not grow with the number of taxpayers. The registration
+PDFs not stored yet are rendered for each chunk by render_registration_pdfs.
+"""
+import logging
+from os import path
+import zipfile
+
+from django.core.files.storage import default_storage
+from django.db.models import FileField, prefetch_related_objects
+from django.utils.text import slugify
+
+from supplier_app import REGISTRATION_PDF_PACK_CHUNK_SIZE
+from supplier_app.models import TaxPayer
+from supplier_app.registration_pdf import render_registration_pdfs
+
+logger = logging.getLogger(__name__)
+
+
+class _ZipStream:
+    """
+    Write-only file for ZipFile, keeping what is written until the response
+    takes it with pop(). It is not seekable, so ZipFile writes each entry
+    sizes after its data instead of going back to its header.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def get_taxpayer_files(taxpayer):
+    """(field name, file) of the files of the taxpayer and its bank accounts"""
+    instances = [taxpayer] + list(taxpayer.bankaccount_set.all())
+    return [
+        (field.name, getattr(instance, field.name))
+        for instance in instances
+        for field in instance._meta.get_fields()
+        if isinstance(field, FileField) and getattr(instance, field.name)
+    ]
+
+
+def _write_file(zip_file, name, stored_file):
+    try:
+        stored_file.open('rb')
+    except (IOError, OSError):
+        logger.warning('The file %s is missing from the storage', stored_file.name)
+        return
+    with stored_file, zip_file.open(name, 'w', force_zip64=True) as entry:
+        for chunk in stored_file.chunks():
+            entry.write(chunk)
+
+
+def _chunks(queryset, size):
+    """The ids of queryset, size at a time"""
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def iter_pdf_pack(taxpayers, language):
+    """
+    Yield the ZIP with the registration PDF in language and the stored
+    files of the taxpayers queryset, in chunks, one folder per taxpayer.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for taxpayer_ids in _chunks(taxpayers, REGISTRATION_PDF_PACK_CHUNK_SIZE):
+            pdf_names = render_registration_pdfs(taxpayer_ids, language)
+            children = TaxPayer.objects.filter(id__in=taxpayer_ids).order_by('id').get_children()
+            prefetch_related_objects(children, 'bankaccount_set')
+            for taxpayer in children:
+                folder = '{}-{}'.format(taxpayer.id, slugify(taxpayer.business_name))
+                if taxpayer.id in pdf_names:
+                    _write_file(
+                        zip_file,
+                        '{}/registration.pdf'.format(folder),
+                        default_storage.open(pdf_names[taxpayer.id]),
+                    )
+                for field_name, stored_file in get_taxpayer_files(taxpayer):
+                    _write_file(
+                        zip_file,
+                        '{}/{}-{}'.format(folder, field_name, path.basename(stored_file.name)),
+                        stored_file,
+                    )
+                yield stream.pop()
+    yield stream.pop()
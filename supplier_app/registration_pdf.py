@@ -0,0 +1,170 @@
+"""
+Registration PDF of a taxpayer, the one downloaded from its details.
+
+xhtml2pdf is CPU heavy, so the PDFs are rendered by the celery workers,
+or by a process pool for the PDF packs, and kept in the default storage.
+The name of each PDF is a hash of the latest historical record of the
+taxpayer and of every model shown in it, of the values shown from the
+models without history, and of the language: any change makes a new
+name, so a stored PDF is never stale and downloading it again does not
+render it again.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import OuterRef, Subquery
+from django.template.loader import get_template
+from django.utils import translation
+
+from supplier_app import (
+    REGISTRATION_PDF_DIRECTORY,
+    REGISTRATION_PDF_TEMPLATE,
+)
+from supplier_app.constants.taxpayer_status import TAXPAYER_STATUS_APPROVED
+from supplier_app.models import (
+    COUNTRIES,
+    Address,
+    BankAccount,
+    ContactInformation,
+    InvitingBuyer,
+    TaxPayer,
+)
+from utils.htmltopdf import htmls_to_pdfs
+
+logger = logging.getLogger(__name__)
+
+
+def _get_latest_history_id(model, taxpayer_field):
+    return Subquery(
+        model.history.filter(
+            **{taxpayer_field: OuterRef('id')}
+        ).order_by('-history_id').values('history_id')[:1]
+    )
+
+
+def _get_inviting_buyer(field):
+    return Subquery(
+        InvitingBuyer.objects.filter(company=OuterRef('company_id')).order_by('-id').values(field)[:1]
+    )
+
+
+def get_registration_pdf_versions(taxpayers):
+    """
+    Values of the taxpayers queryset with their id, the latest history id of
+    each one and of the models in its PDF, and the values shown in it from
+    the models without history.
+    """
+    models = [(model, 'id') for model in [TaxPayer, *COUNTRIES.values()]]
+    models += [(model, 'taxpayer_id') for model in (Address, ContactInformation, BankAccount)]
+    versions = {
+        '{}_history_id'.format(model._meta.model_name): _get_latest_history_id(model, taxpayer_field)
+        for model, taxpayer_field in models
+    }
+    # The summary keeps the names of the current EB entities
+    versions['inviting_buyer_id'] = _get_inviting_buyer('id')
+    versions['inviting_buyer_email'] = _get_inviting_buyer('inviting_buyer__email')
+    return taxpayers.values('id', 'company__name', 'summary__eb_entities', **versions)
+
+
+def get_registration_pdf_name(versions, taxpayer_id, language):
+    digest = hashlib.sha256(
+        repr([REGISTRATION_PDF_TEMPLATE, language, sorted(versions.items())]).encode()
+    ).hexdigest()
+    return '{}/{}.pdf'.format(_get_registration_pdf_directory(taxpayer_id, language), digest)
+
+
+def get_registration_pdf_context(taxpayer_id):
+    taxpayer = TaxPayer.objects.select_related('company').get(pk=taxpayer_id).get_taxpayer_child()
+    # History is ordered from the newest record, the last one is the creation
+    supplier = type(taxpayer).history.filter(id=taxpayer.id).select_related('history_user').last()
+    approved_object = TaxPayer.history.filter(
+        id=taxpayer.id,
+        taxpayer_state=TAXPAYER_STATUS_APPROVED,
+    ).select_related('history_user').first()
+    return {
+        'company': taxpayer.company,
+        'buyer': InvitingBuyer.objects.select_related('inviting_buyer').get(company=taxpayer.company_id),
+        'supplier': supplier,
+        'approved_object': approved_object,
+        'approved_by': approved_object.history_user if approved_object else None,
+        'taxpayer': taxpayer,
+        'taxpayer_address': taxpayer.address_set.get(),
+        'taxpayer_contact': taxpayer.contactinformation_set.get(),
+        'taxpayer_bank_account': taxpayer.bankaccount_set.get(),
+    }
+
+
+def _get_registration_pdf_directory(taxpayer_id, language):
+    return '{}/{}/{}'.format(REGISTRATION_PDF_DIRECTORY, taxpayer_id, language)
+
+
+def _list_registration_pdfs(taxpayer_id, language):
+    directory = _get_registration_pdf_directory(taxpayer_id, language)
+    if not default_storage.exists(directory):
+        return []
+    _, file_names = default_storage.listdir(directory)
+    return ['{}/{}'.format(directory, file_name) for file_name in file_names]
+
+
+def get_registration_pdf_names(taxpayer_ids, language):
+    """Name of the registration PDF of each taxpayer, stored or not"""
+    return {
+        versions['id']: get_registration_pdf_name(versions, versions['id'], language)
+        for versions in get_registration_pdf_versions(TaxPayer.objects.filter(id__in=taxpayer_ids))
+    }
+
+
+def render_registration_pdfs(taxpayer_ids, language):
+    """
+    Render the registration PDFs of the taxpayers in language that are not
+    stored yet and store them, replacing the older ones. The templates are
+    rendered here and converted to PDF by REGISTRATION_PDF_WORKERS
+    processes. Returns the stored name of each taxpayer, without the ones
+    missing data for the PDF or xhtml2pdf failed to convert.
+
+    Only the PDFs listed before reading the versions are replaced, a worker
+    rendering a newer version meanwhile keeps its PDF.
+    """
+    template = get_template(REGISTRATION_PDF_TEMPLATE)
+    with translation.override(language):
+        names = get_registration_pdf_names(taxpayer_ids, language)
+        stored_names = {
+            taxpayer_id: name for taxpayer_id, name in names.items()
+            if default_storage.exists(name)
+        }
+        old_names = {
+            taxpayer_id: _list_registration_pdfs(taxpayer_id, language)
+            for taxpayer_id in names if taxpayer_id not in stored_names
+        }
+        names.update(get_registration_pdf_names(old_names, language))
+        missing_ids, htmls = [], []
+        for taxpayer_id in old_names:
+            if names[taxpayer_id] in old_names[taxpayer_id]:
+                stored_names[taxpayer_id] = names[taxpayer_id]
+                continue
+            try:
+                context = get_registration_pdf_context(taxpayer_id)
+            except ObjectDoesNotExist:
+                logger.warning('Taxpayer %s is missing data of its registration PDF', taxpayer_id)
+                continue
+            missing_ids.append(taxpayer_id)
+            htmls.append(template.render(context))
+    for taxpayer_id, pdf in zip(missing_ids, htmls_to_pdfs(htmls, settings.REGISTRATION_PDF_WORKERS)):
+        if pdf is None:
+            continue
+        stored_names[taxpayer_id] = default_storage.save(names[taxpayer_id], ContentFile(pdf))
+        for old_name in old_names[taxpayer_id]:
+            default_storage.delete(old_name)
+    return stored_names
+
+
+def render_registration_pdf(taxpayer_id, language):
+    """
+    render_registration_pdfs of a single taxpayer. Returns its name, or
+    None when it could not be rendered.
+    """
+    return render_registration_pdfs([taxpayer_id], language).get(taxpayer_id)
@@ -0,0 +1,230 @@
+from datetime import timedelta
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from supplier_app import (
+    DOCUMENT_STATUS_FAILED,
+    DOCUMENT_STATUS_PENDING,
+    DOCUMENT_STATUS_STORED,
+    DOCUMENT_UPLOAD_BATCH_SIZE,
+    DOCUMENT_UPLOAD_LEASE_SECONDS,
+    DOCUMENT_UPLOAD_MAX_ATTEMPTS,
+    DOCUMENT_UPLOAD_RETRY_BASE_DELAY,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_LEASE_SECONDS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_BASE_DELAY,
+    OUTBOX_STATUS_FAILED,
+    OUTBOX_STATUS_PENDING,
+    OUTBOX_STATUS_SENT,
+    REGISTRATION_PDF_RENDER_LOCK_TIMEOUT,
+)
+from supplier_app.models import Document, OutboxEmail
+from supplier_app.registration_pdf import render_registration_pdf
+from utils.documents import rename_document
+from utils.send_email import build_email, get_email_connection
+from utils.upload_spool import get_spool_storage
+
+logger = logging.getLogger(__name__)
+
+
+def get_retry_delay(attempts):
+    return timedelta(seconds=OUTBOX_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+
+
+def _get_smtp_host():
+    return settings.EMAIL_HOST or ''
+
+
+def _get_send_quota(smtp_host, now):
+    sent_last_minute = OutboxEmail.objects.filter(
+        smtp_host=smtp_host,
+        sent_at__gt=now - timedelta(minutes=1),
+    ).count()
+    return max(settings.EMAIL_OUTBOX_RATE_LIMIT_PER_MINUTE - sent_last_minute, 0)
+
+
+def _claim_outbox_emails(limit, now):
+    """
+    Pick the due emails and push their next attempt past the lease, so a
+    drain running at the same time does not pick them too.
+    """
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True).filter(
+                status=OUTBOX_STATUS_PENDING,
+                next_attempt_at__lte=now,
+            ).order_by('next_attempt_at', 'id')[:limit]
+        )
+        OutboxEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+        )
+    return emails
+
+
+def _mark_failed_attempt(outbox_email, error, now):
+    attempts = outbox_email.attempts + 1
+    OutboxEmail.objects.filter(id=outbox_email.id).update(
+        attempts=attempts,
+        last_error=str(error),
+        status=OUTBOX_STATUS_FAILED if attempts >= OUTBOX_MAX_ATTEMPTS else OUTBOX_STATUS_PENDING,
+        next_attempt_at=now + get_retry_delay(attempts),
+    )
+
+
+@shared_task(ignore_result=True)
+def drain_email_outbox():
+    """
+    Send the due outbox emails over one connection, without going over
+    EMAIL_OUTBOX_RATE_LIMIT_PER_MINUTE for the SMTP host. Failed emails are
+    retried with an exponential backoff until OUTBOX_MAX_ATTEMPTS.
+    """
+    now = timezone.now()
+    smtp_host = _get_smtp_host()
+    limit = min(OUTBOX_BATCH_SIZE, _get_send_quota(smtp_host, now))
+    if not limit:
+        return
+    outbox_emails = _claim_outbox_emails(limit, now)
+    if not outbox_emails:
+        return
+
+    connection = get_email_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        for outbox_email in outbox_emails:
+            _mark_failed_attempt(outbox_email, error, now)
+        return
+    sent = 0
+    try:
+        for outbox_email in outbox_emails:
+            email = build_email(
+                outbox_email.subject,
+                outbox_email.message,
+                outbox_email.get_recipients(),
+                connection,
+            )
+            try:
+                email.send()
+            except Exception as error:
+                _mark_failed_attempt(outbox_email, error, now)
+                continue
+            OutboxEmail.objects.filter(id=outbox_email.id).update(
+                status=OUTBOX_STATUS_SENT,
+                attempts=outbox_email.attempts + 1,
+                smtp_host=smtp_host,
+                sent_at=timezone.now(),
+            )
+            sent += 1
+    finally:
+        connection.close()
+    logger.info('Sent %s of %s outbox emails through %s', sent, len(outbox_emails), smtp_host)
+
+
+def _get_registration_pdf_lock_key(taxpayer_id, language):
+    return 'registration_pdf_render_{}_{}'.format(taxpayer_id, language)
+
+
+def _get_registration_pdf_failed_key(taxpayer_id, language):
+    return 'registration_pdf_failed_{}_{}'.format(taxpayer_id, language)
+
+
+def has_registration_pdf_failed(taxpayer_id, language):
+    """Whether the last render of the registration PDF could not render it"""
+    return bool(cache.get(_get_registration_pdf_failed_key(taxpayer_id, language)))
+
+
+def queue_registration_pdf(taxpayer_id, language=None):
+    """
+    Render the registration PDF of the taxpayer in the background, in
+    language or in every one of LANGUAGES. A render already queued is not
+    queued again, queueing it again after a failed render retries it.
+    """
+    languages = [language] if language else [code for code, _ in settings.LANGUAGES]
+    for language in languages:
+        if cache.add(_get_registration_pdf_lock_key(taxpayer_id, language), True, REGISTRATION_PDF_RENDER_LOCK_TIMEOUT):
+            cache.delete(_get_registration_pdf_failed_key(taxpayer_id, language))
+            render_taxpayer_registration_pdf.apply_async([taxpayer_id, language])
+
+
+@shared_task(ignore_result=True)
+def render_taxpayer_registration_pdf(taxpayer_id, language):
+    try:
+        if render_registration_pdf(taxpayer_id, language) is None:
+            logger.error('The registration PDF of taxpayer %s could not be rendered', taxpayer_id)
+            # Kept for as long as the render lock, for the page polling it
+            cache.set(
+                _get_registration_pdf_failed_key(taxpayer_id, language),
+                True,
+                REGISTRATION_PDF_RENDER_LOCK_TIMEOUT,
+            )
+    finally:
+        cache.delete(_get_registration_pdf_lock_key(taxpayer_id, language))
+
+
+def _claim_pending_documents(limit, now):
+    """Same as _claim_outbox_emails, for the spooled documents"""
+    with transaction.atomic():
+        documents = list(
+            Document.objects.select_for_update(skip_locked=True).filter(
+                status=DOCUMENT_STATUS_PENDING,
+                next_attempt_at__lte=now,
+            ).order_by('next_attempt_at', 'id')[:limit]
+        )
+        Document.objects.filter(id__in=[document.id for document in documents]).update(
+            next_attempt_at=now + timedelta(seconds=DOCUMENT_UPLOAD_LEASE_SECONDS),
+        )
+    return documents
+
+
+def _mark_failed_upload(document, error, now):
+    attempts = document.attempts + 1
+    Document.objects.filter(id=document.id).update(
+        attempts=attempts,
+        last_error=str(error),
+        status=DOCUMENT_STATUS_FAILED if attempts >= DOCUMENT_UPLOAD_MAX_ATTEMPTS else DOCUMENT_STATUS_PENDING,
+        next_attempt_at=now + timedelta(seconds=DOCUMENT_UPLOAD_RETRY_BASE_DELAY * 2 ** (attempts - 1)),
+    )
+
+
+@shared_task(ignore_result=True)
+def upload_pending_documents():
+    """
+    Push the due documents of the upload spool to the default storage and
+    delete them from the spool. A document the storage saved with another
+    name is renamed in the rows using it. Failed uploads are retried with an
+    exponential backoff until DOCUMENT_UPLOAD_MAX_ATTEMPTS.
+    """
+    spool = get_spool_storage()
+    if spool is None:
+        return
+    now = timezone.now()
+    documents = _claim_pending_documents(DOCUMENT_UPLOAD_BATCH_SIZE, now)
+    uploaded = 0
+    for document in documents:
+        spooled_name = document.name
+        try:
+            with spool.open(spooled_name, 'rb') as spooled_file:
+                name = default_storage.save(spooled_name, spooled_file)
+        except Exception as error:
+            logger.warning('Upload of the document %s failed: %s', spooled_name, error)
+            _mark_failed_upload(document, error, now)
+            continue
+        with transaction.atomic():
+            if name != spooled_name:
+                rename_document(document, name)
+            Document.objects.filter(id=document.id).update(
+                status=DOCUMENT_STATUS_STORED,
+                attempts=document.attempts + 1,
+                last_error='',
+            )
+        spool.delete(spooled_name)
+        uploaded += 1
+    if documents:
+        logger.info('Uploaded %s of %s spooled documents', uploaded, len(documents))
@@ -1,6 +1,12 @@
-from django.core.files import File
+from io import BytesIO
+from shutil import rmtree
+import tempfile
 from unittest.mock import MagicMock
 
+from django.core.files import File
+from django.test import override_settings
+from PyPDF2 import PdfFileWriter
+
 from supplier_app import (
     PAYMENT_TERMS,
     PAYMENT_TYPES,
@@ -13,7 +19,43 @@ from supplier_app.constants.payment_ar import (
 BUSINESS_EXAMPLE_NAME_1 = 'Pyme 1'
 BUSINESS_EXAMPLE_NAME_2 = 'Pyme 2'
 
-file_mock = MagicMock(spec=File)
+
+def get_pdf_content(width=72):
+    writer = PdfFileWriter()
+    writer.addBlankPage(width, 72)
+    content = BytesIO()
+    writer.write(content)
+    return content.getvalue()
+
+
+def get_temp_dir(test_case):
+    """New temporary directory, removed with its files when test_case ends"""
+    directory = tempfile.mkdtemp()
+    test_case.addCleanup(rmtree, directory)
+    return directory
+
+
+def use_temp_media_root(test_case, **settings):
+    """
+    Store the files saved by test_case in a temporary MEDIA_ROOT, with
+    settings also overridden until it ends. Returns the MEDIA_ROOT.
+    """
+    media_root = get_temp_dir(test_case)
+    media_settings = override_settings(MEDIA_ROOT=media_root, **settings)
+    media_settings.enable()
+    test_case.addCleanup(media_settings.disable)
+    return media_root
+
+
+def get_pdf_file_mock():
+    """File mock with the content of a valid PDF, checked by PdfValidator"""
+    pdf_file_mock = MagicMock(spec=File)
+    pdf_file_mock.read.return_value = get_pdf_content()
+    pdf_file_mock.chunks.return_value = [pdf_file_mock.read.return_value]
+    return pdf_file_mock
+
+
+file_mock = get_pdf_file_mock()
 file_mock.name = 'test.pdf'
 file_mock.size = 50
 
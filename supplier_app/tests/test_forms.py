@@ -3,13 +3,9 @@ from os import (
 )
 from parameterized import parameterized
 from shutil import rmtree
-from unittest.mock import (
-    MagicMock,
-    patch,
-)
+from unittest.mock import patch
 
 from django.contrib.auth.models import Group
-from django.core.files import File
 from django.http import (
     HttpResponseRedirect,
     QueryDict
@@ -23,6 +19,7 @@ from django.test import (
 from django.utils.datastructures import MultiValueDict
 
 from supplier_app.tests import (
+    get_pdf_file_mock,
     taxpayer_creation_POST_factory,
     get_bank_info_example,
 )
@@ -77,7 +74,7 @@ class TestTaxPayerFormValidation(TestCase):
         self.eb_entity = EBEntityFactory()
         self.client = Client()
         self.factory = RequestFactory()
-        self.file_mock = MagicMock(spec=File)
+        self.file_mock = get_pdf_file_mock()
         self.file_mock.name = 'test.pdf'
         self.file_mock.size = 50
         self.create_taxpayer_view = CreateTaxPayerView()
@@ -177,7 +174,7 @@ class TestTaxPayerFormValidation(TestCase):
             data=self.POST
         )
         request.user = self.user_with_eb_social
-        file_mock = MagicMock(spec=File)
+        file_mock = get_pdf_file_mock()
         file_mock.name = 'other.pdf'
         file_mock.size = param_size
         request.FILES.update(self._get_request_FILES(**{attr: file_mock}))
@@ -204,7 +201,7 @@ class TestTaxPayerFormValidation(TestCase):
             data=self.POST
         )
         request.user = self.user_with_eb_social
-        file_mock = MagicMock(spec=File)
+        file_mock = get_pdf_file_mock()
         file_mock.name = param_name
         file_mock.size = 50
         request.FILES.update(self._get_request_FILES(**{attr: file_mock}))
@@ -18,9 +18,11 @@ from supplier_app.models import (
     TaxPayer,
     TaxpayerComment,
     TaxPayerEBEntity,
+    TaxPayerSummary,
     ContactInformation,
     TaxPayerUnitedStates,
     BankAccountUnitedStates,
+    get_taxpayer_names,
 )
 from supplier_app.tests.factory_boy import (
     AddressFactory,
@@ -69,6 +71,14 @@ class TestTaxpayerModel(TestCase):
         )
         self.assertEqual(self.taxpayer_without_eb_entities.get_eb_entity, self.taxpayer_eb_entity_2.eb_entity.eb_name)
 
+    def test_taxpayer_names_are_cached_until_a_taxpayer_changes(self):
+        self.assertIn(self.taxpayer.business_name, get_taxpayer_names())
+        with self.assertNumQueries(0):
+            get_taxpayer_names()
+        self.taxpayer_without_eb_entities.business_name = 'Renamed organization'
+        self.taxpayer_without_eb_entities.save()
+        self.assertIn('Renamed organization', get_taxpayer_names())
+
     def test_taxpayer_creation_first_time_should_have_PENDING_status(self):
         self.assertEqual(self.taxpayer.taxpayer_state, "PENDING")
 
@@ -86,6 +96,27 @@ class TestTaxpayerModel(TestCase):
             taxpayer_arg
         )
 
+    def test_get_taxpayer_child_is_queried_once(self):
+        taxpayer_arg = TaxPayerArgentinaFactory(company=self.company)
+        taxpayer = TaxPayer.objects.get(pk=taxpayer_arg.id)
+        with self.assertNumQueries(1):
+            taxpayer.get_taxpayer_child()
+            taxpayer.get_taxpayer_child()
+        with self.assertNumQueries(0):
+            self.assertIs(taxpayer_arg.get_taxpayer_child(), taxpayer_arg)
+
+    def test_get_children_queries_once_per_country(self):
+        company = CompanyFactory()
+        taxpayer_arg = TaxPayerArgentinaFactory(company=company)
+        taxpayer_usa = TaxPayerUnitedStatedFactory(company=company, country='USA')
+        taxpayer_arg_2 = TaxPayerArgentinaFactory(company=company)
+        with self.assertNumQueries(3):
+            children = TaxPayer.objects.filter(company=company).order_by('id').get_children()
+        self.assertEqual(children, [taxpayer_arg, taxpayer_usa, taxpayer_arg_2])
+        self.assertIsInstance(children[1], TaxPayerUnitedStates)
+        with self.assertNumQueries(0):
+            self.assertEqual(children[1].get_taxpayer_identifier(), taxpayer_usa.taxpayer_id_number)
+
     def test_taxpayer_has_workday_id(self):
         self.assertTrue(self.taxpayer.has_workday_id())
 
@@ -175,6 +206,60 @@ class TestTaxpayerModel(TestCase):
         self.assertEqual(TaxPayerUnitedStates.objects.last(), taxpayer_usa)
 
 
+class TestTaxPayerSummary(TestCase):
+    def setUp(self):
+        self.taxpayer = TaxPayerArgentinaFactory()
+        self.taxpayer_eb_entity = TaxPayerEBEntityFactory(taxpayer=self.taxpayer)
+
+    def test_summary_has_identifier_and_current_eb_entities(self):
+        summary = TaxPayerSummary.objects.get(taxpayer=self.taxpayer)
+        self.assertEqual(summary.identifier, self.taxpayer.cuit)
+        self.assertEqual(summary.eb_entities, self.taxpayer_eb_entity.eb_entity.eb_name)
+
+    def test_summary_of_taxpayer_usa_has_taxpayer_id_number(self):
+        taxpayer_usa = TaxPayerUnitedStatedFactory()
+        self.assertEqual(taxpayer_usa.summary.identifier, taxpayer_usa.taxpayer_id_number)
+
+    def test_summary_follows_identifier_changes(self):
+        self.taxpayer.cuit = '20111111112'
+        self.taxpayer.save()
+        self.assertEqual(TaxPayerSummary.objects.get(taxpayer=self.taxpayer).identifier, '20111111112')
+
+    def test_summary_follows_current_eb_entities(self):
+        eb_entity = EBEntityFactory()
+        self.taxpayer.set_current_eb_entities([eb_entity])
+        self.assertEqual(TaxPayerSummary.objects.get(taxpayer=self.taxpayer).eb_entities, eb_entity.eb_name)
+        self.taxpayer.taxpayerebentity_set.all().delete()
+        self.assertEqual(TaxPayerSummary.objects.get(taxpayer=self.taxpayer).eb_entities, '')
+
+    def test_summary_follows_eb_entity_rename(self):
+        eb_entity = self.taxpayer_eb_entity.eb_entity
+        eb_entity.eb_name = 'Renamed entity'
+        eb_entity.save()
+        self.assertEqual(TaxPayerSummary.objects.get(taxpayer=self.taxpayer).eb_entities, 'Renamed entity')
+
+    def test_eb_entity_rename_updates_every_summary_at_once(self):
+        eb_entity = self.taxpayer_eb_entity.eb_entity
+        other_eb_entity = EBEntityFactory()
+        taxpayers = [self.taxpayer] + TaxPayerArgentinaFactory.create_batch(3)
+        for taxpayer in taxpayers[1:]:
+            TaxPayerEBEntityFactory(taxpayer=taxpayer, eb_entity=eb_entity)
+        TaxPayerEBEntityFactory(taxpayer=taxpayers[1], eb_entity=other_eb_entity)
+        eb_entity.eb_name = 'Renamed entity'
+        # The update of the entity, the taxpayers, their entities and the summaries
+        with self.assertNumQueries(4):
+            eb_entity.save()
+        self.assertEqual(
+            [TaxPayerSummary.objects.get(taxpayer=taxpayer).eb_entities for taxpayer in taxpayers],
+            [
+                'Renamed entity',
+                'Renamed entity, {}'.format(other_eb_entity.eb_name),
+                'Renamed entity',
+                'Renamed entity',
+            ],
+        )
+
+
 class TestAddressModel(TestCase):
     def test_address(self):
         taxpayer = TaxPayerFactory()
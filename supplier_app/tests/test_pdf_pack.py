@@ -0,0 +1,118 @@
+from io import BytesIO
+from unittest.mock import patch
+import zipfile
+
+from django.contrib.auth.models import Group
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.text import slugify
+
+from supplier_app.models import InvitingBuyer
+from supplier_app.tests import use_temp_media_root
+from supplier_app.tests.factory_boy import (
+    AddressFactory,
+    BankAccountFactory,
+    CompanyUserPermissionFactory,
+    ContactFactory,
+    TaxPayerArgentinaFactory,
+    TaxPayerUnitedStatedFactory,
+)
+from users_app.factory_boy import UserFactory
+from users_app.models import User
+from utils.htmltopdf import html_to_pdf
+
+
+class TestTaxpayerPdfPack(TestCase):
+
+    def setUp(self):
+        use_temp_media_root(self)
+
+        self.ap_user = User.objects.create_user(email='ap@eventbrite.com')
+        self.ap_user.groups.add(Group.objects.get(name='ap_administrator'))
+        self.client.force_login(self.ap_user)
+
+        self.taxpayer = self._create_taxpayer(
+            TaxPayerArgentinaFactory,
+            business_name='Panadería Norte',
+            afip_registration_file=SimpleUploadedFile('afip.pdf', b'afip'),
+            witholding_taxes_file='',
+            afip_no_retention_taxes_file='',
+            iibb_registration_file='',
+            iibb_no_retention_taxes_file='',
+        )
+        self.taxpayer_usa = self._create_taxpayer(
+            TaxPayerUnitedStatedFactory,
+            business_name='Music Inc',
+            country='USA',
+            w9_file=SimpleUploadedFile('w9.pdf', b'w9'),
+        )
+        self.url = reverse('taxpayer-pdf-pack')
+
+    def _create_taxpayer(self, factory, **kwargs):
+        taxpayer = factory(**kwargs)
+        InvitingBuyer.objects.create(company=taxpayer.company, inviting_buyer=self.ap_user)
+        address = AddressFactory(taxpayer=taxpayer)
+        ContactFactory(taxpayer=taxpayer, address=address)
+        BankAccountFactory(
+            taxpayer=taxpayer,
+            bank_cbu_file=SimpleUploadedFile('cbu-{}.pdf'.format(taxpayer.id), 'cbu-{}'.format(taxpayer.id).encode()),
+        )
+        return taxpayer
+
+    def _get_pack(self, data=None):
+        response = self.client.get(self.url, data or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+
+    def test_pack_has_the_pdf_and_files_of_every_taxpayer(self):
+        pack = self._get_pack()
+        folder = '{}-panaderia-norte'.format(self.taxpayer.id)
+        folder_usa = '{}-music-inc'.format(self.taxpayer_usa.id)
+        self.assertEqual(
+            sorted(pack.namelist()),
+            sorted([
+                '{}/registration.pdf'.format(folder),
+                '{}/afip_registration_file-afip.pdf'.format(folder),
+                '{}/bank_cbu_file-cbu-{}.pdf'.format(folder, self.taxpayer.id),
+                '{}/registration.pdf'.format(folder_usa),
+                '{}/w9_file-w9.pdf'.format(folder_usa),
+                '{}/bank_cbu_file-cbu-{}.pdf'.format(folder_usa, self.taxpayer_usa.id),
+            ]),
+        )
+        self.assertTrue(pack.read('{}/registration.pdf'.format(folder)).startswith(b'%PDF'))
+        self.assertEqual(pack.read('{}/afip_registration_file-afip.pdf'.format(folder)), b'afip')
+
+    def test_pack_of_filtered_taxpayers(self):
+        pack = self._get_pack({'country': 'USA'})
+        self.assertEqual(
+            {name.split('/')[0] for name in pack.namelist()},
+            {'{}-music-inc'.format(self.taxpayer_usa.id)},
+        )
+
+    def test_pack_reuses_the_stored_pdfs(self):
+        with patch('utils.htmltopdf.html_to_pdf', wraps=html_to_pdf) as render_mock:
+            self._get_pack()
+            self.assertEqual(render_mock.call_count, 2)
+            self._get_pack()
+            self.assertEqual(render_mock.call_count, 2)
+
+    def test_pack_skips_the_pdf_of_taxpayers_missing_data(self):
+        InvitingBuyer.objects.filter(company=self.taxpayer.company).delete()
+        names = self._get_pack().namelist()
+        self.assertNotIn('{}-panaderia-norte/registration.pdf'.format(self.taxpayer.id), names)
+        self.assertIn('{}-panaderia-norte/afip_registration_file-afip.pdf'.format(self.taxpayer.id), names)
+
+    def test_supplier_can_not_download_pack(self):
+        user = UserFactory()
+        CompanyUserPermissionFactory(company=self.taxpayer.company, user=user)
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    @override_settings(REGISTRATION_PDF_WORKERS=2)
+    def test_pack_renders_pdfs_in_process_pool(self):
+        pack = self._get_pack()
+        for taxpayer in (self.taxpayer, self.taxpayer_usa):
+            name = '{}-{}/registration.pdf'.format(taxpayer.id, slugify(taxpayer.business_name))
+            self.assertTrue(pack.read(name).startswith(b'%PDF'))
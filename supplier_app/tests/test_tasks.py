@@ -0,0 +1,123 @@
+from smtplib import SMTPException
+from unittest.mock import MagicMock, patch
+
+from django.core import mail
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from supplier_app import (
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_STATUS_FAILED,
+    OUTBOX_STATUS_PENDING,
+    OUTBOX_STATUS_SENT,
+)
+from supplier_app.models import OutboxEmail
+from supplier_app.tasks import drain_email_outbox, get_retry_delay
+from utils.send_email import _queue_outbox_drain, queue_email_notification
+
+
+class TestDrainEmailOutbox(TestCase):
+
+    def setUp(self):
+        mail.outbox = []
+
+    def _queue_email(self, subject='Testing title', idempotency_key=None):
+        return queue_email_notification(subject, 'Testing message', ['someone@somemail.com'], idempotency_key)
+
+    def _make_failing_connection(self):
+        connection = MagicMock()
+        connection.send_messages.side_effect = SMTPException('Connection refused')
+        return connection
+
+    def test_queue_email_twice_stores_one_email(self):
+        self.assertTrue(self._queue_email(idempotency_key='invite-1'))
+        self.assertFalse(self._queue_email(idempotency_key='invite-1'))
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_queue_email_drains_outbox_on_commit(self):
+        with patch('utils.send_email.transaction.on_commit') as on_commit_mock:
+            self._queue_email(idempotency_key='invite-1')
+            self._queue_email(idempotency_key='invite-1')
+        on_commit_mock.assert_called_once_with(_queue_outbox_drain)
+        with patch('supplier_app.tasks.drain_email_outbox.apply_async') as apply_async_mock:
+            _queue_outbox_drain()
+        apply_async_mock.assert_called_once_with()
+
+    def test_queue_email_without_key_stores_every_email(self):
+        self.assertTrue(self._queue_email())
+        self.assertTrue(self._queue_email())
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+
+    def test_drain_sends_pending_emails(self):
+        self._queue_email()
+        drain_email_outbox()
+        outbox_email = OutboxEmail.objects.get()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Testing title')
+        self.assertEqual(mail.outbox[0].to, ['someone@somemail.com'])
+        self.assertEqual(outbox_email.status, OUTBOX_STATUS_SENT)
+        self.assertEqual(outbox_email.attempts, 1)
+        self.assertIsNotNone(outbox_email.sent_at)
+
+    def test_drain_does_not_send_emails_twice(self):
+        self._queue_email()
+        drain_email_outbox()
+        drain_email_outbox()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_email_is_retried_with_backoff(self):
+        self._queue_email()
+        before_drain = timezone.now()
+        with patch('supplier_app.tasks.get_email_connection', return_value=self._make_failing_connection()):
+            drain_email_outbox()
+        outbox_email = OutboxEmail.objects.get()
+        self.assertEqual(outbox_email.status, OUTBOX_STATUS_PENDING)
+        self.assertEqual(outbox_email.attempts, 1)
+        self.assertEqual(outbox_email.last_error, 'Connection refused')
+        self.assertGreaterEqual(outbox_email.next_attempt_at, before_drain + get_retry_delay(1))
+
+    def test_email_is_not_retried_before_next_attempt(self):
+        self._queue_email()
+        with patch('supplier_app.tasks.get_email_connection', return_value=self._make_failing_connection()):
+            drain_email_outbox()
+        drain_email_outbox()
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.get().attempts, 1)
+
+    def test_email_is_failed_after_max_attempts(self):
+        self._queue_email()
+        OutboxEmail.objects.update(attempts=OUTBOX_MAX_ATTEMPTS - 1)
+        with patch('supplier_app.tasks.get_email_connection', return_value=self._make_failing_connection()):
+            drain_email_outbox()
+        outbox_email = OutboxEmail.objects.get()
+        self.assertEqual(outbox_email.status, OUTBOX_STATUS_FAILED)
+        self.assertEqual(outbox_email.attempts, OUTBOX_MAX_ATTEMPTS)
+
+    def test_retry_delay_grows_exponentially(self):
+        self.assertEqual(get_retry_delay(2), get_retry_delay(1) * 2)
+        self.assertEqual(get_retry_delay(3), get_retry_delay(1) * 4)
+
+    @override_settings(EMAIL_OUTBOX_RATE_LIMIT_PER_MINUTE=2)
+    def test_drain_does_not_exceed_rate_limit(self):
+        for index in range(3):
+            self._queue_email(subject='Testing title {}'.format(index))
+        drain_email_outbox()
+        drain_email_outbox()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(OutboxEmail.objects.filter(status=OUTBOX_STATUS_PENDING).count(), 1)
+
+    @override_settings(EMAIL_OUTBOX_RATE_LIMIT_PER_MINUTE=0)
+    def test_drain_sends_nothing_without_quota(self):
+        self._queue_email()
+        drain_email_outbox()
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_email_is_discarded_when_transaction_rolls_back(self):
+        try:
+            with transaction.atomic():
+                self._queue_email()
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertFalse(OutboxEmail.objects.exists())
@@ -4,26 +4,31 @@ from datetime import (
 )
 from freezegun import freeze_time
 from http import HTTPStatus
+from io import BytesIO
+from openpyxl import load_workbook
 from os import (
+    listdir,
     path,
 )
 from parameterized import parameterized
 from shutil import rmtree
-from unittest.mock import (
-    MagicMock,
-    patch,
-)
+from unittest.mock import patch
 
 from django.contrib.auth.models import Group
 from django.core import mail
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.core.files import File
+from django.core.cache import cache
 from django.core.urlresolvers import (
     reverse,
     reverse_lazy,
 )
-from django.db import DatabaseError
+from django.db import (
+    connection,
+    DatabaseError,
+)
 from django.http import (
     QueryDict
 )
@@ -32,6 +37,7 @@ from django.test import (
     RequestFactory,
     TestCase,
 )
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.utils.datastructures import MultiValueDict
 
@@ -83,6 +89,9 @@ from supplier_app.models import (
 )
 from supplier_app.tests import (
     file_mock,
+    get_pdf_content,
+    get_pdf_file_mock,
+    use_temp_media_root,
     get_bank_info_example,
     get_transaction_type_example,
     get_acccount_type_example,
@@ -107,6 +116,9 @@ from supplier_app.tests.factory_boy import (
     TaxPayerUnitedStatedFactory,
     EbEntityCompanyFactory,
 )
+from supplier_app.registration_pdf import render_registration_pdf
+from supplier_app.tasks import drain_email_outbox
+from utils.htmltopdf import html_to_pdf
 from supplier_app.views import (
     CreateTaxPayerView,
     CompanyUserPermission,
@@ -127,7 +139,7 @@ class TestCreateTaxPayer(TestCase):
     def setUp(self):
         self.client = Client()
         self.factory = RequestFactory()
-        self.file_mock = MagicMock(spec=File)
+        self.file_mock = get_pdf_file_mock()
         self.file_mock.name = 'test.pdf'
         self.file_mock.size = 50
         self.bank_info = get_bank_info_example("CITIBANK N.A.")
@@ -688,6 +700,14 @@ class TestApTaxpayers(TestCase):
         for not_contain_bn in not_contain_business_name:
             self.assertNotContains(response, not_contain_bn)
 
+    def test_search_taxpayers_by_business_name(self):
+        TaxPayerArgentinaFactory.create_batch(10, company=self.company1)
+        self.client.force_login(self.user_ap)
+        response = self.client.get(
+            '{}?business_name={}'.format(reverse(self.ap_home_url), self.taxpayer_ar2.business_name)
+        )
+        self.assertEqual(list(response.context['object_list']), [self.taxpayer_ar2.taxpayer_ptr])
+
     def test_get_taxpayers_between_2_dates_in_ap_site(self):
         self.client.force_login(self.user_ap)
         with freeze_time(time_to_freeze=date(2019, 10, 21)):
@@ -717,6 +737,40 @@ class TestApTaxpayers(TestCase):
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertEqual('supplier_app/ap-taxpayers.html', response.template_name[0])
 
+    def test_taxpayer_list_shows_current_eb_entities_and_us_identifier(self):
+        taxpayer_eb_entity = TaxPayerEBEntityFactory(taxpayer=self.taxpayer_ar1)
+        self.client.force_login(self.user_ap)
+        response = self.client.get(reverse(self.ap_home_url))
+        self.assertContains(response, taxpayer_eb_entity.eb_entity.eb_name)
+        self.assertContains(response, self.taxpayer_usa1.taxpayer_id_number)
+
+    def _count_taxpayer_list_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(self.ap_home_url))
+        return len(context.captured_queries), len(response.context['object_list'])
+
+    def test_taxpayer_list_query_count_does_not_depend_on_page_length(self):
+        self.client.force_login(self.user_ap)
+        short_page_queries, short_page_length = self._count_taxpayer_list_queries()
+        for _ in range(5):
+            TaxPayerEBEntityFactory(taxpayer=TaxPayerArgentinaFactory(company=self.company1))
+        full_page_queries, full_page_length = self._count_taxpayer_list_queries()
+        self.assertLess(short_page_length, full_page_length)
+        self.assertEqual(short_page_queries, full_page_queries)
+
+    def test_taxpayer_list_keyset_pagination(self):
+        TaxPayerArgentinaFactory.create_batch(8, company=self.company1)
+        cache.clear()
+        self.client.force_login(self.user_ap)
+        first_page = self.client.get(reverse(self.ap_home_url))
+        page_obj = first_page.context['page_obj']
+        self.assertEqual(page_obj.count, 11)
+        self.assertEqual(len(page_obj), 10)
+        second_page = self.client.get('{}?{}'.format(reverse(self.ap_home_url), page_obj.next_querystring))
+        self.assertEqual(len(second_page.context['page_obj']), 1)
+        self.assertIsNone(second_page.context['page_obj'].next_querystring)
+
     def test_get_all_taxpayers_list_as_supplier_redirects_to_supplier_home(self):
         self.client.force_login(self.user_with_social_evb1)
         response = self.client.get(
@@ -733,13 +787,30 @@ class TestApTaxpayers(TestCase):
         )
         self.assertTrue(response._headers['content-disposition'][1].endswith('.xlsx'))
 
+    def test_taxpayer_export_to_xls_includes_current_eb_entity(self):
+        TaxPayerEBEntityFactory(taxpayer=self.taxpayer_ar1)
+        self.client.force_login(self.user_ap)
+        response = self.client.get(
+            '{}?country=AR'.format(reverse('taxpayer-to-xls')),
+        )
+        worksheet = load_workbook(BytesIO(b''.join(response.streaming_content))).active
+        rows = {row[0]: row for row in list(worksheet.values)[1:]}
+        self.assertEqual(
+            rows[self.taxpayer_ar1.id][:3],
+            (
+                self.taxpayer_ar1.id,
+                self.taxpayer_ar1.business_name,
+                self.taxpayer_ar1.eb_entities[0].eb_name,
+            )
+        )
+
 class TestSupplierDetailsView(TestCase):
 
     def setUp(self):
         self.client = Client()
         self.factory = RequestFactory()
 
-        self.file_mock = MagicMock(spec=File)
+        self.file_mock = get_pdf_file_mock()
         self.file_mock.name = 'test.pdf'
         self.file_mock.size = 50
 
@@ -856,21 +927,117 @@ class TestSupplierDetailsView(TestCase):
             response, 'Edit',
         )
     
+    def _get_pdf(self, **kwargs):
+        return self.client.get(reverse('pdf-web', kwargs=self.kwargs), **kwargs)
+
     def test_pdf(self):
-        
+        media_root = use_temp_media_root(self)
         InvitingBuyer.objects.create(company=self.taxpayer.company, inviting_buyer=self.ap_user)
-        response = self.client.get(
-            reverse_lazy(
-            'pdf-web',
-            kwargs=self.kwargs
-            )
+        response = self._get_pdf()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(
+            len(listdir(path.join(media_root, 'registration_pdfs', str(self.taxpayer.id), 'en'))),
+            1,
         )
 
+    def test_pdf_is_served_from_storage_until_the_taxpayer_changes(self):
+        media_root = use_temp_media_root(self)
+        InvitingBuyer.objects.create(company=self.taxpayer.company, inviting_buyer=self.ap_user)
+        with patch('utils.htmltopdf.html_to_pdf', wraps=html_to_pdf) as render_mock:
+            self._get_pdf()
+            self._get_pdf()
+            self.assertEqual(render_mock.call_count, 1)
+            self.address.street = 'Other street'
+            self.address.save()
+            self._get_pdf()
+            self.assertEqual(render_mock.call_count, 2)
         self.assertEqual(
-            self.taxpayer,
-            response.context['taxpayer']
+            len(listdir(path.join(media_root, 'registration_pdfs', str(self.taxpayer.id), 'en'))),
+            1,
         )
-        
+
+    def test_pdf_is_rendered_again_when_the_buyer_or_entities_change(self):
+        use_temp_media_root(self)
+        InvitingBuyer.objects.create(company=self.taxpayer.company, inviting_buyer=self.ap_user)
+        with patch('utils.htmltopdf.html_to_pdf', wraps=html_to_pdf) as render_mock:
+            self._get_pdf()
+            TaxPayerEBEntityFactory(taxpayer=self.taxpayer)
+            self._get_pdf()
+            self.assertEqual(render_mock.call_count, 2)
+            self.ap_user.email = 'other-ap@eventbrite.com'
+            self.ap_user.save()
+            self._get_pdf()
+            self.assertEqual(render_mock.call_count, 3)
+
+    def test_render_keeps_the_pdfs_stored_meanwhile(self):
+        media_root = use_temp_media_root(self)
+        InvitingBuyer.objects.create(company=self.taxpayer.company, inviting_buyer=self.ap_user)
+        directory = path.join(media_root, 'registration_pdfs', str(self.taxpayer.id), 'en')
+        old_name = default_storage.save('registration_pdfs/{}/en/old.pdf'.format(self.taxpayer.id), ContentFile(b'old'))
+
+        def store_newer_render(*args, **kwargs):
+            default_storage.save('registration_pdfs/{}/en/newer.pdf'.format(self.taxpayer.id), ContentFile(b'new'))
+            return html_to_pdf(*args, **kwargs)
+
+        with patch('utils.htmltopdf.html_to_pdf', side_effect=store_newer_render):
+            name = render_registration_pdf(self.taxpayer.id, 'en')
+        self.assertEqual(sorted(listdir(directory)), sorted([path.basename(name), 'newer.pdf']))
+        self.assertFalse(default_storage.exists(old_name))
+
+    @patch('supplier_app.views.queue_registration_pdf')
+    def test_pdf_waits_for_the_render(self, queue_mock):
+        use_temp_media_root(self)
+        response = self._get_pdf()
+        self.assertEqual(response.status_code, 202)
+        self.assertTemplateUsed(response, 'supplier_app/registration-pdf.html')
+        queue_mock.assert_called_once_with(self.taxpayer.id, 'en')
+        # The polls queue it again, in case the render was lost
+        response = self._get_pdf(HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json(), {'is_ready': False})
+        self.assertEqual(queue_mock.call_count, 2)
+
+    def test_pdf_of_taxpayer_missing_data(self):
+        use_temp_media_root(self)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        # Without an inviting buyer the PDF can not be rendered
+        self.assertEqual(self._get_pdf().status_code, 404)
+        response = self._get_pdf(HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'is_ready': False, 'has_failed': True})
+        InvitingBuyer.objects.create(company=self.taxpayer.company, inviting_buyer=self.ap_user)
+        self.assertEqual(self._get_pdf().status_code, 200)
+
+    def test_pdf_of_missing_taxpayer(self):
+        self.kwargs['taxpayer_id'] = self.taxpayer.id + 100
+        self.assertEqual(self._get_pdf().status_code, 404)
+
+    def _get_file(self, field_name):
+        return self.client.get(reverse('taxpayer-file', kwargs={'field_name': field_name, **self.kwargs}))
+
+    def test_taxpayer_file(self):
+        use_temp_media_root(self)
+        self.taxpayer.afip_registration_file = SimpleUploadedFile('afip.pdf', b'afip')
+        self.taxpayer.save()
+        self.bank_account.bank_cbu_file = SimpleUploadedFile('cbu.pdf', b'cbu')
+        self.bank_account.save()
+        response = self._get_file('afip_registration_file')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(b''.join(response.streaming_content), b'afip')
+        self.assertEqual(b''.join(self._get_file('bank_cbu_file').streaming_content), b'cbu')
+
+    def test_taxpayer_file_of_other_field(self):
+        use_temp_media_root(self)
+        self.assertEqual(self._get_file('business_name').status_code, 404)
+        self.assertEqual(self._get_file('iibb_registration_file').status_code, 404)
+
+    def test_taxpayer_file_of_other_company(self):
+        use_temp_media_root(self)
+        self.client.force_login(UserFactory())
+        self.assertEqual(self._get_file('afip_registration_file').status_code, 302)
 
     @parameterized.expand([
         ("APPROVED", "1"),
@@ -915,7 +1082,7 @@ class TestTaxpayerDetailsSupplier(TestCase):
         self.user_sup.groups.add(Group.objects.get(name='supplier'))
         self.client.force_login(self.user_sup)
         self.supplier_detail_url = 'supplier-details'
-        self.file_mock = MagicMock(spec=File)
+        self.file_mock = get_pdf_file_mock()
         self.file_mock.name = 'test.pdf'
         self.file_mock.size = 50
         self.company = CompanyFactory(
@@ -997,7 +1164,7 @@ class TestEditTaxPayerInfo(TestCase):
         }
         self.taxpayer_id = self.taxpayer.id
 
-        self.file_mock = MagicMock(spec=File)
+        self.file_mock = get_pdf_file_mock()
         self.file_mock.name = 'test.pdf'
         self.file_mock.size = 50
 
@@ -1274,11 +1441,11 @@ class TestEditTaxPayerInfo(TestCase):
         )
 
         client.force_login(user)
-        new_afip_file = SimpleUploadedFile('afip_file.pdf', bytes(100),)
-        new_witholding_file = SimpleUploadedFile('witholding_file.pdf', bytes(35),)
-        new_afip_no_retention_file = SimpleUploadedFile('afip_no_retention_file.pdf', bytes(43),)
-        new_iibb_no_retention_file = SimpleUploadedFile('iibb_no_retention_file.pdf', bytes(50),)
-        new_iibb_file = SimpleUploadedFile('iibb_file.pdf', bytes(67),)
+        new_afip_file = SimpleUploadedFile('afip_file.pdf', get_pdf_content(100))
+        new_witholding_file = SimpleUploadedFile('witholding_file.pdf', get_pdf_content(35))
+        new_afip_no_retention_file = SimpleUploadedFile('afip_no_retention_file.pdf', get_pdf_content(43))
+        new_iibb_no_retention_file = SimpleUploadedFile('iibb_no_retention_file.pdf', get_pdf_content(50))
+        new_iibb_file = SimpleUploadedFile('iibb_file.pdf', get_pdf_content(67))
         self.TAXPAYER_POST.update({
             'afip_registration_file': new_afip_file,
             'witholding_taxes_file': new_witholding_file,
@@ -1603,7 +1770,7 @@ class TestEditBankAccountInfo(TestCase):
         self.client = Client()
 
         self.factory = RequestFactory()
-        self.file_mock = MagicMock(spec=File)
+        self.file_mock = get_pdf_file_mock()
         self.file_mock.name = 'bank_account.pdf'
         self.file_mock.size = 50
 
@@ -1769,7 +1936,7 @@ class TestEditBankAccountInfo(TestCase):
 
         client.force_login(user)
 
-        new_cbu_file = SimpleUploadedFile(new_cbu_file_name, bytes(123))
+        new_cbu_file = SimpleUploadedFile(new_cbu_file_name, get_pdf_content(123))
         self.BANK_ACCOUNT_POST.update({
             'bank_cbu_file': new_cbu_file,
         })
@@ -1961,11 +2128,13 @@ class TestCompanyInvite(TestCase):
 
     def test_company_invite_sends_email_notification_in_spanish(self,):
         self._make_post("es")
+        drain_email_outbox()
         self.assertIn("Bienvenido a BriteSu! Por favor accede al siguiente link", mail.outbox[0].body)
         self.assertIn("¡Gracias!", mail.outbox[0].body)
 
     def test_company_invite_sends_email_notification(self):
         self._make_post()
+        drain_email_outbox()
         self.assertEqual(
             mail.outbox[0].subject,
             email_notifications['company_invitation']['subject'],
@@ -1977,6 +2146,7 @@ class TestCompanyInvite(TestCase):
     )
     def test_company_invite_sends_token_in_body_and_is_persisted(self, mocked_token):
         self._make_post()
+        drain_email_outbox()
         self.assertIn(
             mocked_token.return_value,
             mail.outbox[0].alternatives[0][0],
@@ -2237,12 +2407,19 @@ class TestApprovalRefuse(TestCase):
             'APPROVED'
         )
 
+    @patch('supplier_app.change_status_strategy.queue_registration_pdf')
+    @patch('supplier_app.change_status_strategy.transaction.on_commit', side_effect=lambda callback: callback())
+    def test_approving_taxpayer_renders_its_pdf(self, on_commit_mock, queue_mock):
+        self._handle_taxpayer_status_request(self.approve)
+        queue_mock.assert_called_once_with(self.taxpayer.id)
+
     def test_change_taxpayer_status_to_active_sends_email_notification(self):
         CompanyUserPermissionFactory(
             user=UserFactory(),
             company=self.taxpayer.company
         )
         self._handle_taxpayer_status_request(self.approve)
+        drain_email_outbox()
         self.assertEqual(
             mail.outbox[0].subject,
             email_notifications['taxpayer_approval']['subject']
@@ -2407,6 +2584,7 @@ class TestApprovalRefuse(TestCase):
             company=self.taxpayer.company
         )
         self._handle_taxpayer_status_request(self.deny)
+        drain_email_outbox()
 
         self.assertEqual(
             mail.outbox[0].subject,
@@ -2424,6 +2602,7 @@ class TestApprovalRefuse(TestCase):
             company=self.taxpayer.company
         )
         self._handle_taxpayer_status_request(self.in_progress)
+        drain_email_outbox()
 
         self.assertEqual(
             mail.outbox[0].subject,
@@ -2660,7 +2839,7 @@ class TestTaxpayerHistory(TestCase):
             'bank_id': bank_account.id,
         }
 
-        file_mock = MagicMock(spec=File)
+        file_mock = get_pdf_file_mock()
         file_mock.name = 'test.pdf'
         file_mock.size = 50
 
@@ -2806,7 +2985,7 @@ class TestTaxpayerCommentView(TestCase):
         self.supplier_detail_url = 'supplier-details'
         self.comment_post_url = 'taxpayer-comment'
 
-        self.file_mock = MagicMock(spec=File)
+        self.file_mock = get_pdf_file_mock()
         self.file_mock.name = 'test.pdf'
         self.file_mock.size = 50
         self.company = CompanyFactory(
@@ -2,10 +2,11 @@ from django.contrib import messages
 from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.storage import default_storage
 from django.db import transaction
 from django.db import DatabaseError
-from django.http import Http404, HttpResponseRedirect, HttpResponse
-from django.shortcuts import get_object_or_404, redirect
+from django.http import Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
 from django.views.generic import TemplateView, View
 from django.views.generic.edit import (
@@ -15,10 +16,11 @@ from django.views.generic.edit import (
 )
 from datetime import datetime
 from django.views.generic.list import ListView
-from django.utils import translation
+from django.utils import timezone, translation
 from django_filters.views import FilterView
 
-from invoices_app import EXPORT_TO_XLS_FULL, EXPORT_TO_XLS_TAXPAYER
+from invoices_app import EXPORT_JOB_TAXPAYERS, EXPORT_TO_XLS_FULL
+from invoices_app.tasks import start_export_job
 from supplier_app import DATE_FORMAT
 from supplier_app.change_status_strategy import (
     run_strategy_taxpayer_status,
@@ -45,6 +47,7 @@ from supplier_app.constants.taxpayer_status import (
     TAXPAYER_STATUS_DENIED,
     TAXPAYER_STATUS_IN_PROGRESS,
     TAXPAYER_STATUS_CHANGES_PENDING)
+from supplier_app.exports import TaxPayerExport
 from supplier_app.filters import TaxPayerFilter
 from supplier_app.forms import (
     AddressCreateForm,
@@ -72,8 +75,17 @@ from supplier_app.models import (
     TaxPayerEBEntity,
     ContactInformation,
     InvitingBuyer,
-    EBEntityCompany
+    EBEntityCompany,
+    get_company_names,
+    get_eb_entities,
+    get_eb_entity,
 )
+from supplier_app.pdf_pack import get_taxpayer_files, iter_pdf_pack
+from supplier_app.registration_pdf import (
+    get_registration_pdf_name,
+    get_registration_pdf_versions,
+)
+from supplier_app.tasks import has_registration_pdf_failed, queue_registration_pdf
 from users_app.mixins import (
     TaxPayerPermissionMixin,
     UserLoginPermissionRequiredMixin,
@@ -93,9 +105,11 @@ from users_app import (
 from users_app.models import User
 from utils import reports
 from utils.exceptions import CouldNotSendEmailError
-from utils.reports import ExcelReportInputParams, generate_xls, generate_response_xls
+from utils.file_response import stored_file_response
+from utils.pagination import KeysetPaginationMixin
+from utils.reports import generate_streaming_response_xls
+from utils.search import filter_by_search
 from utils.send_email import company_invitation_notification
-from utils.htmltopdf import render_to_pdf
 from django.contrib.auth.decorators import permission_required as permission_required_decorator
 
 
@@ -109,7 +123,7 @@ class CompanyCreatorView(UserLoginPermissionRequiredMixin, CreateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['eb_entities'] = EBEntity.objects.all()
+        context['eb_entities'] = get_eb_entities()
         return context
 
     def form_valid(self, form):
@@ -118,7 +132,7 @@ class CompanyCreatorView(UserLoginPermissionRequiredMixin, CreateView):
             return HttpResponseRedirect(self.get_failure_url())
         company = self.save_company(form)
         InvitingBuyer.objects.create(company=company, inviting_buyer=self.request.user)
-        EBEntityCompany.objects.create(company=company, eb_entity=EBEntity.objects.get(pk=form.data['eb_entity']))
+        EBEntityCompany.objects.create(company=company, eb_entity=get_eb_entity(form.data['eb_entity']))
         company_invite(self.request, company)
         return HttpResponseRedirect(self.get_success_url())
 
@@ -182,13 +196,13 @@ class CompanyListView(LoginRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['is_AP'] = self.request.user.is_AP
-        context['all_companies'] = Company.objects.values('name')
+        context['all_companies'] = [{'name': name} for name in get_company_names()]
         return context
 
     def get_queryset(self):
         company_name = self.request.GET.get('company')
         if company_name:
-            queryset = Company.objects.filter(name__icontains=company_name)
+            queryset = filter_by_search(Company.objects.all(), company_name)
         else:
             queryset = Company.objects.all()
         return queryset
@@ -207,16 +221,13 @@ class SupplierHome(UserLoginPermissionRequiredMixin, TemplateView):
 
     def get_taxpayers(self):
         user = self.request.user
-        taxpayer_list = TaxPayer.objects.filter(
+        return TaxPayer.objects.filter(
             company__companyuserpermission__user=user
-        )
-        taxpayer_child = [tax.get_taxpayer_child() for tax in taxpayer_list]
-
-        return taxpayer_child
+        ).get_children()
 
     def _user_has_company(self):
         user = self.request.user
-        if not user.companyuserpermission_set.all():
+        if not user.company_ids:
             messages.error(self.request, COMPANY_ERROR_MESSAGE)
             return False
         else:
@@ -339,22 +350,25 @@ class CreateTaxPayerView(UserLoginPermissionRequiredMixin, TemplateView, FormVie
         bankaccount.save()
 
 
-class ApTaxpayers(UserLoginPermissionRequiredMixin, FilterView):
-    model = TaxPayerArgentina
+class ApTaxpayers(UserLoginPermissionRequiredMixin, KeysetPaginationMixin, FilterView):
+    model = TaxPayer
     template_name = 'supplier_app/ap-taxpayers.html'
     filterset_class = TaxPayerFilter
+    paginate_by = 10
+    keyset_ordering = ('taxpayer_date', 'id')
+    keyset_count = True
     permission_required = (
         CAN_VIEW_ALL_TAXPAYERS_PERM,
     )
 
+    def get_queryset(self):
+        return TaxPayer.objects.select_related('summary')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context['filter_to_xls'] = self.request.GET.urlencode()
         return context
 
-    def get_queryset(self):
-        queryset = TaxPayer.objects.filter()
-        return queryset
-
 
 class SupplierDetailsView(UserLoginPermissionRequiredMixin, TaxPayerPermissionMixin, TemplateView):
     template_name = 'supplier_app/taxpayer-details.html'
@@ -624,11 +638,9 @@ def company_invite(request, company=None):
         company_unique_token.save()
         token = company_unique_token.token
         id_ebentity = EBEntityCompany.objects.get(company=company).eb_entity_id
-        eb_entity = EBEntity.objects.get(pk=id_ebentity)
+        eb_entity = get_eb_entity(id_ebentity)
         company_invitation_notification(company, token, email, language, eb_entity.eb_name)
         messages.success(request, EMAIL_SUCCESS_MESSAGE)
-    except CouldNotSendEmailError:
-        messages.error(request, EMAIL_ERROR_MESSAGE)
     finally:
         translation.activate(old_language)
         return redirect('company-list-deprecated') if request.user.is_AP else redirect('company-list')
@@ -643,6 +655,7 @@ def company_join(request, *args, **kwargs):
             user = request.user
             company = company_unique_token.company
             CompanyUserPermission.objects.create(user=user, company=company)
+            user.clear_roles_cache()
             company_unique_token.delete()
             messages.success(request, JOIN_COMPANY_SUCCESS_MESSAGE)
         except DatabaseError:
@@ -683,33 +696,47 @@ def change_taxpayer_status(request, taxpayer_id):
         ))
 
 
-class GeneratePdf(UserLoginPermissionRequiredMixin, TaxPayerPermissionMixin, TemplateView):
-    template_name = 'supplier_app/html-to-pdf-page.html'
+class GeneratePdf(UserLoginPermissionRequiredMixin, TaxPayerPermissionMixin, View):
+    """
+    Serve the stored registration PDF of the taxpayer. When it is not
+    rendered yet, it is queued and a page waits for it, polling this view.
+    A failed render is answered with a 404, to the page and to its polls.
+    """
     permission_required = (CAN_VIEW_TAXPAYER_PERM)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        company = TaxPayer.objects.get(pk=self.kwargs['taxpayer_id']).company
-        context['company'] = company
-        context['buyer'] = InvitingBuyer.objects.get(company=company.id)
-        supplier = TaxPayerArgentina.history.filter(id=self.kwargs['taxpayer_id'])
-        context['supplier'] = supplier[len(supplier)-1]
-        approved_object_query = TaxPayer.history.filter(id=self.kwargs['taxpayer_id'], taxpayer_state='APPROVED')
-        approved_object = None
-        context['approved_by'] = None
-        if len(approved_object_query) > 0:
-            approved_object = approved_object_query[0]
-            context['approved_by'] = User.objects.get(pk=approved_object.history_user_id)
-        context['approved_object'] = approved_object
-        context['taxpayer'] = get_object_or_404(TaxPayer, pk=self.kwargs['taxpayer_id']).get_taxpayer_child()
-        context['taxpayer_address'] = context['taxpayer'].address_set.get()
-        context['taxpayer_contact'] = context['taxpayer'].contactinformation_set.get()
-        context['taxpayer_bank_account'] = context['taxpayer'].bankaccount_set.get()
-        return context
+    def get(self, request, *args, **kwargs):
+        taxpayer_id = int(self.kwargs['taxpayer_id'])
+        language = translation.get_language()
+        versions = get_object_or_404(get_registration_pdf_versions(TaxPayer.objects.filter(id=taxpayer_id)))
+        name = get_registration_pdf_name(versions, taxpayer_id, language)
+        is_ready = default_storage.exists(name)
+        if not is_ready:
+            if request.is_ajax() and has_registration_pdf_failed(taxpayer_id, language):
+                return JsonResponse({'is_ready': False, 'has_failed': True}, status=404)
+            # Not queued again while it is queued, the polls queue it again
+            # when the render was lost
+            queue_registration_pdf(taxpayer_id, language)
+            # Celery runs the render right away when it is eager
+            is_ready = default_storage.exists(name)
+        if request.is_ajax():
+            return JsonResponse({'is_ready': is_ready})
+        if not is_ready:
+            if has_registration_pdf_failed(taxpayer_id, language):
+                raise Http404()
+            return render(request, 'supplier_app/registration-pdf.html', status=202)
+        return stored_file_response(request, default_storage, name, content_type='application/pdf')
+
+
+class TaxpayerFileView(UserLoginPermissionRequiredMixin, TaxPayerPermissionMixin, View):
+    """Serve a file of the taxpayer or of its bank account, by field name"""
+    permission_required = (CAN_VIEW_TAXPAYER_PERM)
 
     def get(self, request, *args, **kwargs):
-        pdf = render_to_pdf('supplier_app/html-to-pdf-page.html', self.get_context_data())
-        return HttpResponse(pdf, content_type='application/pdf')
+        taxpayer = get_object_or_404(TaxPayer, pk=self.kwargs['taxpayer_id']).get_taxpayer_child()
+        stored_file = dict(get_taxpayer_files(taxpayer)).get(self.kwargs['field_name'])
+        if not stored_file:
+            raise Http404()
+        return stored_file_response(request, stored_file.storage, stored_file.name)
 
 
 class BuyerTaxpayersList(UserLoginPermissionRequiredMixin, ListView):
@@ -737,12 +764,25 @@ class BuyerTaxpayersList(UserLoginPermissionRequiredMixin, ListView):
 
 @permission_required_decorator(CAN_VIEW_TAXPAYER_PERM)
 def export_to_xlsx_taxpayer(request):
-    queryset = TaxPayerFilter(request.GET, queryset=TaxPayer.objects.all()).qs
-    params = ExcelReportInputParams(
-        model=queryset,
-        tab_name='Taxpayer',
-        headers_attrs=EXPORT_TO_XLS_TAXPAYER,
+    export = TaxPayerExport()
+    params = export.get_params(export.get_filterset(request.GET))
+    return generate_streaming_response_xls(params, export.file_name)
+
+
+@permission_required_decorator(CAN_VIEW_ALL_TAXPAYERS_PERM, raise_exception=True)
+def export_taxpayer_pdf_pack(request):
+    filterset = TaxPayerFilter(request.GET, queryset=TaxPayer.objects.all())
+    response = StreamingHttpResponse(
+        iter_pdf_pack(filterset.qs, translation.get_language()),
+        content_type='application/zip',
     )
-    xls_file = generate_xls(params)
+    response['Content-Disposition'] = 'attachment; filename={}-taxpayers-pdf.zip'.format(
+        timezone.now().strftime('%Y-%m-%d'),
+    )
+    return response
+
 
-    return generate_response_xls(xls_file, 'Taxpayer')
+@permission_required_decorator(CAN_VIEW_TAXPAYER_PERM)
+def export_to_xlsx_taxpayer_job(request):
+    export_job = start_export_job(request.user, EXPORT_JOB_TAXPAYERS, request.GET)
+    return redirect(reverse('export-job-detail', kwargs={'pk': export_job.id}))
@@ -1,3 +1,4 @@
+from datetime import timedelta
 import os
 from django.utils.translation import ugettext_lazy as _
 from utils.env import get_env_variable
@@ -41,9 +42,28 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'social_django.middleware.SocialAuthExceptionMiddleware',
     'simple_history.middleware.HistoryRequestMiddleware',
-    'users_app.middleware.middleware.UserLanguageMiddleware'
+    'users_app.middleware.middleware.UserLanguageMiddleware',
+    'utils.query_budget.QueryBudgetMiddleware',
 ]
 
+# Query profiling per view, see utils/query_budget.py
+QUERY_PROFILING_ENABLED = False
+QUERY_BUDGET_RAISE = False
+# Maximum number of queries for each url name
+QUERY_BUDGETS = {
+    'ap-taxpayers': 15,
+    'company-list': 15,
+    'invoices-detail': 25,
+    'invoices-list': 15,
+    'invoice-bulk-upload': 25,
+    'manage-admins': 15,
+    'search': 15,
+    'supplier-details': 25,
+    'supplier-home': 15,
+    'supplier-invoice-list': 15,
+    'taxpayer-comment': 30,
+}
+
 SOCIAL_AUTH_PIPELINE = (
     'social_core.pipeline.social_auth.social_details',
     'social_core.pipeline.social_auth.social_uid',
@@ -85,6 +105,7 @@ TEMPLATES = [
                 'social_django.context_processors.backends',
                 'social_django.context_processors.login_redirect',
                 'django.template.context_processors.i18n',
+                'invoices_app.context_processors.invoice_statuses',
             ],
         },
     },
@@ -174,7 +195,64 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_BROKER_URL = BROKER_URL
 CELERY_RESULT_BACKEND = BROKER_URL
 CELERY_ALWAYS_EAGER = False
+
+# Cache of the reference data (see utils.reference_data) and of the views,
+# in the Redis of the celery broker, its keys prefixed to keep them apart
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': BROKER_URL,
+        'KEY_PREFIX': 'cache',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+    },
+}
 EMAIL_BACKEND = 'djcelery_email.backends.CeleryEmailBackend'
+# Backend used from inside the celery workers to deliver the emails
+CELERY_EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_OUTBOX_RATE_LIMIT_PER_MINUTE = 60
+CELERYBEAT_SCHEDULE = {
+    'drain-email-outbox': {
+        'task': 'supplier_app.tasks.drain_email_outbox',
+        'schedule': timedelta(seconds=30),
+    },
+    'upload-pending-documents': {
+        'task': 'supplier_app.tasks.upload_pending_documents',
+        'schedule': timedelta(seconds=60),
+    },
+    'expire-export-jobs': {
+        'task': 'invoices_app.tasks.expire_export_jobs',
+        'schedule': timedelta(hours=1),
+    },
+}
 
 SIMPLE_HISTORY_HISTORY_CHANGE_REASON_USE_TEXT_FIELD = True
+# Processes checking the PDFs of a bulk invoice upload, 0 checks them in
+# the request process
+INVOICE_BULK_UPLOAD_WORKERS = 4
+# Processes rendering the registration PDFs of a PDF pack, 0 renders them
+# in the request process
+REGISTRATION_PDF_WORKERS = 4
+# Processes checking the uploaded PDFs, 0 checks them in the request
+# process, and the seconds and pages a PDF may take
+PDF_VALIDATION_WORKERS = 2
+PDF_VALIDATION_TIMEOUT = 10
+PDF_MAX_PAGES = 500
+# Remote storage wrapped by utils.cached_storage.CachedStorage, and the
+# local directory and size in bytes of its copies of the files read
+CACHED_STORAGE_BACKEND = 'django.core.files.storage.FileSystemStorage'
+CACHED_STORAGE_DIR = os.path.join(BASE_DIR, 'storage_cache')
+CACHED_STORAGE_MAX_SIZE = 512 * 1024 * 1024
+# Local directory of the uploaded documents waiting to be pushed to the
+# default storage. It must be shared by the web servers and the celery
+# workers: the dynos have their own ephemeral disks, so it is only set where
+# they share one. None saves the files to the storage inside the request
+UPLOAD_SPOOL_DIR = None
+# Same as the Django defaults, also computing the SHA-256 of the uploaded
+# files for utils.documents
+FILE_UPLOAD_HANDLERS = [
+    'utils.documents.MemoryHashingUploadHandler',
+    'utils.documents.TemporaryHashingUploadHandler',
+]
 USER_FIELDS = ['username', 'email', 'preferred_language']
@@ -20,7 +20,8 @@ SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET = get_env_variable(
    'SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET'
 )
 
-DEFAULT_FILE_STORAGE = 'storages.backends.dropbox.DropBoxStorage'
+DEFAULT_FILE_STORAGE = 'utils.cached_storage.CachedStorage'
+CACHED_STORAGE_BACKEND = 'storages.backends.dropbox.DropBoxStorage'
 DROPBOX_OAUTH2_TOKEN = get_env_variable('DROPBOX_OAUTH2_TOKEN')
 
 DEBUG = True
@@ -39,7 +39,8 @@ MIDDLEWARE += [  # noqa
 ]
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
-DEFAULT_FILE_STORAGE = 'storages.backends.dropbox.DropBoxStorage'
+DEFAULT_FILE_STORAGE = 'utils.cached_storage.CachedStorage'
+CACHED_STORAGE_BACKEND = 'storages.backends.dropbox.DropBoxStorage'
 DROPBOX_OAUTH2_TOKEN = get_env_variable('DROPBOX_OAUTH2_TOKEN')
 
 DB_FROM_ENV = dj_database_url.config(conn_max_age=500)
@@ -74,7 +75,15 @@ LOGGING = {
         'testlogger': {
             'handlers': ['console'],
             'level': 'INFO',
-        }
+        },
+        'utils.send_email': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+        'utils.query_budget': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
     }
 }
 
@@ -14,4 +14,15 @@ DATABASES = {
     }
 }
 DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
-CELERY_ALWAYS_EAGER = True
\ No newline at end of file
+CELERY_ALWAYS_EAGER = True
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+CELERY_EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+QUERY_PROFILING_ENABLED = True
+QUERY_BUDGET_RAISE = True
+INVOICE_BULK_UPLOAD_WORKERS = 0
+REGISTRATION_PDF_WORKERS = 0
+PDF_VALIDATION_WORKERS = 0
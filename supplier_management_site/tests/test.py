@@ -1,10 +1,36 @@
+from collections import Counter
+from datetime import timedelta
+import hashlib
+from io import BytesIO, StringIO
+import json
+import os
+import time
+
+from dropbox.exceptions import ApiError
+from dropbox import files as dropbox_files
 from parameterized import parameterized
+from PyPDF2 import PdfFileWriter
 from unittest.mock import patch
 
+from django.contrib.auth.models import Permission
 from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.core.management import call_command
+from django.db.models import Q
+from django.http import Http404
 from django.test import (
+    RequestFactory,
     TestCase,
+    override_settings,
 )
+from django.template import Context, Template
+from django.urls import reverse
+from django.utils import timezone, translation
 
 from invoices_app import (
     INVOICE_STATUS_APPROVED,
@@ -12,13 +38,40 @@ from invoices_app import (
     INVOICE_STATUS_CHANGES_REQUEST,
     INVOICE_STATUS_PAID,
     INVOICE_STATUS_REJECTED,
-    INVOICE_STATUS_IN_PROGRESS)
+    INVOICE_STATUS_IN_PROGRESS,
+    INVOICE_STATUS,
+    INVOICE_STATUSES_DICT,
+)
+from invoices_app.context_processors import invoice_statuses
 
 from supplier_app.constants.email_notifications import email_notifications
-from supplier_app.models import InvitingBuyer
+from supplier_app.models import (
+    BankAccount,
+    Company,
+    Document,
+    EBEntity,
+    InvitingBuyer,
+    OutboxEmail,
+    get_company_names,
+    get_eb_entities,
+    get_eb_entity,
+    get_taxpayer_names,
+)
+from supplier_app import (
+    DOCUMENT_PRUNE_GRACE_SECONDS,
+    DOCUMENT_STATUS_FAILED,
+    DOCUMENT_STATUS_PENDING,
+    DOCUMENT_STATUS_STORED,
+    DOCUMENT_UPLOAD_MAX_ATTEMPTS,
+)
+from supplier_app.tasks import drain_email_outbox, upload_pending_documents
+from supplier_app.tests import get_pdf_content, get_temp_dir, use_temp_media_root
 
 from supplier_app.tests.factory_boy import (
+    BankAccountFactory,
     CompanyUserPermissionFactory,
+    EBEntityFactory,
+    TaxPayerArgentinaFactory,
     TaxPayerFactory,
     CompanyFactory,
 )
@@ -27,10 +80,41 @@ from supplier_app.tests.factory_boy import (
 from users_app.factory_boy import (
     UserFactory
 )
-from utils.exceptions import CouldNotSendEmailError
-from utils.invoice_lookup import invoice_status_lookup
+from users_app.models import get_role_permissions
+from utils.cached_storage import CachedStorage
+from utils.documents import (
+    MemoryHashingUploadHandler,
+    TemporaryHashingUploadHandler,
+    _queue_document_uploads,
+    get_document_references,
+    get_sha256,
+    prune_documents,
+    store_documents,
+    verify_documents,
+)
+from utils.exceptions import CouldNotSendEmailError, QueryBudgetExceeded
+from utils.file_validator import PdfValidator, check_pdfs, validate_file
+from utils.file_response import stored_file_response
+from utils.history import get_status_display
+from utils.invoice_lookup import get_invoice_status, get_invoice_statuses, invoice_status_lookup
+from utils.pagination import (
+    CURSOR_NEXT,
+    decode_cursor,
+    encode_cursor,
+    get_keyset_filter,
+)
+from utils.query_budget import (
+    QueryProfile,
+    get_fingerprint,
+    get_percentile,
+    get_query_stats,
+    reset_query_stats,
+)
+from utils.reference_data import get_reference_data, invalidate_reference_data
+from utils.search import filter_by_search, normalize_search_text
 from utils.send_email import (
     get_user_emails_by_tax_payer_id,
+    queue_email_messages,
     send_email_notification,
     taxpayer_notification,
     get_buyer_emails_by_tax_payer_id, buyer_notification)
@@ -88,6 +172,22 @@ class EmailUtilsTest(TestCase):
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, 'Testing title')
 
+    def test_queue_email_messages_once_per_change(self):
+        email_messages = [
+            ('Testing title', '<p>Testing message</p>', ['someone@somemail.com']),
+            ('Titulo de prueba', '<p>Mensaje de prueba</p>', ['alguien@somemail.com']),
+            ('Titulo de prueba', '<p>Mensaje de prueba</p>', []),
+        ]
+
+        queue_email_messages(email_messages, ('invoice_status', 1, 10))
+        queue_email_messages(email_messages, ('invoice_status', 1, 10))
+        queue_email_messages(email_messages[:1], ('invoice_status', 1, 11))
+
+        self.assertEqual(
+            sorted(json.loads(email.recipients) for email in OutboxEmail.objects.all()),
+            [['alguien@somemail.com'], ['someone@somemail.com'], ['someone@somemail.com']],
+        )
+
     def test_send_email_notification_raises_exception_with_wrong_recipient_list_format(self):
         subject = 'Testing title'
         message = 'Testing message'
@@ -141,6 +241,7 @@ class EmailUtilsTest(TestCase):
     ])
     def test_taxpayer_email_notification(self, change_type):
         taxpayer_notification(self.tax_payer1, change_type)
+        drain_email_outbox()
         self.assertEqual(
             email_notifications[change_type]['subject'],
             mail.outbox[0].subject,
@@ -152,13 +253,26 @@ class EmailUtilsTest(TestCase):
     def test_taxpayer_email_notification(self, change_type):
         InvitingBuyer.objects.create(company=self.tax_payer1.company, inviting_buyer=self.user1)
         buyer_notification(self.tax_payer1, change_type)
+        drain_email_outbox()
         self.assertEqual(
             email_notifications[change_type]['subject'],
             mail.outbox[0].subject,
         )
 
+    def test_taxpayer_email_notification_once_per_change(self):
+        taxpayer_notification(self.tax_payer1, 'taxpayer_approval')
+        taxpayer_notification(self.tax_payer1, 'taxpayer_approval')
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+        self.tax_payer1.change_required_taxpayer()
+        self.tax_payer1.save()
+        self.tax_payer1.approve_taxpayer()
+        self.tax_payer1.save()
+        taxpayer_notification(self.tax_payer1, 'taxpayer_approval')
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+
     def test_business_name_in_subject_for_taxpayer_email_notification(self):
         taxpayer_notification(self.tax_payer1, 'taxpayer_approval')
+        drain_email_outbox()
         self.assertIn(
             self.tax_payer1.business_name,
             mail.outbox[0].alternatives[0][0]
@@ -177,3 +291,632 @@ class TestInvoiceStatusLookup(TestCase):
     ])
     def test_invoice_status_lookup(self, expected_value, tag):
         self.assertEqual(invoice_status_lookup(tag), expected_value)
+
+    def test_invoice_status_lookup_by_label(self):
+        with translation.override('es'):
+            label = get_invoice_status('1').label
+            self.assertEqual(invoice_status_lookup(label), '1')
+        self.assertIsNone(invoice_status_lookup('UNKNOWN'))
+
+    def test_statuses_are_labeled_in_each_language(self):
+        for language in ('en', 'es'):
+            with translation.override(language):
+                self.assertEqual(
+                    [(status.code, status.label) for status in get_invoice_statuses(language).values()],
+                    [(code, str(label)) for code, label in INVOICE_STATUS],
+                )
+                self.assertEqual(get_status_display('2'), str(INVOICE_STATUSES_DICT['2']))
+        self.assertIsNone(get_status_display('0'))
+
+    def test_context_processor(self):
+        with translation.override('es'):
+            context = invoice_statuses(RequestFactory().get('/'))
+        self.assertEqual(context['INVOICE_STATUS_APPROVED'], '1')
+        self.assertEqual(context['INVOICE_STATUS_IN_PROGRESS'], '6')
+        self.assertIs(context['invoice_statuses'], get_invoice_statuses('es'))
+
+    def test_invoice_status_badge(self):
+        template = Template('{% load invoice_status %}{% invoice_status_badge status %}')
+        self.assertEqual(
+            template.render(Context({'status': '4'})),
+            '<span class="badge badge-danger">{}</span>'.format(INVOICE_STATUSES_DICT['4']),
+        )
+        self.assertEqual(template.render(Context({'status': '0'})), '')
+
+
+class TestKeysetPagination(TestCase):
+
+    def test_cursor_round_trip_keeps_microseconds(self):
+        received = timezone.now().replace(microsecond=123456)
+        cursor = encode_cursor(CURSOR_NEXT, [received, 7])
+        self.assertEqual(decode_cursor(cursor, 2), (CURSOR_NEXT, [received.isoformat(), 7]))
+
+    @parameterized.expand([
+        ('not-a-cursor', ),
+        ('', ),
+        (encode_cursor(CURSOR_NEXT, [1]), ),
+    ])
+    def test_invalid_cursor_is_ignored(self, cursor):
+        self.assertIsNone(decode_cursor(cursor, 2))
+
+    @parameterized.expand([
+        (True, ('date', 'id'), Q(date__gt=1) | Q(date=1, id__gt=2)),
+        (False, ('date', 'id'), Q(date__lt=1) | Q(date=1, id__lt=2)),
+        (True, ('-date', 'id'), Q(date__lt=1) | Q(date=1, id__gt=2)),
+    ])
+    def test_keyset_filter(self, forward, ordering, expected_filter):
+        self.assertEqual(
+            str(get_keyset_filter(ordering, [1, 2], forward)),
+            str(expected_filter),
+        )
+
+
+class TestQueryBudget(TestCase):
+
+    def setUp(self):
+        reset_query_stats()
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        reset_query_stats()
+
+    def test_fingerprint_ignores_literals(self):
+        self.assertEqual(
+            get_fingerprint("SELECT * FROM \"invoice\" WHERE \"id\" = 12 AND \"status\" = 'PENDING'"),
+            get_fingerprint("SELECT * FROM \"invoice\" WHERE \"id\" = 7 AND \"status\" = 'PAID'"),
+        )
+
+    def test_fingerprint_collapses_in_lists(self):
+        self.assertEqual(
+            get_fingerprint('SELECT * FROM "invoice" WHERE "id" IN (1, 2, 3)'),
+            'SELECT * FROM "invoice" WHERE "id" IN (...)',
+        )
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(get_percentile(values, 50), 50)
+        self.assertEqual(get_percentile(values, 99), 99)
+        self.assertEqual(get_percentile([3], 90), 3)
+
+    def test_queries_are_recorded_by_url_name(self):
+        self.client.get(reverse('login'))
+        self.client.get(reverse('login'))
+        stats = get_query_stats()['login']
+        self.assertEqual(stats['requests'], 2)
+        self.assertGreater(stats['queries']['p50'], 0)
+        self.assertTrue(stats['slowest'])
+
+    def test_profile_reports_duplicate_and_slowest_queries(self):
+        profile = QueryProfile([
+            {'sql': 'SELECT * FROM "company" WHERE "id" = 1', 'time': '0.002'},
+            {'sql': 'SELECT * FROM "company" WHERE "id" = 2', 'time': '0.001'},
+            {'sql': 'SELECT * FROM "invoice"', 'time': '0.010'},
+        ])
+        self.assertEqual(profile.count, 3)
+        self.assertAlmostEqual(profile.time, 0.013)
+        self.assertEqual(profile.duplicates, {'SELECT * FROM "company" WHERE "id" = ?': 2})
+        self.assertEqual(profile.slowest[0], (0.010, 'SELECT * FROM "invoice"'))
+
+    @override_settings(QUERY_BUDGETS={'login': 0})
+    def test_view_over_budget_raises(self):
+        with self.assertLogs('utils.query_budget', level='WARNING'), self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('login'))
+
+    @override_settings(QUERY_BUDGETS={'login': 0}, QUERY_BUDGET_RAISE=False)
+    def test_view_over_budget_logs_warning(self):
+        with self.assertLogs('utils.query_budget', level='WARNING'):
+            self.client.get(reverse('login'))
+        self.assertEqual(get_query_stats()['login']['over_budget'], 1)
+
+    def test_query_stats_is_staff_only(self):
+        response = self.client.get(reverse('query-stats'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_query_stats_returns_stats_to_staff(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(reverse('login'))
+        response = self.client.get(reverse('query-stats'))
+        self.assertIn('login', response.json())
+
+
+class TestSearch(TestCase):
+
+    def test_normalize_search_text(self):
+        self.assertEqual(normalize_search_text('  Panadería  Ñandú S.A. '), 'panaderia nandu s a')
+        self.assertEqual(normalize_search_text(None), '')
+
+    def test_filter_by_search_matches_every_word_prefix(self):
+        matching = CompanyFactory(name='Producciones Andinas')
+        CompanyFactory(name='Producciones del Sur')
+        self.assertEqual(list(filter_by_search(Company.objects.all(), 'prod andin')), [matching])
+
+    def test_filter_by_search_without_words_matches_nothing(self):
+        CompanyFactory()
+        self.assertFalse(filter_by_search(Company.objects.all(), '-- ?').exists())
+
+    def test_filter_by_search_forgets_deleted_rows(self):
+        company = CompanyFactory(name='Deleted company')
+        company.delete()
+        self.assertFalse(filter_by_search(Company.objects.all(), 'deleted').exists())
+
+
+class TestCachedStorage(TestCase):
+
+    def setUp(self):
+        self.remote = FileSystemStorage(location=get_temp_dir(self))
+        self.storage = CachedStorage(backend=self.remote, location=get_temp_dir(self), max_size=10)
+        self.remote.save('file/invoice.pdf', ContentFile(b'invoice'))
+
+    def _read(self, name):
+        with self.storage.open(name) as stored_file:
+            return stored_file.read()
+
+    def _cached_paths(self):
+        return [
+            os.path.join(directory, file_name)
+            for directory, _, file_names in os.walk(self.storage.location)
+            for file_name in file_names
+        ]
+
+    def test_open_downloads_the_file_once(self):
+        with patch.object(self.remote, 'open', wraps=self.remote.open) as remote_open:
+            self.assertEqual(self._read('file/invoice.pdf'), b'invoice')
+            self.assertEqual(self._read('file/invoice.pdf'), b'invoice')
+        self.assertEqual(remote_open.call_count, 1)
+        self.assertEqual(len(self._cached_paths()), 1)
+
+    def test_open_downloads_a_modified_file_again(self):
+        self._read('file/invoice.pdf')
+        self.remote.delete('file/invoice.pdf')
+        self.remote.save('file/invoice.pdf', ContentFile(b'changed'))
+        os.utime(self.remote.path('file/invoice.pdf'), (0, 0))
+        self.assertEqual(self._read('file/invoice.pdf'), b'changed')
+        self.assertEqual(len(self._cached_paths()), 1)
+
+    def test_least_recently_read_files_are_evicted(self):
+        self.remote.save('file/comment.pdf', ContentFile(b'comment'))
+        invoice_path = self.storage._get_cached_path('file/invoice.pdf')
+        comment_path = self.storage._get_cached_path('file/comment.pdf')
+        self._read('file/invoice.pdf')
+        os.utime(invoice_path, (0, 0))
+        self._read('file/comment.pdf')
+        self.assertEqual(self._cached_paths(), [comment_path])
+
+        os.utime(comment_path, (0, 0))
+        self._read('file/invoice.pdf')
+        self.assertEqual(self._cached_paths(), [invoice_path])
+
+    def test_delete_removes_the_cached_file(self):
+        self._read('file/invoice.pdf')
+        self.storage.delete('file/invoice.pdf')
+        self.assertFalse(self.remote.exists('file/invoice.pdf'))
+        self.assertEqual(self._cached_paths(), [])
+
+    def test_save_writes_to_the_remote_storage(self):
+        name = self.storage.save('file/invoice.pdf', ContentFile(b'other'))
+        self.assertNotEqual(name, 'file/invoice.pdf')
+        self.assertTrue(self.remote.exists(name))
+        self.assertEqual(self.storage.url(name), self.remote.url(name))
+
+
+class TestStoredFileResponse(TestCase):
+
+    def setUp(self):
+        self.storage = FileSystemStorage(location=get_temp_dir(self))
+        self.storage.save('invoice.pdf', ContentFile(b'0123456789'))
+        self.factory = RequestFactory()
+
+    def _get(self, **headers):
+        return stored_file_response(self.factory.get('/', **headers), self.storage, 'invoice.pdf')
+
+    def test_whole_file(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self._get()['ETag']
+        response = self._get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    @parameterized.expand([
+        ('bytes=2-5', 'bytes 2-5/10', b'2345'),
+        ('bytes=7-', 'bytes 7-9/10', b'789'),
+        ('bytes=-3', 'bytes 7-9/10', b'789'),
+        ('bytes=8-20', 'bytes 8-9/10', b'89'),
+    ])
+    def test_range(self, range_header, content_range, content):
+        response = self._get(HTTP_RANGE=range_header)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], content_range)
+        self.assertEqual(response['Content-Length'], str(len(content)))
+        self.assertEqual(b''.join(response.streaming_content), content)
+
+    @parameterized.expand([
+        ('bytes=5-2',),
+        ('bytes=0-1,4-5',),
+        ('lines=1-2',),
+    ])
+    def test_unsupported_range_gets_the_whole_file(self, range_header):
+        response = self._get(HTTP_RANGE=range_header)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_range_out_of_the_file(self):
+        response = self._get(HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_range_of_an_old_version_gets_the_whole_file(self):
+        response = self._get(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_file(self):
+        with self.assertRaises(Http404):
+            stored_file_response(self.factory.get('/'), self.storage, 'missing.pdf')
+
+    def test_missing_dropbox_file(self):
+        not_found = dropbox_files.GetMetadataError.path(dropbox_files.LookupError.not_found)
+        error = ApiError('request', not_found, 'not_found', 'en')
+        with patch.object(self.storage, 'get_modified_time', side_effect=error):
+            with self.assertRaises(Http404):
+                self._get()
+        restricted = dropbox_files.GetMetadataError.path(dropbox_files.LookupError.restricted_content)
+        error = ApiError('request', restricted, 'restricted', 'en')
+        with patch.object(self.storage, 'get_modified_time', side_effect=error):
+            with self.assertRaises(ApiError):
+                self._get()
+
+
+class TestDocuments(TestCase):
+
+    def setUp(self):
+        use_temp_media_root(self)
+        self.taxpayer = TaxPayerFactory()
+
+    def _create_bank_account(self, content, name='cbu.pdf'):
+        return BankAccountFactory(taxpayer=self.taxpayer, bank_cbu_file=SimpleUploadedFile(name, content))
+
+    def test_same_content_is_stored_once(self):
+        bank_account = self._create_bank_account(b'cbu')
+        other_bank_account = self._create_bank_account(b'cbu', name='other.pdf')
+        self.assertEqual(bank_account.bank_cbu_file.name, other_bank_account.bank_cbu_file.name)
+        self.assertEqual(default_storage.listdir('file')[1], ['cbu.pdf'])
+        document = Document.objects.get()
+        self.assertEqual(document.sha256, hashlib.sha256(b'cbu').hexdigest())
+        self.assertEqual((document.name, document.size), ('file/cbu.pdf', 3))
+
+    def test_store_documents_with_same_queries_for_any_number_of_files(self):
+        bank_accounts = [
+            BankAccount(taxpayer=self.taxpayer, bank_cbu_file=SimpleUploadedFile('cbu.pdf', content))
+            for content in (b'first', b'second', b'first')
+        ]
+        with self.assertNumQueries(4):
+            store_documents([bank_account.bank_cbu_file for bank_account in bank_accounts])
+        self.assertEqual(bank_accounts[0].bank_cbu_file.name, bank_accounts[2].bank_cbu_file.name)
+        self.assertNotEqual(bank_accounts[0].bank_cbu_file.name, bank_accounts[1].bank_cbu_file.name)
+        self.assertEqual(Document.objects.count(), 2)
+
+    def test_delete_keeps_the_shared_file(self):
+        bank_account = self._create_bank_account(b'cbu')
+        other_bank_account = self._create_bank_account(b'cbu')
+        other_bank_account.bank_cbu_file.delete()
+        self.assertTrue(default_storage.exists(bank_account.bank_cbu_file.name))
+
+    def test_references_count_rows_and_history(self):
+        bank_account = self._create_bank_account(b'cbu')
+        self._create_bank_account(b'cbu')
+        bank_account.bank_cbu_file = SimpleUploadedFile('new.pdf', b'new')
+        bank_account.save()
+        # Each file has its row and creation record, cbu.pdf also the
+        # creation record of the account changed to new.pdf
+        self.assertEqual(
+            get_document_references(),
+            Counter({'file/cbu.pdf': 3, 'file/new.pdf': 2}),
+        )
+        self.assertEqual(get_document_references(['file/new.pdf']), Counter({'file/new.pdf': 2}))
+
+    def _expire_unused_documents(self):
+        Document.objects.exclude(unused_since=None).update(
+            unused_since=timezone.now() - timedelta(seconds=DOCUMENT_PRUNE_GRACE_SECONDS),
+        )
+
+    def test_prune_deletes_only_unused_documents(self):
+        bank_account = self._create_bank_account(b'cbu')
+        Document.objects.create(sha256='0' * 64, name='file/unused.pdf', size=6)
+        default_storage.save('file/unused.pdf', ContentFile(b'unused'))
+        self.assertEqual(prune_documents(default_storage), [])
+        self.assertTrue(default_storage.exists('file/unused.pdf'))
+        self._expire_unused_documents()
+        self.assertEqual([document.name for document in prune_documents(default_storage)], ['file/unused.pdf'])
+        self.assertFalse(default_storage.exists('file/unused.pdf'))
+        self.assertEqual(list(Document.objects.values_list('name', flat=True)), [bank_account.bank_cbu_file.name])
+
+    def test_prune_keeps_documents_used_again(self):
+        bank_account = self._create_bank_account(b'cbu')
+        name = bank_account.bank_cbu_file.name
+        BankAccount.objects.filter(id=bank_account.id).update(bank_cbu_file='')
+        BankAccount.history.update(bank_cbu_file='')
+        prune_documents(default_storage)
+        self._expire_unused_documents()
+        BankAccount.objects.filter(id=bank_account.id).update(bank_cbu_file=name)
+        self.assertEqual(prune_documents(default_storage), [])
+        self.assertIsNone(Document.objects.get(name=name).unused_since)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_prune_rechecks_references_before_deleting(self):
+        bank_account = self._create_bank_account(b'cbu')
+        name = bank_account.bank_cbu_file.name
+        Document.objects.filter(name=name).update(unused_since=timezone.now() - timedelta(days=2))
+        with patch('utils.documents.get_document_references', side_effect=[Counter(), Counter({name: 1})]):
+            self.assertEqual(prune_documents(default_storage), [])
+        self.assertTrue(default_storage.exists(name))
+
+    def test_verify_reports_changed_and_missing_files(self):
+        bank_account = self._create_bank_account(b'cbu')
+        missing = Document.objects.create(sha256='0' * 64, name='file/missing.pdf', size=6)
+        self.assertEqual(verify_documents(default_storage), [missing])
+        with open(default_storage.path(bank_account.bank_cbu_file.name), 'wb') as stored_file:
+            stored_file.write(b'changed')
+        self.assertEqual(
+            verify_documents(default_storage),
+            [Document.objects.get(sha256=hashlib.sha256(b'cbu').hexdigest()), missing],
+        )
+
+    def test_index_files_uploaded_before_the_index(self):
+        first = self._create_bank_account(b'cbu')
+        second = self._create_bank_account(b'cbu')
+        Document.objects.all().delete()
+        legacy_name = default_storage.save('file/legacy.pdf', ContentFile(b'cbu'))
+        BankAccount.objects.filter(id=second.id).update(bank_cbu_file=legacy_name)
+
+        out = StringIO()
+        call_command('check_documents', index=True, stdout=out)
+        self.assertEqual(Document.objects.get().name, first.bank_cbu_file.name)
+        self.assertIn('file/legacy.pdf has the content of an indexed file', out.getvalue())
+        self.assertIn('1 documents, 3 bytes, 3 references, 0 unused', out.getvalue())
+
+    @parameterized.expand([
+        (MemoryHashingUploadHandler,),
+        (TemporaryHashingUploadHandler,),
+    ])
+    def test_upload_handlers_hash_the_uploaded_file(self, handler_class):
+        handler = handler_class()
+        handler.handle_raw_input(None, {}, 6, 'boundary')
+        try:
+            handler.new_file('bank_cbu_file', 'cbu.pdf', 'application/pdf', 6)
+        except StopFutureHandlers:
+            pass
+        for start, chunk in ((0, b'cbu'), (3, b'cbu')):
+            handler.receive_data_chunk(chunk, start)
+        uploaded_file = handler.file_complete(6)
+        self.assertEqual(uploaded_file.sha256, hashlib.sha256(b'cbucbu').hexdigest())
+        self.assertEqual(get_sha256(uploaded_file), uploaded_file.sha256)
+
+
+class TestUploadSpool(TestCase):
+
+    def setUp(self):
+        self.spool_dir = get_temp_dir(self)
+        use_temp_media_root(self, UPLOAD_SPOOL_DIR=self.spool_dir)
+        self.taxpayer = TaxPayerFactory()
+
+    def _create_bank_account(self, content=b'cbu'):
+        return BankAccountFactory(taxpayer=self.taxpayer, bank_cbu_file=SimpleUploadedFile('cbu.pdf', content))
+
+    def test_new_file_is_spooled_until_uploaded(self):
+        bank_account = self._create_bank_account()
+        name = bank_account.bank_cbu_file.name
+        self.assertEqual(name, 'file/{}/cbu.pdf'.format(hashlib.sha256(b'cbu').hexdigest()[:16]))
+        self.assertEqual(Document.objects.get().status, DOCUMENT_STATUS_PENDING)
+        self.assertFalse(default_storage.exists(name))
+        bank_account = BankAccount.objects.get(id=bank_account.id)
+        self.assertEqual(bank_account.bank_cbu_file.read(), b'cbu')
+        bank_account.bank_cbu_file.close()
+
+        upload_pending_documents()
+        self.assertEqual(Document.objects.get().status, DOCUMENT_STATUS_STORED)
+        with default_storage.open(name) as stored_file:
+            self.assertEqual(stored_file.read(), b'cbu')
+        self.assertFalse(os.path.exists(os.path.join(self.spool_dir, name)))
+        bank_account = BankAccount.objects.get(id=bank_account.id)
+        self.assertEqual(bank_account.bank_cbu_file.read(), b'cbu')
+        bank_account.bank_cbu_file.close()
+
+    def test_upload_is_queued_on_commit(self):
+        with patch('utils.documents.transaction.on_commit') as on_commit_mock:
+            self._create_bank_account()
+        on_commit_mock.assert_called_once_with(_queue_document_uploads)
+        with patch('supplier_app.tasks.upload_pending_documents.apply_async') as apply_async_mock:
+            _queue_document_uploads()
+        apply_async_mock.assert_called_once_with()
+
+    def test_file_stored_with_another_name_renames_rows_and_history(self):
+        bank_account = self._create_bank_account()
+        spooled_name = bank_account.bank_cbu_file.name
+        default_storage.save(spooled_name, ContentFile(b'other'))
+        upload_pending_documents()
+        name = Document.objects.get().name
+        self.assertNotEqual(name, spooled_name)
+        self.assertEqual(BankAccount.objects.get(id=bank_account.id).bank_cbu_file.name, name)
+        self.assertEqual(get_document_references([spooled_name]), Counter())
+        self.assertEqual(get_document_references([name]), Counter({name: 2}))
+        with default_storage.open(name) as stored_file:
+            self.assertEqual(stored_file.read(), b'cbu')
+
+    def test_failed_upload_is_retried_until_max_attempts(self):
+        self._create_bank_account()
+        with patch('supplier_app.tasks.default_storage.save', side_effect=IOError('Dropbox is down')), \
+                self.assertLogs('supplier_app.tasks', 'WARNING'):
+            upload_pending_documents()
+            document = Document.objects.get()
+            self.assertEqual(
+                (document.status, document.attempts, document.last_error),
+                (DOCUMENT_STATUS_PENDING, 1, 'Dropbox is down'),
+            )
+            self.assertGreater(document.next_attempt_at, timezone.now())
+            upload_pending_documents()
+            self.assertEqual(Document.objects.get().attempts, 1)
+
+            for attempts in range(2, DOCUMENT_UPLOAD_MAX_ATTEMPTS + 1):
+                Document.objects.update(next_attempt_at=timezone.now())
+                upload_pending_documents()
+        document = Document.objects.get()
+        self.assertEqual((document.status, document.attempts), (DOCUMENT_STATUS_FAILED, DOCUMENT_UPLOAD_MAX_ATTEMPTS))
+        self.assertTrue(os.path.exists(os.path.join(self.spool_dir, document.name)))
+
+    def test_prune_and_verify_skip_spooled_documents(self):
+        bank_account = self._create_bank_account()
+        BankAccount.objects.filter(id=bank_account.id).delete()
+        self.assertEqual(verify_documents(default_storage), [])
+        self.assertEqual(prune_documents(default_storage), [])
+        self.assertEqual(Document.objects.count(), 1)
+
+
+def get_pdf(pages=1, password=None):
+    writer = PdfFileWriter()
+    for _ in range(pages):
+        writer.addBlankPage(72, 72)
+    if password:
+        writer.encrypt(password)
+    content = BytesIO()
+    writer.write(content)
+    return content.getvalue()
+
+
+class TestPdfValidation(TestCase):
+
+    def _check(self, content, **kwargs):
+        return check_pdfs([SimpleUploadedFile('invoice.pdf', content)], **kwargs)[0]
+
+    def test_valid_pdf(self):
+        self.assertIsNone(self._check(get_pdf()))
+
+    @parameterized.expand([
+        (b'broken', 'The file is not a valid PDF'),
+        (b'%PDF-1.4 broken', 'The file is not a valid PDF'),
+        (b'0' * 2048 + get_pdf(), 'The file is not a valid PDF'),
+        (get_pdf(password='secret'), 'The PDF is encrypted'),
+        (get_pdf(pages=0), 'The PDF has no pages'),
+    ])
+    def test_invalid_pdf(self, content, error):
+        self.assertEqual(str(self._check(content)), error)
+
+    @override_settings(PDF_MAX_PAGES=2)
+    def test_pdf_with_too_many_pages(self):
+        self.assertIsNone(self._check(get_pdf(pages=2)))
+        self.assertEqual(str(self._check(get_pdf(pages=3))), 'The PDF has more than 2 pages')
+
+    @override_settings(PDF_VALIDATION_TIMEOUT=0.05)
+    def test_pdf_taking_too_long_is_stopped(self):
+        with patch('utils.file_validator.PdfFileReader', side_effect=lambda *args, **kwargs: time.sleep(5)):
+            started = time.monotonic()
+            self.assertEqual(str(self._check(get_pdf())), 'The PDF took too long to read')
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_temporary_uploaded_file_is_read_from_its_path(self):
+        uploaded_file = TemporaryUploadedFile('invoice.pdf', 'application/pdf', 0, None)
+        self.addCleanup(uploaded_file.close)
+        uploaded_file.write(get_pdf())
+        uploaded_file.flush()
+        with patch('utils.file_validator.tempfile.NamedTemporaryFile') as spool_mock:
+            self.assertEqual(check_pdfs([uploaded_file]), [None])
+        spool_mock.assert_not_called()
+
+    def test_pdfs_in_process_pool(self):
+        self.assertEqual(
+            [str(error) if error else error for error in check_pdfs([
+                SimpleUploadedFile('invoice.pdf', get_pdf()),
+                SimpleUploadedFile('broken.pdf', b'broken'),
+                SimpleUploadedFile('encrypted.pdf', get_pdf(password='secret')),
+            ], workers=1)],
+            [None, 'The file is not a valid PDF', 'The PDF is encrypted'],
+        )
+
+    def test_checked_file_is_not_read_again(self):
+        uploaded_file = SimpleUploadedFile('invoice.pdf', get_pdf(pages=0))
+        self.assertEqual(validate_file(uploaded_file)[1], ['The PDF has no pages'])
+        with patch('utils.file_validator.check_pdf') as check_mock:
+            with self.assertRaisesMessage(ValidationError, 'The PDF has no pages'):
+                PdfValidator()(uploaded_file)
+        check_mock.assert_not_called()
+
+    def test_validate_file_checks_the_pdf_of_valid_files_only(self):
+        self.assertEqual(validate_file(SimpleUploadedFile('invoice.pdf', get_pdf_content()))[1], [])
+        self.assertEqual(validate_file(SimpleUploadedFile('invoice.xml', b'broken'))[1], ['Only .pdf allowed'])
+        self.assertEqual(
+            validate_file(SimpleUploadedFile('invoice.pdf', b'broken'))[1],
+            ['The file is not a valid PDF'],
+        )
+
+    def test_validator_skips_stored_files_and_other_extensions(self):
+        bank_account = BankAccountFactory(bank_cbu_file=SimpleUploadedFile('cbu.pdf', b'broken'))
+        PdfValidator()(bank_account.bank_cbu_file)
+        PdfValidator()(SimpleUploadedFile('cbu.xml', b'broken'))
+        with self.assertRaisesMessage(ValidationError, 'The file is not a valid PDF'):
+            PdfValidator()(SimpleUploadedFile('cbu.pdf', b'broken'))
+
+
+class TestReferenceData(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_eb_entities_are_cached_until_one_changes(self):
+        eb_entity = EBEntityFactory()
+        self.assertIn(eb_entity, get_eb_entities())
+        with self.assertNumQueries(0):
+            self.assertEqual(get_eb_entity(eb_entity.id), eb_entity)
+        eb_entity.eb_name = 'Eventbrite Renamed'
+        eb_entity.save()
+        self.assertEqual(get_eb_entity(str(eb_entity.id)).eb_name, 'Eventbrite Renamed')
+        eb_entity.delete()
+        with self.assertRaises(EBEntity.DoesNotExist):
+            get_eb_entity(eb_entity.id)
+
+    def test_company_names_are_cached_until_a_company_changes(self):
+        company = CompanyFactory(name='Pyme Norte')
+        self.assertIn('Pyme Norte', get_company_names())
+        with self.assertNumQueries(0):
+            get_company_names()
+        CompanyFactory(name='Pyme Sur')
+        self.assertIn('Pyme Sur', get_company_names())
+        company.delete()
+        self.assertNotIn('Pyme Norte', get_company_names())
+
+    def test_taxpayer_names_are_invalidated_by_the_country_models(self):
+        taxpayer = TaxPayerArgentinaFactory(business_name='Panaderia Norte')
+        self.assertIn('Panaderia Norte', get_taxpayer_names())
+        taxpayer.business_name = 'Panaderia Sur'
+        taxpayer.save()
+        self.assertIn('Panaderia Sur', get_taxpayer_names())
+        with patch('utils.reference_data.invalidate_reference_data') as invalidate_mock:
+            UserFactory()
+        invalidate_mock.assert_not_called()
+
+    def test_role_permissions_are_cached(self):
+        role_permissions = get_role_permissions()
+        self.assertEqual(
+            role_permissions,
+            dict(Permission.objects.filter(codename__in=['ap_role', 'buyer_role']).values_list('codename', 'id')),
+        )
+        with self.assertNumQueries(0):
+            get_role_permissions()
+        Permission.objects.get(codename='buyer_role').delete()
+        self.assertNotIn('buyer_role', get_role_permissions())
+
+    def test_result_built_before_a_change_is_not_read(self):
+        def build_stale():
+            # The data changes while it is read
+            invalidate_reference_data('test')
+            return 'stale'
+        self.assertEqual(get_reference_data('test', build_stale), 'stale')
+        self.assertEqual(get_reference_data('test', lambda: 'fresh'), 'fresh')
+        self.assertEqual(get_reference_data('test', lambda: 'other'), 'fresh')
@@ -18,14 +18,8 @@ def is_invoice_for_user():
             if request.user.has_perm(CAN_VIEW_ALL_INVOICES_PERM):
                 return view_func(request, *args, **kwargs)
 
-            invoice = Invoice.objects.filter(id=kwargs['pk'])[0]
-            taxpayer = invoice.taxpayer
-            company = taxpayer.company
-            companyuserpermission = \
-                request.user.companyuserpermission_set.filter(
-                    company=company
-                )
-            if companyuserpermission:
+            invoice = Invoice.objects.select_related('taxpayer').filter(id=kwargs['pk'])[0]
+            if request.user.is_company_member(invoice.taxpayer.company_id):
                 return view_func(request, *args, **kwargs)
             else:
                 return HttpResponseForbidden('Forbidden')
@@ -26,15 +26,8 @@ class IsUserCompanyInvoice(UserPassesTestMixin):
         if self.request.user.has_perm(CAN_VIEW_ALL_INVOICES_PERM):
             return True
 
-        invoice = get_object_or_404(Invoice, id=self.kwargs.get('pk'))
-
-        taxpayer = invoice.taxpayer
-        company = taxpayer.company
-        companyuserpermission = \
-            self.request.user.companyuserpermission_set.filter(
-                company=company
-            )
-        return True if companyuserpermission else False
+        invoice = get_object_or_404(Invoice.objects.select_related('taxpayer'), id=self.kwargs.get('pk'))
+        return self.request.user.is_company_member(invoice.taxpayer.company_id)
 
 
 class TaxPayerPermissionMixin(UserPassesTestMixin):
@@ -47,12 +40,7 @@ class TaxPayerPermissionMixin(UserPassesTestMixin):
             return True
 
         taxpayer = get_object_or_404(TaxPayer, id=self.kwargs.get('taxpayer_id'))
-        company = taxpayer.company
-        companyuserpermission = \
-            self.request.user.companyuserpermission_set.filter(
-                company=company
-            )
-        return True if companyuserpermission else False
+        return self.request.user.is_company_member(taxpayer.company_id)
 
 
 class UserLoginPermissionRequiredMixin(LoginRequiredMixin, PermissionRequiredMixin):
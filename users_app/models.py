@@ -1,8 +1,12 @@
 from django.db import models
 from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, Permission
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
+
+from utils.reference_data import cached_reference_data
+
 LANGUAGES = ['es', 'pt-br']
 
 
@@ -68,29 +72,55 @@ class User(AbstractUser):
             return self.email.split('@')[0]
         return self.username
 
+    @cached_property
+    def group_names(self):
+        """
+        Names of the groups of the user, loaded once per instance. The user of
+        a request is built for that request only, so every role check made
+        while serving it shares this query.
+        """
+        return frozenset(self.groups.values_list('name', flat=True))
+
+    @cached_property
+    def company_ids(self):
+        return frozenset(self.companyuserpermission_set.values_list('company_id', flat=True))
+
+    def clear_roles_cache(self):
+        self.__dict__.pop('group_names', None)
+        self.__dict__.pop('company_ids', None)
+
+    def is_company_member(self, company_id):
+        return company_id in self.company_ids
+
     @property
     def is_ap_account(self):
         return self.has_perm('users_app.ap_role')
 
     @property
     def is_AP(self):
-        return self.groups.filter(name='ap_administrator').exists()
+        return 'ap_administrator' in self.group_names
 
     @property
     def is_ap_reporter(self):
-        return self.groups.filter(name='ap_reporter').exists()
+        return 'ap_reporter' in self.group_names
 
     @property
     def is_ap_manager(self):
-        return self.groups.filter(name='ap_manager').exists()
+        return 'ap_manager' in self.group_names
 
     @property
     def is_supplier(self):
-        return self.groups.filter(name='supplier').exists()
+        return 'supplier' in self.group_names
 
     @property
     def is_buyer(self):
-        return self.groups.filter(name='buyer').exists()
+        return 'buyer' in self.group_names
 
     class Meta:
         index_together = ["email"]
+
+
+@cached_reference_data('role_permissions', ['auth.Permission'])
+def get_role_permissions():
+    """The ids of the ap_role and buyer_role permissions by codename"""
+    return dict(Permission.objects.filter(codename__in=['ap_role', 'buyer_role']).values_list('codename', 'id'))
@@ -13,10 +13,12 @@ from django.contrib.auth.models import Group
 from django.contrib.contenttypes.models import ContentType
 from django.core.files import File
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import (
     Client,
     TestCase,
 )
+from django.test.utils import CaptureQueriesContext
 from supplier_app.tests.factory_boy import (
     AddressFactory,
     BankAccountFactory,
@@ -147,6 +149,18 @@ class TestSupplierPermissions(TestCase):
             response.template_name,
         )
 
+    def test_supplier_taxpayer_details_loads_roles_and_companies_once(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(
+                reverse(
+                    self.supplier_detail_url,
+                    kwargs={'taxpayer_id': self.taxpayer1.id}
+                ),
+            )
+        queries = [query['sql'] for query in context.captured_queries]
+        self.assertEqual(len([sql for sql in queries if sql.startswith('SELECT "auth_group"."name"')]), 1)
+        self.assertEqual(len([sql for sql in queries if 'FROM "supplier_app_companyuserpermission"' in sql]), 1)
+
     def test_supplier_cant_access_to_edit_another_supplier_taxpayer(self):
         kwargs = {
             'taxpayer_id': self.taxpayer2.id
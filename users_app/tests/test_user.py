@@ -64,6 +64,36 @@ class TestUser(TestCase):
         admin_user = User.objects.create_superuser('super@user.com', 'foo')
         self.assertEqual(str(admin_user), 'super@user.com')
 
+    def test_roles_are_loaded_with_one_query(self):
+        user = UserFactory(email='normal@user.com')
+        user.groups.add(Group.objects.get(name='supplier'))
+        with self.assertNumQueries(1):
+            self.assertTrue(user.is_supplier)
+            self.assertFalse(user.is_AP)
+            self.assertFalse(user.is_ap_manager)
+            self.assertFalse(user.is_ap_reporter)
+            self.assertFalse(user.is_buyer)
+
+    def test_company_membership_is_loaded_with_one_query(self):
+        user = UserFactory(email='normal@user.com')
+        company = CompanyFactory()
+        other_company = CompanyFactory()
+        CompanyUserPermissionFactory(user=user, company=company)
+        with self.assertNumQueries(1):
+            self.assertTrue(user.is_company_member(company.id))
+            self.assertFalse(user.is_company_member(other_company.id))
+
+    def test_clear_roles_cache_reloads_roles_and_companies(self):
+        user = UserFactory(email='normal@user.com')
+        company = CompanyFactory()
+        self.assertFalse(user.is_buyer)
+        self.assertFalse(user.is_company_member(company.id))
+        user.groups.add(Group.objects.get(name='buyer'))
+        CompanyUserPermissionFactory(user=user, company=company)
+        user.clear_roles_cache()
+        self.assertTrue(user.is_buyer)
+        self.assertTrue(user.is_company_member(company.id))
+
     def test_create_user_ap(self):
         User = get_user_model()
         user = UserFactory(email='normal@user.com', password='foo')
@@ -3,6 +3,7 @@ from users_app.views import (
     LoginView,
     LogoutView,
     ErrorLoginView,
+    query_stats,
     set_user_language,
 )
 
@@ -20,5 +21,6 @@ urlpatterns = [
     url(r'^logout$', LogoutView.as_view(), name='logout'),
     url(r'^login-error$', ErrorLoginView.as_view(), name='login-error'),
     url(r'^set_user_language/$', set_user_language, name='set_user_language'),
+    url(r'^query-stats/$', query_stats, name='query-stats'),
     url(r'^users/', include(users_patterns)),
 ]
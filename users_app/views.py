@@ -6,11 +6,10 @@ from django.contrib.auth.mixins import (
     PermissionRequiredMixin,
     UserPassesTestMixin,
 )
-from django.contrib.auth.models import (
-    Group,
-    Permission,
-)
+from django.contrib.auth.models import Group
+from django.contrib.admin.views.decorators import staff_member_required
 from django.http import (
+    JsonResponse,
     HttpResponseBadRequest,
     HttpResponseRedirect,
 )
@@ -26,12 +25,14 @@ from django.urls import reverse_lazy
 from django.views.generic.list import ListView
 from django.utils.translation import activate
 from django.urls import reverse
-from pure_pagination.mixins import PaginationMixin
 from users_app import ALLOWED_AP_ACCOUNTS, CAN_MANAGE_APS_PERM
-from users_app.models import User
+from users_app.models import User, get_role_permissions
 from users_app.forms import UserAdminForm
+from utils.pagination import KeysetPaginationMixin
+from utils.query_budget import get_query_stats
 from utils.send_email import (
-    send_email_notification,
+    get_idempotency_key,
+    queue_email_notification,
     build_mail_html,
 )
 from django.conf import settings
@@ -68,11 +69,12 @@ class IsApUser(UserPassesTestMixin):
         return self.request.user.email in ALLOWED_AP_ACCOUNTS
 
 
-class AdminList(PaginationMixin, PermissionRequiredMixin, ListView):
+class AdminList(KeysetPaginationMixin, PermissionRequiredMixin, ListView):
     model = User
     template_name = 'registration/admins-list.html'
     permission_required = CAN_MANAGE_APS_PERM
     paginate_by = 10
+    keyset_ordering = ('date_joined', 'id')
     filter = False
 
     def change_filter(self):
@@ -83,13 +85,14 @@ class AdminList(PaginationMixin, PermissionRequiredMixin, ListView):
 
     def get_queryset(self):
         self.change_filter()
+        role_permissions = get_role_permissions()
         if self.filter:
-            perm_ap = Permission.objects.get(codename='ap_role')
+            perm_ap = role_permissions['ap_role']
             queryset = User.objects.filter(
                 Q(groups__permissions=perm_ap)).distinct()
         else:
-            perm_ap = Permission.objects.get(codename='ap_role')
-            perm_buyer = Permission.objects.get(codename='buyer_role')
+            perm_ap = role_permissions['ap_role']
+            perm_buyer = role_permissions['buyer_role']
             queryset = User.objects.filter(
                 Q(groups__permissions=perm_buyer) | Q(groups__permissions=perm_ap)
             ).distinct()
@@ -110,10 +113,11 @@ def change_ap_permission(request, pk):
     group = Group.objects.filter(name=group_name).first()
     if not group:
         return HttpResponseBadRequest()
-    if user.groups.filter(name=group_name).exists():
+    if group_name in user.group_names:
         group.user_set.remove(user)
     else:
         user.groups.add(group)
+    user.clear_roles_cache()
     return redirect('manage-admins')
 
 
@@ -161,5 +165,16 @@ class CreateAdmin(PermissionRequiredMixin, CreateView):
             '{}/login/google-oauth2/?next='.format(settings.BRITESU_BASE_URL)
         )
         recipient_list = [form.cleaned_data['email']]
-        send_email_notification.apply_async([subject, message, recipient_list])
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        queue_email_notification(
+            subject,
+            message,
+            recipient_list,
+            get_idempotency_key('ap_invitation', self.object.id),
+        )
+        return response
+
+
+@staff_member_required
+def query_stats(request):
+    return JsonResponse(get_query_stats())
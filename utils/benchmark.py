@@ -0,0 +1,503 @@
+import copy
+from datetime import timedelta
+from decimal import Decimal
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.management.color import no_style
+from django.db import connection, reset_queries, transaction
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from invoices_app import CURRENCIES, INVOICE_STATUS, INVOICE_STATUS_PENDING_CODE
+from invoices_app.models import Invoice
+from supplier_app import CURRENT_STATUS, PAYMENT_TERMS, PAYMENT_TYPES
+from supplier_app.constants.bank_info import BANK_INFO
+from supplier_app.constants.payment_ar import ACCOUNT_TYPE_AR, TRANSACTION_TYPE_AR
+from supplier_app.constants.taxpayer_status import (
+    TAXPAYER_STATUS_APPROVED,
+    TAXPAYER_STATUS_CHANGE_REQUIRED,
+    TAXPAYER_STATUS_DENIED,
+    TAXPAYER_STATUS_IN_PROGRESS,
+    TAXPAYER_STATUS_PENDING,
+)
+from supplier_app.models import (
+    Address,
+    BankAccount,
+    Company,
+    CompanyUserPermission,
+    ContactInformation,
+    EBEntity,
+    EBEntityCompany,
+    InvitingBuyer,
+    TaxPayer,
+    TaxPayerArgentina,
+    TaxPayerEBEntity,
+    TaxPayerSummary,
+)
+from users_app.models import User
+from utils.query_budget import get_percentile
+from utils.search import normalize_search_text
+
+BENCHMARK_EB_ENTITIES = 10
+BENCHMARK_DAYS = 2 * 365
+BENCHMARK_FILE_NAME = 'file/benchmark.pdf'
+BENCHMARK_AP_EMAIL = 'benchmark-ap@eventbrite.com'
+BENCHMARK_BUYER_EMAIL = 'benchmark-buyer@eventbrite.com'
+BENCHMARK_PERCENTILES = (50, 90)
+BENCHMARK_PAGE_SIZE = 10
+
+# Most of the taxpayers of a real database are approved
+TAXPAYER_STATES = (
+    [TAXPAYER_STATUS_APPROVED] * 6 +
+    [TAXPAYER_STATUS_PENDING, TAXPAYER_STATUS_IN_PROGRESS, TAXPAYER_STATUS_CHANGE_REQUIRED, TAXPAYER_STATUS_DENIED]
+)
+INVOICE_STATUS_CODES = [code for code, _ in INVOICE_STATUS]
+
+
+def get_batch_size(fields, objs, batch_size):
+    # bulk_create takes the batch size as given, even over the backend limits
+    return max(min(batch_size, connection.ops.bulk_batch_size(fields, objs)), 1)
+
+
+def insert_rows(model, objs, batch_size):
+    """
+    Insert objs into the table of model keeping every value they carry.
+
+    bulk_create would replace the auto_now_add dates and refuses the child
+    tables of multi-table inherited models such as TaxPayerArgentina, so the
+    rows are inserted raw. The objects must already have their ids.
+    """
+    if not objs:
+        return
+    fields = model._meta.local_concrete_fields
+    batch_size = get_batch_size(fields, objs, batch_size)
+    for start in range(0, len(objs), batch_size):
+        model._base_manager._insert(objs[start:start + batch_size], fields=fields, raw=True)
+
+
+def build_history(model, objs, history_type='+'):
+    """
+    Build the historical records of objs the way simple_history would when
+    saving them, dated by their _history_date attribute.
+    """
+    history_model = model.history.model
+    # Fields excluded from the history are not in the historical model
+    history_attnames = {field.attname for field in history_model._meta.fields}
+    attnames = [field.attname for field in model._meta.fields if field.attname in history_attnames]
+    return [
+        history_model(
+            history_date=obj._history_date,
+            history_user_id=getattr(obj, '_history_user_id', None),
+            history_change_reason='',
+            history_type=history_type,
+            **{attname: getattr(obj, attname) for attname in attnames}
+        )
+        for obj in objs
+    ]
+
+
+def insert_history(model, history, batch_size):
+    history_model = model.history.model
+    history_model.objects.bulk_create(
+        history,
+        batch_size=get_batch_size(history_model._meta.concrete_fields, history, batch_size),
+    )
+
+
+def get_benchmark_user(email, group_name):
+    user = User.objects.create_user(email)
+    user.groups.add(Group.objects.get(name=group_name))
+    return user
+
+
+def split_evenly(total, parts, index):
+    return total // parts + (1 if index < total % parts else 0)
+
+
+class BenchmarkDataGenerator:
+    """
+    Bulk generate companies with their supplier users, taxpayers (with
+    address, contact and bank account) and invoices, plus the history rows
+    the views read.
+
+    Work is done by chunks of companies, each one in its own transaction,
+    so only one chunk of objects is kept in memory.
+    """
+    models = [
+        User,
+        Company,
+        CompanyUserPermission,
+        EBEntity,
+        EBEntityCompany,
+        InvitingBuyer,
+        TaxPayer,
+        TaxPayerEBEntity,
+        Address,
+        ContactInformation,
+        BankAccount,
+        Invoice,
+    ]
+
+    def __init__(self, companies, taxpayers, invoices, invoice_updates=1, batch_size=1000, seed=0, stdout=None):
+        self.companies = companies
+        self.taxpayers = max(taxpayers, companies)
+        self.invoices = invoices
+        self.invoice_updates = invoice_updates
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.stdout = stdout
+        self.now = timezone.now()
+        self.password = make_password(None)
+        self.next_ids = {}
+
+    def _log(self, message):
+        if self.stdout:
+            self.stdout.write(message)
+
+    def _next_id(self, model):
+        if model not in self.next_ids:
+            self.next_ids[model] = (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+        next_id = self.next_ids[model]
+        self.next_ids[model] += 1
+        return next_id
+
+    def _random_date(self):
+        return self.now - timedelta(days=self.random.randint(0, BENCHMARK_DAYS), seconds=self.random.randint(0, 86399))
+
+    def generate(self):
+        self.ap_user = get_benchmark_user(BENCHMARK_AP_EMAIL, 'ap_administrator')
+        self.buyer = get_benchmark_user(BENCHMARK_BUYER_EMAIL, 'buyer')
+        self.supplier_group = Group.objects.get(name='supplier')
+        with transaction.atomic():
+            self.eb_entities = [
+                EBEntity(id=self._next_id(EBEntity), eb_name='Benchmark entity {}'.format(index), eb_country='AR')
+                for index in range(BENCHMARK_EB_ENTITIES)
+            ]
+            insert_rows(EBEntity, self.eb_entities, self.batch_size)
+
+        self.taxpayer_index = 0
+        for start in range(0, self.companies, self.batch_size):
+            end = min(start + self.batch_size, self.companies)
+            with transaction.atomic():
+                self._generate_companies(range(start, end))
+            self._log('{} of {} companies generated'.format(end, self.companies))
+        self._reset_sequences()
+
+    def _reset_sequences(self):
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), self.models):
+                cursor.execute(sql)
+
+    def _generate_companies(self, company_indexes):
+        users, companies, permissions, buyers, entities = [], [], [], [], []
+        taxpayers = []
+        for company_index in company_indexes:
+            created = self._random_date()
+            user_id = self._next_id(User)
+            user = User(
+                id=user_id,
+                email='benchmark-supplier-{}@example.com'.format(user_id),
+                password=self.password,
+                date_joined=created,
+                preferred_language='en',
+            )
+            company_name = 'Benchmark company {}'.format(company_index)
+            company = Company(
+                id=self._next_id(Company),
+                name=company_name,
+                description='Benchmark company',
+                search_name=normalize_search_text(company_name),
+            )
+            users.append(user)
+            companies.append(company)
+            permissions.append(CompanyUserPermission(
+                id=self._next_id(CompanyUserPermission),
+                company=company,
+                user=user,
+            ))
+            buyers.append(InvitingBuyer(
+                id=self._next_id(InvitingBuyer),
+                company=company,
+                inviting_buyer=self.buyer,
+                creation_date=created,
+            ))
+            eb_entity = self.random.choice(self.eb_entities)
+            entities.append(EBEntityCompany(id=self._next_id(EBEntityCompany), company=company, eb_entity=eb_entity))
+            for _ in range(split_evenly(self.taxpayers, self.companies, company_index)):
+                taxpayers.append(self._build_taxpayer(company, user, eb_entity, created))
+
+        insert_rows(User, users, self.batch_size)
+        user_groups = [User.groups.through(user_id=user.id, group_id=self.supplier_group.id) for user in users]
+        User.groups.through.objects.bulk_create(
+            user_groups,
+            batch_size=get_batch_size(User.groups.through._meta.concrete_fields, user_groups, self.batch_size),
+        )
+        insert_rows(Company, companies, self.batch_size)
+        insert_rows(CompanyUserPermission, permissions, self.batch_size)
+        insert_rows(InvitingBuyer, buyers, self.batch_size)
+        insert_rows(EBEntityCompany, entities, self.batch_size)
+        self._insert_taxpayers(taxpayers)
+
+        invoices = []
+        for taxpayer in taxpayers:
+            invoices_count = split_evenly(self.invoices, self.taxpayers, self.taxpayer_index)
+            invoices.extend(self._build_invoice(taxpayer, number) for number in range(invoices_count))
+            self.taxpayer_index += 1
+        self._insert_invoices(invoices)
+
+    def _build_taxpayer(self, company, user, eb_entity, created):
+        taxpayer_id = self._next_id(TaxPayer)
+        business_name = 'Benchmark supplier {}'.format(taxpayer_id)
+        taxpayer = TaxPayerArgentina(
+            id=taxpayer_id,
+            taxpayer_ptr_id=taxpayer_id,
+            workday_id='WD{}'.format(taxpayer_id),
+            business_name=business_name,
+            search_name=normalize_search_text(business_name),
+            taxpayer_state=self.random.choice(TAXPAYER_STATES),
+            country='AR',
+            company=company,
+            taxpayer_date=created.date(),
+            cuit='{:011d}'.format(taxpayer_id),
+            taxpayer_condition='monotributista',
+            payment_type=PAYMENT_TYPES[0].value,
+            payment_term=self.random.choice(PAYMENT_TERMS).value,
+            afip_registration_file=BENCHMARK_FILE_NAME,
+            afip_no_retention_taxes_file=BENCHMARK_FILE_NAME,
+            iibb_registration_file=BENCHMARK_FILE_NAME,
+            iibb_no_retention_taxes_file=BENCHMARK_FILE_NAME,
+            witholding_taxes_file=BENCHMARK_FILE_NAME,
+            witholding_suss_file=BENCHMARK_FILE_NAME,
+        )
+        taxpayer._history_date = created
+        taxpayer._history_user_id = user.id
+        taxpayer._eb_entity = eb_entity
+        taxpayer._user = user
+        return taxpayer
+
+    def _insert_taxpayers(self, taxpayers):
+        taxpayer_entities, summaries, addresses, contacts, bank_accounts = [], [], [], [], []
+        for taxpayer in taxpayers:
+            summaries.append(TaxPayerSummary(
+                taxpayer_id=taxpayer.id,
+                identifier=taxpayer.cuit,
+                eb_entities=taxpayer._eb_entity.eb_name,
+            ))
+            taxpayer_entities.append(TaxPayerEBEntity(
+                id=self._next_id(TaxPayerEBEntity),
+                eb_entity=taxpayer._eb_entity,
+                taxpayer_id=taxpayer.id,
+                status=CURRENT_STATUS,
+            ))
+            address = Address(
+                id=self._next_id(Address),
+                street='Calle falsa',
+                number=self.random.randint(1, 9999),
+                zip_code='5500',
+                city='Godoy Cruz',
+                state='Mendoza',
+                country='AR',
+                taxpayer_id=taxpayer.id,
+            )
+            addresses.append(address)
+            contacts.append(ContactInformation(
+                id=self._next_id(ContactInformation),
+                address=address,
+                contact_person='John Smith',
+                phone_number='0115123456',
+                email=taxpayer._user.email,
+                website='www.example.com',
+                taxpayer_id=taxpayer.id,
+            ))
+            bank_account_id = self._next_id(BankAccount)
+            bank_accounts.append(BankAccount(
+                id=bank_account_id,
+                bank_account_number='{:022d}'.format(bank_account_id),
+                bank_info=BANK_INFO['BANCO DE LA NACION ARGENTINA'],
+                taxpayer_id=taxpayer.id,
+                bank_cbu_file=BENCHMARK_FILE_NAME,
+                bank_transaction_type=TRANSACTION_TYPE_AR['Bank transfer'],
+                bank_account_type=ACCOUNT_TYPE_AR['Saving account'],
+                bank_beneficiary='John Smith',
+            ))
+        for obj in addresses + contacts + bank_accounts:
+            obj._history_date = self.now
+
+        insert_rows(TaxPayer, taxpayers, self.batch_size)
+        insert_rows(TaxPayerArgentina, taxpayers, self.batch_size)
+        insert_rows(TaxPayerEBEntity, taxpayer_entities, self.batch_size)
+        insert_rows(TaxPayerSummary, summaries, self.batch_size)
+        insert_rows(Address, addresses, self.batch_size)
+        insert_rows(ContactInformation, contacts, self.batch_size)
+        insert_rows(BankAccount, bank_accounts, self.batch_size)
+        for model, objs in (
+            (TaxPayer, taxpayers),
+            (TaxPayerArgentina, taxpayers),
+            (Address, addresses),
+            (ContactInformation, contacts),
+            (BankAccount, bank_accounts),
+        ):
+            insert_history(model, build_history(model, objs), self.batch_size)
+
+    def _build_invoice(self, taxpayer, number):
+        received = self._random_date()
+        invoice_date = received.date() - timedelta(days=self.random.randint(0, 30))
+        net_amount = Decimal(self.random.randint(100, 1000000)) / 100
+        vat = (net_amount * Decimal('0.21')).quantize(Decimal('0.01'))
+        invoice = Invoice(
+            id=self._next_id(Invoice),
+            taxpayer_id=taxpayer.id,
+            currency=self.random.choice(CURRENCIES)[0],
+            status=INVOICE_STATUS_PENDING_CODE,
+            po_number=str(self.random.randint(10000, 99999)),
+            invoice_date=invoice_date,
+            invoice_due_date=invoice_date + timedelta(days=taxpayer.payment_term),
+            invoice_date_received=received,
+            invoice_number=str(number + 1),
+            net_amount=net_amount,
+            vat=vat,
+            total_amount=net_amount + vat,
+            user_id=taxpayer._user.id,
+            invoice_file=BENCHMARK_FILE_NAME,
+            invoice_eb_entity_id=taxpayer._eb_entity.id,
+        )
+        invoice._history_date = received
+        invoice._history_user_id = taxpayer._user.id
+        return invoice
+
+    def _insert_invoices(self, invoices):
+        history = build_history(Invoice, invoices)
+        for invoice in invoices:
+            # Walk each invoice through a few status changes made by AP
+            for update in range(self.invoice_updates):
+                invoice.status = self.random.choice(INVOICE_STATUS_CODES)
+                invoice._history_date = invoice._history_date + timedelta(hours=self.random.randint(1, 72))
+                invoice._history_user_id = self.ap_user.id
+                history.extend(build_history(Invoice, [copy.copy(invoice)], history_type='~'))
+        insert_rows(Invoice, invoices, self.batch_size)
+        insert_history(Invoice, history, self.batch_size)
+
+
+def get_query_plan(queryset):
+    sql, params = queryset.query.sql_with_params()
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        return [str(row[-1]) for row in cursor.fetchall()]
+
+
+def get_query_plans():
+    """
+    Return the database plans of the queries behind the invoice and taxpayer
+    filters, to check which indexes they use.
+    """
+    until = timezone.now().date()
+    since = until - timedelta(days=30)
+    invoices = Invoice.objects.for_list().order_by('invoice_date_received', 'id')
+    querysets = {
+        'invoices-by-status': invoices.filter(status=INVOICE_STATUS_PENDING_CODE),
+        'invoices-by-invoice-date': invoices.filter(invoice_date__range=(since, until)),
+        'invoices-by-due-date': invoices.filter(invoice_due_date__range=(since, until)),
+        'invoices-with-new-comment-from-ap': invoices.filter(new_comment_from_ap=True),
+        'invoices-with-new-comment-from-supplier': invoices.filter(new_comment_from_supplier=True),
+        'invoice-workday-id-exists': Invoice.objects.filter(workday_id='WD1').values('id'),
+        'taxpayers-by-state': TaxPayer.objects.filter(
+            taxpayer_state=TAXPAYER_STATUS_PENDING,
+            taxpayer_date__range=(since, until),
+        ),
+        'taxpayer-workday-id-exists': TaxPayer.objects.filter(workday_id='WD1').values('id'),
+    }
+    return {
+        name: get_query_plan(queryset[:BENCHMARK_PAGE_SIZE])
+        for name, queryset in querysets.items()
+    }
+
+
+def get_benchmark_cases():
+    """
+    Return the (name, url, params) of the requests to time, built around an
+    invoice and taxpayer from the middle of the tables.
+    """
+    middle_id = (Invoice.objects.aggregate(max_id=Max('id'))['max_id'] or 0) // 2
+    invoice = Invoice.objects.select_related('taxpayer').filter(id__gte=middle_id).order_by('id').first()
+    invoices_list = reverse('invoices-list')
+    date_before = timezone.now().date()
+    cases = [
+        ('invoices-list', invoices_list, {}),
+        ('invoices-list-status', invoices_list, {'status': INVOICE_STATUS_PENDING_CODE}),
+        ('invoices-list-date-range', invoices_list, {
+            'invoice_date_after': (date_before - timedelta(days=30)).isoformat(),
+            'invoice_date_before': date_before.isoformat(),
+        }),
+        ('invoice-to-xls', reverse('invoice-to-xls'), {'status': INVOICE_STATUS_PENDING_CODE}),
+        ('taxpayer-to-xls', reverse('taxpayer-to-xls'), {}),
+        ('ap-taxpayers', reverse('ap-taxpayers'), {}),
+    ]
+    if invoice:
+        cases += [
+            ('invoices-list-organization', invoices_list, {
+                'taxpayer__business_name': invoice.taxpayer.business_name,
+            }),
+            ('invoices-detail', reverse('invoices-detail', kwargs={
+                'taxpayer_id': invoice.taxpayer_id,
+                'pk': invoice.id,
+            }), {}),
+            ('pdf-web', reverse('pdf-web', kwargs={'taxpayer_id': invoice.taxpayer_id}), {}),
+            ('search', reverse('search'), {'q': invoice.taxpayer.business_name}),
+        ]
+    return cases
+
+
+def _request(client, url, params):
+    response = client.get(url, params)
+    if response.streaming:
+        size = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        size = len(response.content)
+    return response.status_code, size
+
+
+def time_case(client, url, params, repeat):
+    """
+    Request url once to warm up and count its queries, then repeat more
+    times measuring the whole response, streamed content included.
+    """
+    reset_queries()
+    with CaptureQueriesContext(connection) as context:
+        status_code, size = _request(client, url, params)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _request(client, url, params)
+        timings.append((time.perf_counter() - start) * 1000)
+    result = {
+        'status_code': status_code,
+        'bytes': size,
+        'queries': len(context.captured_queries),
+        'min_ms': round(min(timings), 2),
+        'max_ms': round(max(timings), 2),
+    }
+    if len(context.captured_queries) >= connection.queries_log.maxlen:
+        # The connection only keeps the last queries_log.maxlen queries
+        result['queries_truncated'] = True
+    for percentile in BENCHMARK_PERCENTILES:
+        result['p{}_ms'.format(percentile)] = round(get_percentile(timings, percentile), 2)
+    return result
+
+
+def run_benchmark(repeat):
+    client = Client()
+    client.force_login(get_benchmark_user(BENCHMARK_AP_EMAIL, 'ap_administrator'))
+    results = {}
+    for name, url, params in get_benchmark_cases():
+        try:
+            results[name] = time_case(client, url, params, repeat)
+        except Exception as error:
+            results[name] = {'error': repr(error)}
+    return results
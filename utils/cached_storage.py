@@ -0,0 +1,153 @@
+"""
+Storage keeping a local disk copy of the files it reads from a remote one.
+
+In production the files live in Dropbox, so every download of an invoice,
+comment attachment or taxpayer certificate was a download from Dropbox.
+CachedStorage wraps the CACHED_STORAGE_BACKEND storage: writes, urls and
+metadata go to it, and files read are kept in CACHED_STORAGE_DIR.
+
+A cached copy is named by a hash of the file name and of its modification
+time in the remote storage, so a file replaced in the remote storage is
+downloaded again and never served stale. Reading a cached copy touches it,
+and when the copies take more than CACHED_STORAGE_MAX_SIZE bytes the least
+recently read ones are deleted. Files are downloaded to a temporary file in
+chunks and moved in place, so concurrent readers never see half a file.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage, get_storage_class
+from django.utils.deconstruct import deconstructible
+from storages.backends.dropbox import DropBoxStorage
+
+logger = logging.getLogger(__name__)
+
+_TEMPORARY_PREFIX = '.download-'
+
+
+def _hash(value):
+    return hashlib.sha256(repr(value).encode()).hexdigest()
+
+
+@deconstructible
+class CachedStorage(Storage):
+
+    def __init__(self, backend=None, location=None, max_size=None):
+        self.backend = backend or get_storage_class(settings.CACHED_STORAGE_BACKEND)()
+        self.location = location or settings.CACHED_STORAGE_DIR
+        self.max_size = settings.CACHED_STORAGE_MAX_SIZE if max_size is None else max_size
+
+    def _get_directory(self, name):
+        return os.path.join(self.location, _hash(name))
+
+    def _get_cached_path(self, name):
+        return os.path.join(self._get_directory(name), _hash(self.backend.get_modified_time(name)))
+
+    def _download(self, name, cached_path):
+        directory = os.path.dirname(cached_path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(prefix=_TEMPORARY_PREFIX, dir=directory)
+        try:
+            if isinstance(self.backend, DropBoxStorage):
+                # DropBoxFile keeps the whole download in memory, the client
+                # can write it to disk as it arrives
+                os.close(descriptor)
+                self.backend.client.files_download_to_file(temporary_path, self.backend._full_path(name))
+            else:
+                with os.fdopen(descriptor, 'wb') as cached_file, self.backend.open(name, 'rb') as remote_file:
+                    for chunk in remote_file.chunks():
+                        cached_file.write(chunk)
+            os.replace(temporary_path, cached_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    def _delete_older_versions(self, cached_path):
+        directory = os.path.dirname(cached_path)
+        for file_name in os.listdir(directory):
+            file_path = os.path.join(directory, file_name)
+            if file_path != cached_path and not file_name.startswith(_TEMPORARY_PREFIX):
+                self._remove(file_path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Delete the least recently read copies until they fit in max_size"""
+        entries = []
+        for directory, _, file_names in os.walk(self.location):
+            for file_name in file_names:
+                if file_name.startswith(_TEMPORARY_PREFIX):
+                    continue
+                file_path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file_path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, file_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            self._remove(file_path)
+            total_size -= size
+
+    def _open(self, name, mode='rb'):
+        if mode != 'rb':
+            return self.backend.open(name, mode)
+        cached_path = self._get_cached_path(name)
+        try:
+            cached_file = open(cached_path, 'rb')
+        except FileNotFoundError:
+            self._download(name, cached_path)
+            # Opened before evicting, so the copy is still readable if it
+            # is evicted right away
+            cached_file = open(cached_path, 'rb')
+            self._delete_older_versions(cached_path)
+            self.evict()
+        else:
+            os.utime(cached_path)
+        return File(cached_file, name=name)
+
+    def _save(self, name, content):
+        return self.backend._save(name, content)
+
+    def delete(self, name):
+        self.backend.delete(name)
+        shutil.rmtree(self._get_directory(name), ignore_errors=True)
+
+    def get_available_name(self, name, max_length=None):
+        return self.backend.get_available_name(name, max_length=max_length)
+
+    def generate_filename(self, filename):
+        return self.backend.generate_filename(filename)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def get_accessed_time(self, name):
+        return self.backend.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.backend.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
@@ -0,0 +1,314 @@
+"""
+Uploaded documents stored once per content.
+
+Suppliers upload the same PDFs again and again: the same certificate for
+several taxpayers, the same invoice to fix its data. DocumentFileField
+stores a file only when no stored file has the same SHA-256, otherwise it
+takes the name of the stored one, so identical uploads share one blob in
+the remote storage. The supplier_app Document table is the index of the
+stored blobs by hash, also used to check they were not changed or lost.
+
+The hash of a file uploaded in a request is computed by the upload
+handlers while its chunks arrive, the hash of other files is computed
+reading them in chunks. Blobs are shared, so they are never deleted with
+the rows using them: get_document_references counts the rows and
+historical records using each one and the check_documents command deletes
+the ones left unused.
+
+A request may match the content of an unused document and save a row with
+its name while the documents are pruned, so a document is only deleted when
+it was already found unused DOCUMENT_PRUNE_GRACE_SECONDS before, and its
+references are counted again with its row locked.
+
+New files may be written to the upload spool first, see utils.upload_spool.
+"""
+from collections import Counter
+from datetime import timedelta
+import hashlib
+
+from django.apps import apps
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+
+from supplier_app import DOCUMENT_PRUNE_GRACE_SECONDS, DOCUMENT_STATUS_PENDING, DOCUMENT_STATUS_STORED
+from utils.upload_spool import SpooledStorage, get_spool_name, get_spool_storage
+
+
+def _get_document_model():
+    # utils is imported by the models, the model is looked up when used
+    return apps.get_model('supplier_app', 'Document')
+
+
+class _HashingUploadHandlerMixin:
+    """Keep the SHA-256 of the uploaded file in its sha256 attribute"""
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # MemoryFileUploadHandler is not activated for big files, the chunks
+        # are hashed by the next handler
+        if getattr(self, 'activated', True):
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.sha256 = self.sha256.hexdigest()
+        return uploaded_file
+
+
+class MemoryHashingUploadHandler(_HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class TemporaryHashingUploadHandler(_HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def get_sha256(content):
+    """SHA-256 of content, from the upload handlers or read in chunks"""
+    sha256 = getattr(content, 'sha256', None)
+    if sha256:
+        return sha256
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _create_documents(documents, storage):
+    """Insert documents, returning the ones indexed for their SHA-256"""
+    try:
+        with transaction.atomic():
+            return _get_document_model().objects.bulk_create(documents)
+    except IntegrityError:
+        pass
+    # Another request stored some of the contents meanwhile, its documents
+    # are kept and the blobs stored here deleted
+    indexed_documents = []
+    for document in documents:
+        indexed_document, created = _get_document_model().objects.get_or_create(
+            sha256=document.sha256,
+            defaults={'name': document.name, 'size': document.size},
+        )
+        if not created:
+            storage.delete(document.name)
+        indexed_documents.append(indexed_document)
+    return indexed_documents
+
+
+def _queue_document_uploads():
+    # supplier_app.tasks imports the models, which import this module
+    from supplier_app.tasks import upload_pending_documents
+    upload_pending_documents.apply_async()
+
+
+def store_documents(field_files):
+    """
+    Commit the uncommitted files of field_files, storing each content only
+    once: the files with the SHA-256 of a Document take its name and the
+    others are saved and indexed. With an upload spool the new files are
+    written to it as pending documents, uploaded once the transaction is
+    committed. Runs the same queries for any number of files, so bulk
+    inserts can store all their files first.
+    """
+    field_files = [field_file for field_file in field_files if field_file and not field_file._committed]
+    contents = {}
+    for field_file in field_files:
+        field_file.sha256 = get_sha256(field_file.file)
+        contents.setdefault(field_file.sha256, field_file)
+    documents = {
+        document.sha256: document
+        for document in _get_document_model().objects.filter(sha256__in=contents)
+    }
+    spool = get_spool_storage()
+    new_documents = []
+    for sha256, field_file in contents.items():
+        if sha256 in documents:
+            continue
+        name = field_file.field.generate_filename(field_file.instance, field_file.name)
+        if spool is None:
+            name = field_file.storage.save(name, field_file.file, max_length=field_file.field.max_length)
+            document = _get_document_model()(sha256=sha256, name=name, size=field_file.file.size)
+        else:
+            name = spool.save(get_spool_name(name, sha256), field_file.file, max_length=field_file.field.max_length)
+            document = _get_document_model()(
+                sha256=sha256,
+                name=name,
+                size=field_file.file.size,
+                status=DOCUMENT_STATUS_PENDING,
+            )
+        documents[sha256] = document
+        new_documents.append(document)
+    if new_documents:
+        for document in _create_documents(new_documents, spool or field_files[0].storage):
+            documents[document.sha256] = document
+        if spool is not None:
+            transaction.on_commit(_queue_document_uploads)
+    for field_file in field_files:
+        field_file.name = documents[field_file.sha256].name
+        setattr(field_file.instance, field_file.field.name, field_file.name)
+        field_file._committed = True
+
+
+class DocumentFieldFile(FieldFile):
+
+    # FieldFile and FileDescriptor set the storage of the field, the files
+    # still in the upload spool are read from it
+    @property
+    def storage(self):
+        return self._storage
+
+    @storage.setter
+    def storage(self, storage):
+        self._storage = storage if isinstance(storage, SpooledStorage) else SpooledStorage(storage)
+
+    def save(self, name, content, save=True):
+        self.name = name
+        self.file = content
+        self._committed = False
+        store_documents([self])
+        if save:
+            self.instance.save()
+
+    save.alters_data = True
+
+    def delete(self, save=True):
+        # The blob may be used by other rows, check_documents deletes it
+        # when nothing uses it anymore
+        if hasattr(self, '_file'):
+            self.close()
+            del self.file
+        self.name = None
+        setattr(self.instance, self.field.name, self.name)
+        self._committed = False
+        if save:
+            self.instance.save()
+
+    delete.alters_data = True
+
+
+class DocumentFileField(models.FileField):
+    attr_class = DocumentFieldFile
+
+
+def get_document_fields():
+    """
+    (model, field name) of every DocumentFileField, and of the same field
+    in the historical model of the models with history.
+    """
+    fields = []
+    for model in apps.get_models():
+        for field in model._meta.local_fields:
+            if isinstance(field, DocumentFileField):
+                fields.append((model, field.name))
+                history = getattr(model, 'history', None)
+                if history is not None:
+                    fields.append((history.model, field.name))
+    return fields
+
+
+def get_document_references(names=None):
+    """
+    Counter of the rows and historical records using each stored file
+    name, only for names when given. Runs one query per document field.
+    """
+    references = Counter()
+    for model, field_name in get_document_fields():
+        queryset = model._default_manager.exclude(**{field_name: ''}).exclude(**{field_name: None})
+        if names is not None:
+            queryset = queryset.filter(**{'{}__in'.format(field_name): names})
+        for row in queryset.values(field_name).annotate(references=Count('pk')).order_by():
+            references[row[field_name]] += row['references']
+    return references
+
+
+def rename_document(document, name):
+    """Rename document, and the rows and historical records using it"""
+    with transaction.atomic():
+        for model, field_name in get_document_fields():
+            model._default_manager.filter(**{field_name: document.name}).update(**{field_name: name})
+        _get_document_model().objects.filter(id=document.id).update(name=name)
+    document.name = name
+
+
+def _hash_stored_file(storage, name):
+    with storage.open(name, 'rb') as stored_file:
+        return get_sha256(stored_file)
+
+
+def index_documents(storage):
+    """
+    Index the files used by the document fields that are not indexed yet,
+    the ones uploaded before the index. Returns the (name, sha256) of the
+    ones indexed and of the ones with the content of an indexed file, those
+    are still stored twice. Files missing from storage are skipped.
+    """
+    Document = _get_document_model()
+    indexed_names = set(Document.objects.values_list('name', flat=True))
+    indexed, duplicated = [], []
+    for name in sorted(set(get_document_references()) - indexed_names):
+        try:
+            sha256 = _hash_stored_file(storage, name)
+        except (IOError, OSError):
+            continue
+        _, created = Document.objects.get_or_create(
+            sha256=sha256,
+            defaults={'name': name, 'size': storage.size(name)},
+        )
+        (indexed if created else duplicated).append((name, sha256))
+    return indexed, duplicated
+
+
+def verify_documents(storage):
+    """
+    The indexed documents missing from storage or with other content, the
+    ones in the upload spool are not checked.
+    """
+    broken = []
+    documents = _get_document_model().objects.filter(status=DOCUMENT_STATUS_STORED)
+    for document in documents.order_by('id').iterator():
+        try:
+            sha256 = _hash_stored_file(storage, document.name)
+        except (IOError, OSError):
+            sha256 = None
+        if sha256 != document.sha256:
+            broken.append(document)
+    return broken
+
+
+def prune_documents(storage):
+    """
+    Delete the stored documents no row or historical record uses since
+    DOCUMENT_PRUNE_GRACE_SECONDS, and mark the ones found unused for the
+    first time. The ones in the upload spool are kept.
+    """
+    Document = _get_document_model()
+    now = timezone.now()
+    references = get_document_references()
+    documents = Document.objects.filter(status=DOCUMENT_STATUS_STORED).order_by('id')
+    used, unused, expired = [], [], []
+    for document in documents:
+        if references[document.name]:
+            if document.unused_since:
+                used.append(document.id)
+        elif document.unused_since is None:
+            unused.append(document.id)
+        elif document.unused_since <= now - timedelta(seconds=DOCUMENT_PRUNE_GRACE_SECONDS):
+            expired.append(document.id)
+    Document.objects.filter(id__in=used).update(unused_since=None)
+    Document.objects.filter(id__in=unused).update(unused_since=now)
+    with transaction.atomic():
+        expired = list(Document.objects.select_for_update().filter(id__in=expired).order_by('id'))
+        references = get_document_references([document.name for document in expired])
+        pruned = [document for document in expired if not references[document.name]]
+        Document.objects.filter(id__in=[document.id for document in pruned]).delete()
+    for document in pruned:
+        storage.delete(document.name)
+    return pruned
@@ -8,3 +8,8 @@ class EmailError(Exception):
 class CouldNotSendEmailError(EmailError):
     """Generic error for error in email host user or password"""
     pass
+
+
+class QueryBudgetExceeded(Exception):
+    """A view ran more queries than its budget in QUERY_BUDGETS"""
+    pass
@@ -0,0 +1,110 @@
+import hashlib
+import mimetypes
+import re
+
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from dropbox.exceptions import ApiError
+
+# Only single ranges are served, any other Range gets the whole file
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STORED_FILE_BLOCK_SIZE = 64 * 1024
+
+
+class _RangeNotSatisfiable(Exception):
+    pass
+
+
+class _FileRange:
+    """The bytes start to end of a file, read by FileResponse"""
+
+    def __init__(self, stored_file, start, end):
+        stored_file.seek(start)
+        self._file = stored_file
+        self._remaining = end - start + 1
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size) if size else b''
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def _is_not_found(error):
+    if isinstance(error, ApiError):
+        # Dropbox, the storage in production, raises it when reading the
+        # metadata of a missing file, and for any other failed call
+        return error.error.is_path() and error.error.get_path().is_not_found()
+    return True
+
+
+def _get_range(request, etag, size):
+    """(start, end) asked by the Range header, or None for the whole file"""
+    range_header = request.META.get('HTTP_RANGE', '').strip()
+    match = _RANGE_RE.match(range_header)
+    if not match or request.META.get('HTTP_IF_RANGE', etag) != etag:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        if not int(end):
+            raise _RangeNotSatisfiable()
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        raise _RangeNotSatisfiable()
+    return start, min(int(end), size - 1) if end else size - 1
+
+
+def stored_file_response(request, storage, name, content_type=None, filename=None, as_attachment=False):
+    """
+    Stream the file name of storage. The ETag is the name and modification
+    time of the file, so browsers revalidate it with If-None-Match and get a
+    304 instead of the file, and a single byte Range gets a 206 with that
+    part, for PDF viewers and resumed downloads.
+    """
+    try:
+        modified_time = storage.get_modified_time(name)
+    except (FileNotFoundError, ApiError) as error:
+        if not _is_not_found(error):
+            raise
+        raise Http404()
+    etag = quote_etag(hashlib.sha256(repr([name, modified_time]).encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        stored_file = storage.open(name, 'rb')
+        size = stored_file.size
+        try:
+            file_range = _get_range(request, etag, size)
+        except _RangeNotSatisfiable:
+            stored_file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+        if file_range is None:
+            response = FileResponse(stored_file)
+            response['Content-Length'] = size
+        else:
+            start, end = file_range
+            response = FileResponse(_FileRange(stored_file, start, end), status=206)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+        response.block_size = STORED_FILE_BLOCK_SIZE
+        filename = filename or name.rsplit('/', 1)[-1]
+        response['Content-Type'] = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response['Content-Disposition'] = '{}; filename={}'.format(
+            'attachment' if as_attachment else 'inline',
+            filename,
+        )
+        response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
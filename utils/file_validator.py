@@ -1,13 +1,51 @@
-from django.core.exceptions import ValidationError
+"""
+Validation of the uploaded files.
+
+Besides their size and extension, the uploaded PDFs are checked to be
+readable: the first chunk must have the PDF header, and PyPDF2 must read
+the xref table, trailer and page tree. Broken or huge PDFs are rejected on
+upload instead of breaking whoever opens them later. PyPDF2 is slow and can
+spin on crafted files, so check_pdfs runs it in PDF_VALIDATION_WORKERS
+processes, each check stopped after PDF_VALIDATION_TIMEOUT seconds. The
+files are spooled to disk for the workers, never read whole into memory.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import repeat
+import signal
+import tempfile
+import threading
 
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models.fields.files import FieldFile
 from django.utils.translation import ugettext_lazy as _
 from django.utils.deconstruct import deconstructible
+from PyPDF2 import PdfFileReader
 
 from invoices_app import (
     INVOICE_MAX_SIZE_FILE,
     INVOICE_ALLOWED_FILE_EXTENSIONS,
 )
 
+# The PDF header may come after some garbage, up to 1024 bytes in
+PDF_HEADER = b'%PDF-'
+PDF_HEADER_SIZE = 1024
+
+PDF_INVALID = 'invalid'
+PDF_ENCRYPTED = 'encrypted'
+PDF_NO_PAGES = 'no_pages'
+PDF_TOO_MANY_PAGES = 'too_many_pages'
+PDF_TIMEOUT = 'timeout'
+
+PDF_ERRORS = {
+    PDF_INVALID: _('The file is not a valid PDF'),
+    PDF_ENCRYPTED: _('The PDF is encrypted'),
+    PDF_NO_PAGES: _('The PDF has no pages'),
+    PDF_TOO_MANY_PAGES: _('The PDF has more than {} pages'),
+    PDF_TIMEOUT: _('The PDF took too long to read'),
+}
+
 
 @deconstructible
 class FileSizeValidator(object):
@@ -37,7 +75,7 @@ class FileSizeValidator(object):
             )
 
 
-def validate_file(file, max_size_form=None):
+def validate_file(file, max_size_form=None, read_pdf=True):
     if not max_size_form:
         max_size_form = INVOICE_MAX_SIZE_FILE
 
@@ -61,4 +99,128 @@ def validate_file(file, max_size_form=None):
                 ''.join(INVOICE_ALLOWED_FILE_EXTENSIONS)
             )
         )
+
+    if read_pdf and value_to_return['is_valid']:
+        pdf_error = check_pdfs([file])[0]
+        if pdf_error:
+            value_to_return['is_valid'] = False
+            value_to_return['errors'].append(pdf_error)
     return list(value_to_return.values())
+
+
+class _PdfCheckTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise _PdfCheckTimeout()
+
+
+def check_pdf(path, max_pages, timeout):
+    """
+    Error code of the PDF in path, or None when it can be read. It runs in
+    the worker processes, where a timer interrupts it after timeout seconds.
+    """
+    # Signals only reach the main thread, checks run inline in other
+    # threads go without timer
+    use_timer = bool(timeout) and threading.current_thread() is threading.main_thread()
+    if use_timer:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with open(path, 'rb') as pdf:
+            reader = PdfFileReader(pdf, strict=False)
+            if reader.isEncrypted:
+                return PDF_ENCRYPTED
+            pages = reader.getNumPages()
+    except _PdfCheckTimeout:
+        return PDF_TIMEOUT
+    # PyPDF2 raises all kinds of errors on broken files
+    except Exception:
+        return PDF_INVALID
+    finally:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+    if not pages:
+        return PDF_NO_PAGES
+    if pages > max_pages:
+        return PDF_TOO_MANY_PAGES
+    return None
+
+
+def _get_path(uploaded_file, stack):
+    """Path of uploaded_file on disk, spooled to a temporary file if needed"""
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        return uploaded_file.temporary_file_path()
+    spooled_file = stack.enter_context(tempfile.NamedTemporaryFile(suffix='.pdf'))
+    for chunk in uploaded_file.chunks():
+        spooled_file.write(chunk)
+    spooled_file.flush()
+    return spooled_file.name
+
+
+def _get_uploaded_file(value):
+    return value.file if isinstance(value, FieldFile) else value
+
+
+def check_pdfs(files, workers=None):
+    """
+    Error message of each of files, None for the readable PDFs. The files
+    without the PDF header in their first chunk are rejected right away,
+    the others are read by check_pdf in workers processes
+    (PDF_VALIDATION_WORKERS by default), or in this process when it is 0.
+    The result is kept in the pdf_error attribute of each file, so the
+    model validators do not read again the files checked by the views.
+    """
+    if workers is None:
+        workers = settings.PDF_VALIDATION_WORKERS
+    files = [_get_uploaded_file(uploaded_file) for uploaded_file in files]
+    errors = [None] * len(files)
+    with ExitStack() as stack:
+        paths = {}
+        for index, uploaded_file in enumerate(files):
+            if hasattr(uploaded_file, 'pdf_error'):
+                errors[index] = uploaded_file.pdf_error
+                continue
+            uploaded_file.seek(0)
+            header = uploaded_file.read(PDF_HEADER_SIZE)
+            uploaded_file.seek(0)
+            if PDF_HEADER not in header:
+                errors[index] = PDF_INVALID
+            else:
+                paths[index] = _get_path(uploaded_file, stack)
+        arguments = (list(paths.values()), repeat(settings.PDF_MAX_PAGES), repeat(settings.PDF_VALIDATION_TIMEOUT))
+        workers = min(workers, len(paths))
+        if workers < 1:
+            results = list(map(check_pdf, *arguments))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(check_pdf, *arguments))
+        for index, error in zip(paths, results):
+            errors[index] = error
+    for uploaded_file, error in zip(files, errors):
+        uploaded_file.pdf_error = error
+    return [
+        PDF_ERRORS[error].format(settings.PDF_MAX_PAGES) if error else None
+        for error in errors
+    ]
+
+
+@deconstructible
+class PdfValidator(object):
+    """Reject the uploaded files check_pdfs finds are not readable PDFs"""
+
+    code = 'invalid_pdf'
+
+    def __call__(self, value):
+        # Stored files were checked when they were uploaded, and the ones
+        # with other extensions are rejected by FileExtensionValidator
+        if getattr(value, '_committed', False) or not value.name.lower().endswith('.pdf'):
+            return
+        error = check_pdfs([value])[0]
+        if error:
+            raise ValidationError(error, code=self.code)
+
+    def __eq__(self, other):
+        return isinstance(other, PdfValidator)
@@ -1,59 +1,67 @@
+from django.utils import timezone
 from django.utils.translation import gettext, gettext_lazy as _
 
-from invoices_app import INVOICE_STATUS
-from invoices_app.models import Comment, Invoice
-
-AVOID_COMMENTS = [
-    'new_comment_from_ap',
-    'new_comment_from_supplier',
-]
+from invoices_app.models import Comment, Invoice, InvoiceChange
+from utils.invoice_lookup import get_invoice_status
 
 
 def get_status_display(status):
-    for k, v in INVOICE_STATUS:
-        if k == status:
-            return v
+    invoice_status = get_invoice_status(status)
+    return invoice_status.label if invoice_status else None
 
 
 def invoice_history_comments(invoice):
     """
     This function returns a list of automaticly generated comments for an invoice.
-    The comments are generated using the invoice change history, this allows us
+    The comments are generated from the invoice change log, this allows us
     to create the comments in the current user's language.
 
     The comments contain the user that made the change and a text message with every
     field that changed with the original value and the new value.
     """
-    history = Invoice.history.filter(id=invoice.id)
-    record = history.last()
+    invoice_changes = InvoiceChange.objects.filter(
+        invoice=invoice,
+    ).select_related('user').order_by('change_date', 'history_id')
     comments = []
-    while record.next_record:
-        next_record = record.next_record
-        delta = next_record.diff_against(record)
+    for invoice_change in invoice_changes:
         message = _('Changed: \n')
-        for change in delta.changes:
-            if change.field not in AVOID_COMMENTS:
-                if change.field != 'status':
-                    old_value = change.old
-                    new_value = change.new
-                else:
-                    old_value = get_status_display(change.old)
-                    new_value = get_status_display(change.new)
-                message += _('{} from {} to {}\n').format(
-                    Invoice._meta.get_field(change.field).verbose_name,
-                    old_value,
-                    new_value,
-                )
-        if next_record.history_change_reason:
-            message += gettext('\nChange reason:\n')
-            message += next_record.history_change_reason
-        if message != _('Changed: \n'):
-            comment = Comment(
-                user=next_record.history_user,
-                invoice=next_record.instance,
-                message=message,
-                comment_date_received=next_record.history_date
+        for field, old_value, new_value in invoice_change.get_changes():
+            if field == 'status':
+                old_value = get_status_display(old_value)
+                new_value = get_status_display(new_value)
+            message += _('{} from {} to {}\n').format(
+                Invoice._meta.get_field(field).verbose_name,
+                old_value,
+                new_value,
             )
-            comments.append(comment)
-        record = next_record
+        if invoice_change.change_reason:
+            message += gettext('\nChange reason:\n')
+            message += invoice_change.change_reason
+        comment = Comment(
+            user=invoice_change.user,
+            invoice=invoice,
+            message=message,
+            comment_date_received=invoice_change.change_date
+        )
+        comments.append(comment)
     return comments
+
+
+def build_historical_record(instance, history_user=None, history_change_reason=None, history_type='~',
+                            history_date=None):
+    """
+    The historical record simple_history would create when saving instance,
+    for changes written with update() or bulk_create, which skip it.
+    """
+    history_model = type(instance).history.model
+    return history_model(
+        history_date=history_date or timezone.now(),
+        history_user=history_user,
+        history_change_reason=history_change_reason,
+        history_type=history_type,
+        **{
+            field.attname: getattr(instance, field.attname)
+            for field in instance._meta.fields
+            if field.name not in history_model._history_excluded_fields
+        }
+    )
@@ -1,14 +1,34 @@
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
-from django.http import HttpResponse
 from django.template.loader import get_template
 
 from xhtml2pdf import pisa
 
-def render_to_pdf(template_src, context_dict={}):
-    template = get_template(template_src)
-    html  = template.render(context_dict)
+
+def html_to_pdf(html):
+    """The PDF of html, as bytes, or None if it fails"""
     result = BytesIO()
     pdf = pisa.pisaDocument(BytesIO(html.encode("ISO-8859-1")), result)
     if not pdf.err:
-        return HttpResponse(result.getvalue(), content_type='application/pdf')
-    return None
\ No newline at end of file
+        return result.getvalue()
+    return None
+
+
+def htmls_to_pdfs(htmls, workers):
+    """
+    html_to_pdf of each of htmls, converted by workers processes. It is the
+    CPU heavy part, the templates are rendered by the caller since it has
+    the database connection.
+    """
+    workers = min(workers, len(htmls))
+    if workers < 2:
+        return [html_to_pdf(html) for html in htmls]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(html_to_pdf, htmls))
+
+
+def render_to_pdf(template_src, context_dict={}):
+    """The PDF of the rendered template, as bytes, or None if it fails"""
+    template = get_template(template_src)
+    html  = template.render(context_dict)
+    return html_to_pdf(html)
@@ -1,8 +1,50 @@
-from django.utils.translation import gettext as _
-from invoices_app import INVOICE_STATUS
+"""
+Registry of the invoice statuses: code, untranslated name, label and badge.
+
+The statuses were found scanning INVOICE_STATUS and translating every
+label on each lookup, six times per view for the template constants. The
+codes are found by name in a dict, and the labels of each language are
+translated once and kept for the life of the process.
+"""
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from django.utils import translation
+
+from invoices_app import (
+    INVOICE_STATUS,
+    INVOICE_STATUS_BADGES,
+    INVOICE_STATUS_CODES,
+)
+
+InvoiceStatus = namedtuple('InvoiceStatus', 'code name label badge')
+
+_INVOICE_STATUS_NAMES = {code: name for name, code in INVOICE_STATUS_CODES.items()}
+
+
+@lru_cache(maxsize=None)
+def get_invoice_statuses(language):
+    """The InvoiceStatus of each code, labeled in language"""
+    with translation.override(language):
+        return OrderedDict(
+            (code, InvoiceStatus(code, _INVOICE_STATUS_NAMES[code], str(label), INVOICE_STATUS_BADGES[code]))
+            for code, label in INVOICE_STATUS
+        )
+
+
+@lru_cache(maxsize=None)
+def _get_invoice_status_codes_by_label(language):
+    return {status.label: status.code for status in get_invoice_statuses(language).values()}
+
+
+def get_invoice_status(code):
+    """The InvoiceStatus of code in the active language, None if unknown"""
+    return get_invoice_statuses(translation.get_language()).get(code)
 
 
 def invoice_status_lookup(status_value):
-    for (key, value) in INVOICE_STATUS:
-        if _(status_value) == value:
-            return key
+    """The code of the status called status_value, or labeled so in the active language"""
+    code = INVOICE_STATUS_CODES.get(status_value)
+    if code is None:
+        code = _get_invoice_status_codes_by_label(translation.get_language()).get(status_value)
+    return code
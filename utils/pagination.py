@@ -0,0 +1,153 @@
+import base64
+import binascii
+from functools import reduce
+import hashlib
+import json
+import operator
+
+from django.core.cache import cache
+from django.db.models import Q
+
+CURSOR_PARAM = 'cursor'
+CURSOR_NEXT = 'n'
+CURSOR_PREVIOUS = 'p'
+KEYSET_COUNT_CACHE_TIMEOUT = 5 * 60
+
+
+def encode_cursor(direction, values):
+    # isoformat() keeps the microseconds, which the seek comparison needs.
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    payload = json.dumps([direction, values])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, keys_count):
+    """
+    Return the (direction, values) stored in cursor, or None when the cursor
+    was tampered with or does not match the ordering of the listing.
+    """
+    try:
+        direction, values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        return None
+    if direction not in (CURSOR_NEXT, CURSOR_PREVIOUS) or not isinstance(values, list) or len(values) != keys_count:
+        return None
+    return direction, values
+
+
+def _split_ordering(ordering):
+    return [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+
+def _reverse_ordering(ordering):
+    return [field[1:] if field.startswith('-') else '-' + field for field in ordering]
+
+
+def get_keyset_filter(ordering, values, forward=True):
+    """
+    Build the Q object selecting the rows that come after (or before, when
+    forward is False) the row whose ordering fields hold values.
+
+    For an ordering (a, id) going forward this is a > va OR (a = va AND id > vid).
+    """
+    conditions = []
+    equals = {}
+    for (field, descending), value in zip(_split_ordering(ordering), values):
+        lookup = 'lt' if descending == forward else 'gt'
+        conditions.append(Q(**equals) & Q(**{'{}__{}'.format(field, lookup): value}))
+        equals[field] = value
+    return reduce(operator.or_, conditions)
+
+
+def get_cached_count(queryset):
+    """
+    Count the rows of queryset, reusing the result of an identical query for
+    KEYSET_COUNT_CACHE_TIMEOUT seconds.
+    """
+    cache_key = 'keyset_count:{}'.format(hashlib.sha256(str(queryset.query).encode('utf-8')).hexdigest())
+    count = cache.get(cache_key)
+    if count is None:
+        count = queryset.count()
+        cache.set(cache_key, count, KEYSET_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, querydict, ordering, has_next, has_previous, count=None):
+        self.object_list = object_list
+        self.querydict = querydict
+        self.ordering = ordering
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.count = count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _get_values(self, obj):
+        return [getattr(obj, field) for field, _ in _split_ordering(self.ordering)]
+
+    def _get_querystring(self, direction, obj):
+        querydict = self.querydict.copy()
+        querydict.pop('page', None)
+        querydict[CURSOR_PARAM] = encode_cursor(direction, self._get_values(obj))
+        return querydict.urlencode()
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_querystring(self):
+        if self.has_next and self.object_list:
+            return self._get_querystring(CURSOR_NEXT, self.object_list[-1])
+
+    @property
+    def previous_querystring(self):
+        if self.has_previous and self.object_list:
+            return self._get_querystring(CURSOR_PREVIOUS, self.object_list[0])
+
+
+class KeysetPaginationMixin:
+    """
+    Paginate a ListView by seeking past the last row shown instead of using
+    OFFSET, so every page costs the same no matter how deep it is.
+
+    keyset_ordering must end with a unique field (usually 'id') so that rows
+    sharing the leading values still have a stable order. The exact number
+    of rows is only computed when keyset_count is True, and it is cached.
+    """
+    keyset_ordering = ('id',)
+    keyset_count = False
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = list(self.keyset_ordering)
+        cursor = decode_cursor(self.request.GET.get(CURSOR_PARAM, ''), len(ordering))
+        direction, values = cursor if cursor else (CURSOR_NEXT, None)
+        forward = direction == CURSOR_NEXT
+
+        page_queryset = queryset.order_by(*(ordering if forward else _reverse_ordering(ordering)))
+        if values is not None:
+            page_queryset = page_queryset.filter(get_keyset_filter(ordering, values, forward))
+        object_list = list(page_queryset[:page_size + 1])
+        has_more = len(object_list) > page_size
+        object_list = object_list[:page_size]
+
+        if forward:
+            has_next, has_previous = has_more, values is not None
+        else:
+            object_list.reverse()
+            has_next, has_previous = True, has_more
+
+        page = KeysetPage(
+            object_list,
+            self.request.GET,
+            ordering,
+            has_next=has_next,
+            has_previous=has_previous,
+            count=get_cached_count(queryset) if self.keyset_count else None,
+        )
+        return None, page, object_list, page.has_other_pages()
@@ -0,0 +1,145 @@
+from collections import Counter, deque
+import logging
+import re
+import threading
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils.deprecation import MiddlewareMixin
+
+from utils.exceptions import QueryBudgetExceeded
+
+logger = logging.getLogger(__name__)
+
+# Requests kept per view to compute the percentiles
+QUERY_STATS_SAMPLES = 500
+QUERY_STATS_SLOWEST = 5
+QUERY_STATS_PERCENTILES = (50, 90, 99)
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r'IN \(\?(?:, \?)*\)')
+
+
+def get_fingerprint(sql):
+    """
+    Replace the literals of sql, so the same statement run with different
+    parameters (the usual N+1 pattern) gets the same fingerprint.
+    """
+    return _IN_LIST_RE.sub('IN (...)', _LITERAL_RE.sub('?', sql))
+
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    index = max(int(round(percentile / 100 * len(values))) - 1, 0)
+    return values[index]
+
+
+class QueryProfile:
+
+    def __init__(self, queries):
+        self.count = len(queries)
+        self.time = sum(float(query['time']) for query in queries)
+        self.slowest = sorted(
+            ((float(query['time']), query['sql']) for query in queries),
+            reverse=True,
+        )[:QUERY_STATS_SLOWEST]
+        fingerprints = Counter(get_fingerprint(query['sql']) for query in queries)
+        self.duplicates = {sql: count for sql, count in fingerprints.items() if count > 1}
+
+
+class ViewQueryStats:
+
+    def __init__(self):
+        self.samples = deque(maxlen=QUERY_STATS_SAMPLES)
+        self.slowest = []
+        self.duplicates = Counter()
+        self.over_budget = 0
+
+    def add(self, profile, over_budget):
+        self.samples.append((profile.count, profile.time))
+        self.slowest = sorted(self.slowest + profile.slowest, reverse=True)[:QUERY_STATS_SLOWEST]
+        self.duplicates.update(profile.duplicates)
+        self.over_budget += over_budget
+
+    def as_dict(self):
+        counts = [count for count, _ in self.samples]
+        times = [time for _, time in self.samples]
+        return {
+            'requests': len(self.samples),
+            'over_budget': self.over_budget,
+            'queries': {
+                'p{}'.format(percentile): get_percentile(counts, percentile)
+                for percentile in QUERY_STATS_PERCENTILES
+            },
+            'time': {
+                'p{}'.format(percentile): get_percentile(times, percentile)
+                for percentile in QUERY_STATS_PERCENTILES
+            },
+            'slowest': [{'time': time, 'sql': sql} for time, sql in self.slowest],
+            'duplicates': [
+                {'sql': sql, 'count': count}
+                for sql, count in self.duplicates.most_common(QUERY_STATS_SLOWEST)
+            ],
+        }
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record_query_profile(url_name, profile, over_budget=False):
+    with _stats_lock:
+        _stats.setdefault(url_name, ViewQueryStats()).add(profile, over_budget)
+
+
+def get_query_stats():
+    with _stats_lock:
+        return {url_name: stats.as_dict() for url_name, stats in sorted(_stats.items())}
+
+
+def reset_query_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+class QueryBudgetMiddleware(MiddlewareMixin):
+    """
+    Record the queries run by every view, keyed by its url name, and check
+    them against QUERY_BUDGETS.
+
+    Only enabled when QUERY_PROFILING_ENABLED is set, since it turns on the
+    debug cursor. Going over the budget of a view logs a warning, or raises
+    QueryBudgetExceeded when QUERY_BUDGET_RAISE is set (as in the tests).
+    """
+
+    def __init__(self, get_response=None):
+        if not settings.QUERY_PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def process_request(self, request):
+        request._query_budget_state = (connection.force_debug_cursor, len(connection.queries_log))
+        connection.force_debug_cursor = True
+
+    def process_response(self, request, response):
+        state = getattr(request, '_query_budget_state', None)
+        if state is None:
+            return response
+        force_debug_cursor, initial_queries = state
+        connection.force_debug_cursor = force_debug_cursor
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None or not resolver_match.url_name:
+            return response
+
+        url_name = resolver_match.url_name
+        profile = QueryProfile(list(connection.queries_log)[initial_queries:])
+        budget = settings.QUERY_BUDGETS.get(url_name)
+        over_budget = budget is not None and profile.count > budget
+        record_query_profile(url_name, profile, over_budget)
+        if over_budget:
+            message = '{} ran {} queries, over its budget of {}'.format(url_name, profile.count, budget)
+            logger.warning(message)
+            if settings.QUERY_BUDGET_RAISE:
+                raise QueryBudgetExceeded(message)
+        return response
@@ -0,0 +1,103 @@
+"""
+Cache of the reference data read by most requests: the EB entities, the
+company and taxpayer names, the role permissions. They change a few times
+a month but were queried on every request showing a form or a list.
+
+A function decorated with cached_reference_data keeps its result in the
+default cache, the Redis of the celery broker in production. The key of a
+result has the current version of its name, and saving or deleting an
+instance of one of the models it reads moves the name to a new version.
+A request that read the old rows meanwhile stores its result with the old
+version, where nobody reads it, so a change is never hidden by a stale
+result. The version is also moved when the transaction is committed, for
+the requests that read the rows before the commit.
+"""
+from functools import wraps
+import uuid
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+REFERENCE_DATA_CACHE_TIMEOUT = 60 * 60
+
+# Labels of the models read by each cached name
+_reference_data_models = {}
+# Cached names read by each model, and by the subclasses of the models
+_reference_data_senders = {}
+
+
+def _get_version_key(name):
+    return 'reference_data:{}:version'.format(name)
+
+
+def _get_version(name):
+    version_key = _get_version_key(name)
+    version = cache.get(version_key)
+    if version is None:
+        # Another request may have set it meanwhile, its version is kept
+        cache.add(version_key, uuid.uuid4().hex, None)
+        version = cache.get(version_key)
+    return version
+
+
+def invalidate_reference_data(name):
+    cache.set(_get_version_key(name), uuid.uuid4().hex, None)
+
+
+def get_reference_data(name, build):
+    """The cached result of build for name, built again when it changed"""
+    key = 'reference_data:{}:{}'.format(name, _get_version(name))
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, REFERENCE_DATA_CACHE_TIMEOUT)
+    return data
+
+
+def cached_reference_data(name, models):
+    """
+    Decorator caching the result of a function without arguments, until an
+    instance of one of models (app labels like 'supplier_app.EBEntity', or
+    their subclasses) is saved or deleted.
+    """
+    for model in models:
+        _reference_data_models.setdefault(model, set()).add(name)
+
+    def decorator(build):
+        @wraps(build)
+        def wrapper():
+            return get_reference_data(name, build)
+        wrapper.invalidate = lambda: invalidate_reference_data(name)
+        return wrapper
+    return decorator
+
+
+def invalidate_changed_reference_data(sender, **kwargs):
+    for name in _reference_data_senders.get(sender, ()):
+        invalidate_reference_data(name)
+        transaction.on_commit(lambda name=name: invalidate_reference_data(name))
+
+
+def connect_reference_data_signals():
+    """
+    Invalidate the cached names when the models they read are saved or
+    deleted, called once the models are loaded. Taxpayers are saved
+    through their country model, so the subclasses are connected too.
+    """
+    models = {apps.get_model(label): names for label, names in _reference_data_models.items()}
+    for sender in apps.get_models():
+        names = set()
+        for model, model_names in models.items():
+            if issubclass(sender, model):
+                names |= model_names
+        if not names:
+            continue
+        _reference_data_senders[sender] = names
+        for signal in (post_save, post_delete):
+            signal.connect(
+                invalidate_changed_reference_data,
+                sender=sender,
+                dispatch_uid='reference_data_{}'.format(sender._meta.label),
+            )
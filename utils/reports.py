@@ -1,66 +1,86 @@
 from datetime import timedelta
 from datetime import datetime
+import hashlib
+import json
+from tempfile import TemporaryFile
+from wsgiref.util import FileWrapper
 
 from openpyxl import Workbook
-from tempfile import NamedTemporaryFile
-from django.core.files.base import ContentFile
-from django.http import (
-    HttpResponse,
-)
+from django.db.models import Max
+from django.http import StreamingHttpResponse
 from django.utils.translation import gettext_lazy as _
 
 import attr
 
 from utils import COMMENT_TAXPAYER, COMMENT_TAXPAYER_INT_VALUES
 
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+XLSX_STREAM_CHUNK_SIZE = 64 * 1024
+XLSX_PROGRESS_STEP = 1000
+
 
 class ExcelReportInputParams:
     model = attr.ib
     headers_attrs = attr.ib
     tab_name = attr.ib
+    formatters = attr.ib
 
-    def __init__(self, model, tab_name, headers_attrs):
+    def __init__(self, model, tab_name, headers_attrs, formatters=None):
         self.headers_attrs = headers_attrs
         self.model = model
         self.tab_name = tab_name
-
-
-def generate_xls(params):
-    queryset = params.model
-    headers = params.headers_attrs.keys()
-    attrs = params.headers_attrs.values()
-    workbook = Workbook()
-    worksheet = workbook.active
-    worksheet.title = params.tab_name
-    row_num = 1
-    for col_num, column_title in enumerate(headers, 1):
-        cell = worksheet.cell(row=row_num, column=col_num)
-        cell.value = column_title
-
-    for data in queryset:
-        row_num += 1
-        row = []
-
-        for attribute in attrs:
-            model_atribute = getattr(data, attribute)
-            if callable(model_atribute):
-                row.append(model_atribute())
-            else:
-                row.append(model_atribute)
-
-        for col_num, cell_value in enumerate(row, 1):
-            cell = worksheet.cell(row=row_num, column=col_num)
-            cell.value = cell_value
-
-    with NamedTemporaryFile() as tmp:
-        workbook.save(tmp.name)
-        tmp.seek(0)
-        stream = tmp.read()
-    return stream
-
-
-def generate_response_xls(xls_file, file_name):
-    response = HttpResponse(ContentFile(xls_file), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        self.formatters = formatters or {}
+
+
+def get_report_rows(params):
+    """
+    Yield one list of cell values per row of the report queryset.
+
+    The queryset is projected with values_list() over the report lookups and
+    consumed with iterator(), so no model instance is built and the rows are
+    never cached by the queryset.
+    """
+    lookups = list(params.headers_attrs.values())
+    formatters = [params.formatters.get(lookup) for lookup in lookups]
+    for values in params.model.values_list(*lookups).iterator():
+        yield [
+            formatter(value) if formatter else value
+            for formatter, value in zip(formatters, values)
+        ]
+
+
+def write_xls(params, output, progress_callback=None):
+    """
+    Write the report into output (a path or a binary file object).
+
+    A write-only workbook keeps every appended row in a temporary file instead
+    of memory, so the memory used does not depend on the number of rows.
+    progress_callback, if given, is called with the number of rows written
+    every XLSX_PROGRESS_STEP rows and once more when all rows are written.
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=params.tab_name)
+    worksheet.append(list(params.headers_attrs.keys()))
+    rows_written = 0
+    for row in get_report_rows(params):
+        worksheet.append(row)
+        rows_written += 1
+        if progress_callback and rows_written % XLSX_PROGRESS_STEP == 0:
+            progress_callback(rows_written)
+    workbook.save(output)
+    if progress_callback:
+        progress_callback(rows_written)
+    return rows_written
+
+
+def generate_streaming_response_xls(params, file_name):
+    xls_file = TemporaryFile()
+    write_xls(params, xls_file)
+    xls_file.seek(0)
+    response = StreamingHttpResponse(
+        FileWrapper(xls_file, XLSX_STREAM_CHUNK_SIZE),
+        content_type=XLSX_CONTENT_TYPE,
+    )
     response['Content-Disposition'] = 'attachment; filename={date}-{file_name}.xlsx'.format(
         date=datetime.now().strftime('%Y-%m-%d'),
         file_name=file_name
@@ -68,6 +88,77 @@ def generate_response_xls(xls_file, file_name):
     return response
 
 
+def _normalize_filter_value(value):
+    if value is None:
+        return None
+    if isinstance(value, slice):
+        return [str(value.start) if value.start is not None else None,
+                str(value.stop) if value.stop is not None else None]
+    if isinstance(value, (list, tuple)):
+        return sorted(str(item) for item in value)
+    return str(value)
+
+
+def normalize_filter_params(filterset):
+    """
+    Return the filterset's valid, non empty values as a JSON serializable dict.
+
+    Parameters the filterset does not know about (page, ordering...) are left
+    out, so two querystrings that filter the same rows normalize the same way.
+    filterset.qs still filters on the valid fields of an invalid form, so
+    those are kept, and the invalid fields are listed under '__errors__'.
+    """
+    form = filterset.form
+    form.is_valid()
+    params = {}
+    for field, value in form.cleaned_data.items():
+        value = _normalize_filter_value(value)
+        if value not in (None, '', [], [None, None]):
+            params[field] = value
+    if form.errors:
+        params['__errors__'] = sorted(form.errors)
+    return params
+
+
+def get_report_cache_key(report_name, filterset, last_change):
+    payload = json.dumps(
+        [report_name, normalize_filter_params(filterset), str(last_change)],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ExcelReport:
+    """
+    Describes an exportable report: which filterset narrows it, how its rows
+    are projected and which historical models tell when its data last changed.
+    """
+    kind = None
+    file_name = None
+    filterset_class = None
+    history_models = ()
+
+    def get_queryset(self):
+        raise NotImplementedError()
+
+    def get_params(self, filterset):
+        raise NotImplementedError()
+
+    def get_filterset(self, querydict):
+        return self.filterset_class(querydict, queryset=self.get_queryset())
+
+    def get_last_change(self):
+        last_changes = [
+            model.history.aggregate(last_change=Max('history_date'))['last_change']
+            for model in self.history_models
+        ]
+        last_changes = [last_change for last_change in last_changes if last_change]
+        return max(last_changes) if last_changes else None
+
+    def get_cache_key(self, filterset):
+        return get_report_cache_key(self.kind, filterset, self.get_last_change())
+
+
 def get_field_changes(form, except_field, model_to_compare):
     result = ""
     if hasattr(form, 'cleaned_data'):
@@ -0,0 +1,123 @@
+"""
+Search over the search_name column of taxpayers and companies.
+
+search_name keeps the name lowercased, without accents and with the
+punctuation collapsed to single spaces. PostgreSQL matches it through a GIN
+trigram index (see migration 0030_search_name of supplier_app) and SQLite,
+used in development and tests, through an FTS5 table per searchable table,
+kept up to date by triggers.
+"""
+import re
+import unicodedata
+
+from django.db import connection, connections
+from django.db.models import ExpressionWrapper, FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Length
+
+# Tables with a search_name column
+SEARCH_TABLES = (
+    'supplier_app_company',
+    'supplier_app_taxpayer',
+)
+
+_NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def normalize_search_text(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _NON_WORD_RE.sub(' ', text.lower()).strip()
+
+
+def get_search_tokens(text):
+    return normalize_search_text(text).split()
+
+
+def _get_fts_table(table):
+    return '{}_search'.format(table)
+
+
+def _get_fts_match(tokens):
+    # Tokens only have letters and digits, every one of them has to be the
+    # prefix of a word of the name
+    return ' '.join('"{}"*'.format(token) for token in tokens)
+
+
+def create_sqlite_search_tables(using='default'):
+    """
+    Create the FTS5 tables and their triggers if they are missing, and
+    rebuild them from search_name.
+
+    SQLite drops the triggers whenever a migration remakes the table, so this
+    runs after every migrate instead of in a migration.
+    """
+    with connections[using].cursor() as cursor:
+        for table in SEARCH_TABLES:
+            fts_table = _get_fts_table(table)
+            cursor.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5('
+                "search_name, content='{table}', content_rowid='id')".format(fts_table=fts_table, table=table)
+            )
+            cursor.execute(
+                'CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {table} BEGIN '
+                'INSERT INTO {fts_table}(rowid, search_name) VALUES (new.id, new.search_name); '
+                'END'.format(fts_table=fts_table, table=table)
+            )
+            cursor.execute(
+                'CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {table} BEGIN '
+                "INSERT INTO {fts_table}({fts_table}, rowid, search_name) VALUES ('delete', old.id, old.search_name); "
+                'END'.format(fts_table=fts_table, table=table)
+            )
+            cursor.execute(
+                'CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE OF search_name ON {table} BEGIN '
+                "INSERT INTO {fts_table}({fts_table}, rowid, search_name) VALUES ('delete', old.id, old.search_name); "
+                'INSERT INTO {fts_table}(rowid, search_name) VALUES (new.id, new.search_name); '
+                'END'.format(fts_table=fts_table, table=table)
+            )
+            cursor.execute("INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')".format(fts_table=fts_table))
+
+
+class _SearchMatchIds(RawSQL):
+    """
+    The ids matching an FTS5 table, as the right hand side of an id__in
+    filter. The lookup already wraps it in parentheses, and twice would make
+    SQLite read it as a single value.
+    """
+
+    def __init__(self, fts_table, match):
+        super().__init__('SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(fts_table), [match])
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def filter_by_search(queryset, text, rank=False):
+    """
+    Keep the rows of queryset whose search_name has every word of text. With
+    rank, the rows are also annotated with a search_rank, higher for better
+    matches.
+
+    The model of queryset has to own the search_name column, querysets of
+    the country taxpayers have to search TaxPayer instead.
+    """
+    tokens = get_search_tokens(text)
+    if not tokens:
+        return queryset.none()
+    if connection.vendor == 'sqlite':
+        fts_table = _get_fts_table(queryset.model._meta.db_table)
+        queryset = queryset.filter(id__in=_SearchMatchIds(fts_table, _get_fts_match(tokens)))
+    else:
+        for token in tokens:
+            queryset = queryset.filter(search_name__contains=token)
+    if not rank:
+        return queryset
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+        return queryset.annotate(search_rank=TrigramSimilarity('search_name', ' '.join(tokens)))
+    # Every word already matched, so the shorter names are the closer ones.
+    # The FTS5 rank would run the match again for every row.
+    return queryset.annotate(search_rank=ExpressionWrapper(
+        Value(1.0) / Length('search_name'),
+        output_field=FloatField(),
+    ))
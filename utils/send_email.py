@@ -1,7 +1,18 @@
-from typing import Tuple, List
+from collections import defaultdict
+import hashlib
+import json
+import logging
+import uuid
+from typing import Callable, Iterable, Tuple, List
 
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import (
+    EmailMultiAlternatives,
+    get_connection,
+    send_mail,
+)
+from django.db import transaction
+from django.db.models import Max
 from django.template.loader import render_to_string
 from django.utils import translation
 from django.utils.html import strip_tags
@@ -9,9 +20,17 @@ from django.utils.translation import (
     ugettext_lazy as _,
 )
 from django.contrib import messages
+from invoices_app import (
+    DISCLAIMER,
+    INVOICE_BULK_STATUS_COMMENT_EMAIL,
+    INVOICE_BULK_STATUS_EMAIL,
+    INVOICE_BULK_STATUS_UPPER,
+)
+from invoices_app.models import Invoice
 from supplier_app.constants.custom_messages import EMAIL_ERROR_MESSAGE
 from supplier_app.models import (
     CompanyUserPermission,
+    OutboxEmail,
     TaxPayer,
     InvitingBuyer)
 from supplier_app.constants.email_notifications import email_notifications
@@ -23,6 +42,14 @@ from supplier_app.constants.email_notifications import (
 )
 from django.utils.translation import to_locale, get_language
 
+logger = logging.getLogger(__name__)
+
+
+def get_from_email():
+    return 'Suppliers Management Eventbrite <{}>'.format(
+        settings.EMAIL_HOST_USER
+    )
+
 
 @shared_task(ignore_result=True)
 def send_email_notification(subject, message, recipient_list):
@@ -31,9 +58,7 @@ def send_email_notification(subject, message, recipient_list):
         send_mail(
             subject,
             plain_message,
-            'Suppliers Management Eventbrite <{}>'.format(
-                settings.EMAIL_HOST_USER
-            ),
+            get_from_email(),
             recipient_list,
             html_message=message,
             fail_silently=False,
@@ -42,6 +67,164 @@ def send_email_notification(subject, message, recipient_list):
         raise CouldNotSendEmailError()
 
 
+def build_email(subject, message, recipient_list, connection=None):
+    email = EmailMultiAlternatives(
+        subject,
+        strip_tags(message),
+        get_from_email(),
+        recipient_list,
+        connection=connection,
+    )
+    email.attach_alternative(message, 'text/html')
+    return email
+
+
+def get_email_connection():
+    return get_connection(settings.CELERY_EMAIL_BACKEND, fail_silently=False)
+
+
+def get_idempotency_key(*parts):
+    """
+    Hash of parts, which identify the change notified, so queuing the
+    notification of the same change again gets the same key.
+    """
+    payload = json.dumps([str(part) for part in parts])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _queue_outbox_drain():
+    # supplier_app.tasks imports this module
+    from supplier_app.tasks import drain_email_outbox
+    drain_email_outbox.apply_async()
+
+
+def queue_email_notification(subject, message, recipient_list, idempotency_key=None):
+    """
+    Store the email in the outbox, in the caller's transaction.
+
+    The email is sent by the drain_email_outbox task, queued once the
+    transaction is committed and run by celery beat for the retries.
+    Returns False when an email with the same idempotency key is already in
+    the outbox, emails without a key are always stored.
+    """
+    if idempotency_key is None:
+        idempotency_key = uuid.uuid4().hex
+    _, created = OutboxEmail.objects.get_or_create(
+        idempotency_key=idempotency_key,
+        defaults={
+            'subject': str(subject),
+            'message': message,
+            'recipients': json.dumps(list(recipient_list)),
+        },
+    )
+    if created:
+        transaction.on_commit(_queue_outbox_drain)
+    return created
+
+
+def get_messages_by_language(
+    users: Iterable,
+    build_message: Callable[[], Tuple[str, str]],
+) -> List[Tuple[str, str, List[str]]]:
+    """
+    Return one (subject, html message, [email]) per user, in the user's
+    preferred language.
+
+    build_message is called once per language with that language active, so
+    the mail template is rendered once per language instead of once per user.
+    """
+    emails_by_language = defaultdict(list)
+    for user in users:
+        emails_by_language[user.preferred_language].append(user.email)
+
+    current_language = get_language()
+    email_messages = []
+    try:
+        for language, emails in emails_by_language.items():
+            translation.activate(language)
+            subject, message = build_message()
+            email_messages.extend((str(subject), message, [email]) for email in emails)
+    finally:
+        translation.activate(current_language)
+    return email_messages
+
+
+def get_invoice_change_ids(invoices):
+    """Latest historical record of each of invoices by id, the change notified"""
+    return dict(
+        Invoice.history.filter(
+            id__in=[invoice.id for invoice in invoices],
+        ).order_by().values('id').annotate(Max('history_id')).values_list('id', 'history_id__max')
+    )
+
+
+def send_bulk_status_change_emails(invoices, message=None):
+    """
+    Queue one email per supplier company listing all its invoices changed,
+    instead of one per invoice.
+    """
+    language = get_language()
+    invoices_by_company = defaultdict(list)
+    for invoice in invoices:
+        invoices_by_company[invoice.taxpayer.company].append(invoice)
+    users_by_company = defaultdict(list)
+    company_users = CompanyUserPermission.objects.filter(
+        company__in=list(invoices_by_company),
+        user__is_active=True,
+    ).select_related('user')
+    for company_user in company_users:
+        users_by_company[company_user.company_id].append(company_user.user)
+    change_ids = get_invoice_change_ids(invoices)
+
+    def get_message_builder(company, company_invoices):
+        def build_message():
+            status = str(company_invoices[0].get_status_display()).lower()
+            lower_text = INVOICE_BULK_STATUS_EMAIL.format(
+                status,
+                ', #'.join(invoice.invoice_number for invoice in company_invoices),
+            )
+            if message:
+                lower_text = '{} {}'.format(lower_text, INVOICE_BULK_STATUS_COMMENT_EMAIL.format(message))
+            html_message = build_mail_html(
+                company.name,
+                INVOICE_BULK_STATUS_UPPER.format(status),
+                lower_text,
+                DISCLAIMER,
+            )
+            return INVOICE_BULK_STATUS_UPPER.format(status), html_message
+        return build_message
+
+    for company, company_invoices in invoices_by_company.items():
+        queue_email_messages(
+            get_messages_by_language(
+                users_by_company[company.id],
+                get_message_builder(company, company_invoices),
+            ),
+            (
+                'invoice_bulk_status',
+                company_invoices[0].status,
+                sorted((invoice.id, change_ids.get(invoice.id)) for invoice in company_invoices),
+            ),
+        )
+    translation.activate(language)
+
+
+def queue_email_messages(email_messages, change=None):
+    """
+    Queue the complete (subject, html message, recipient list) of
+    email_messages in the outbox. change identifies the change notified,
+    each email is keyed by it and its recipients so the same change is
+    never emailed twice.
+    """
+    for subject, message, recipient_list in email_messages:
+        if not (subject and message and recipient_list):
+            continue
+        idempotency_key = None
+        if change is not None:
+            idempotency_key = get_idempotency_key(*change, sorted(recipient_list))
+        queue_email_notification(subject, message, recipient_list, idempotency_key)
+
+
 def company_invitation_notification(company, token, email, language, eb_entity_name):
     subject = _(email_notifications['company_invitation']['subject'])
     upper_text = _(email_notifications['company_invitation']['body']['upper_text'])
@@ -61,7 +244,12 @@ def company_invitation_notification(company, token, email, language, eb_entity_n
         second_text,
         third_text,
     )
-    send_email_notification.apply_async([subject, message, email])
+    queue_email_notification(
+        subject,
+        message,
+        email,
+        get_idempotency_key('company_invitation', token, sorted(email)),
+    )
 
 
 def get_message_and_subject(change_type: str, taxpayer: TaxPayer) -> Tuple[str, str]:
@@ -88,19 +276,37 @@ def get_supplier_language_by_taxpayer(taxpayer):
     return supplier_language
 
 
+def get_taxpayer_change_id(taxpayer):
+    """Latest historical record of taxpayer, the change notified"""
+    return TaxPayer.history.filter(id=taxpayer.id).order_by('-history_id').values_list(
+        'history_id',
+        flat=True,
+    ).first()
+
+
 def taxpayer_notification(taxpayer, change_type):
     taxpayer_language = to_locale(get_language())
     translation.activate(get_supplier_language_by_taxpayer(taxpayer))
     message, subject = get_message_and_subject(change_type, taxpayer)
     recipient_list = get_user_emails_by_tax_payer_id(taxpayer.id)
-    send_email_notification.apply_async([subject, message, recipient_list])
+    queue_email_notification(
+        subject,
+        message,
+        recipient_list,
+        get_idempotency_key(change_type, get_taxpayer_change_id(taxpayer), sorted(recipient_list)),
+    )
     translation.activate(taxpayer_language)
 
 
 def buyer_notification(taxpayer, change_type):
     message, subject = get_message_and_subject(change_type, taxpayer)
     recipient_list = get_buyer_emails_by_tax_payer_id(taxpayer.id)
-    send_email_notification.apply_async([subject, message, recipient_list])
+    queue_email_notification(
+        subject,
+        message,
+        recipient_list,
+        get_idempotency_key(change_type, get_taxpayer_change_id(taxpayer), sorted(recipient_list)),
+    )
 
 
 def get_user_emails_by_tax_payer_id(tax_payer_id):
@@ -0,0 +1,93 @@
+"""
+Local spool of the uploaded documents waiting to be pushed to the storage.
+
+Writing a file to Dropbox takes a round trip per chunk, and the views
+saved every uploaded file inside the request and its transaction: a
+taxpayer with five certificates took seconds to create. When
+UPLOAD_SPOOL_DIR is set, store_documents writes the new files to that
+directory instead and indexes them as pending documents, committed with
+the rows using them. The workers read the files from it, so it must be a
+disk shared with the web servers, it is not set by default. The
+upload_pending_documents task then pushes them to the storage, retrying
+the failed ones, and renames the rows if the storage picked another name.
+
+Spooled names have a directory made of the hash of the content, so they
+never clash with the names of the stored files. SpooledStorage reads them
+from the spool while they are pending, so they can be downloaded right
+after the upload.
+"""
+import posixpath
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, Storage
+
+
+def get_spool_storage():
+    """Storage of the upload spool, None when uploads are not spooled"""
+    if not settings.UPLOAD_SPOOL_DIR:
+        return None
+    return FileSystemStorage(location=settings.UPLOAD_SPOOL_DIR)
+
+
+def get_spool_name(name, sha256):
+    """name inside a directory of the content hash"""
+    directory, file_name = posixpath.split(name)
+    return posixpath.join(directory, sha256[:16], file_name)
+
+
+class SpooledStorage(Storage):
+    """backend, reading the files still in the upload spool from it"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.spool = get_spool_storage()
+
+    def _get_storage(self, name):
+        if self.spool is not None and self.spool.exists(name):
+            return self.spool
+        return self.backend
+
+    def _open(self, name, mode='rb'):
+        storage = self._get_storage(name)
+        try:
+            return storage.open(name, mode)
+        except FileNotFoundError:
+            # Pushed and deleted from the spool meanwhile
+            if storage is self.backend:
+                raise
+            return self.backend.open(name, mode)
+
+    def _save(self, name, content):
+        return self.backend._save(name, content)
+
+    def delete(self, name):
+        if self.spool is not None:
+            self.spool.delete(name)
+        self.backend.delete(name)
+
+    def get_available_name(self, name, max_length=None):
+        return self.backend.get_available_name(name, max_length=max_length)
+
+    def generate_filename(self, filename):
+        return self.backend.generate_filename(filename)
+
+    def exists(self, name):
+        return self._get_storage(name).exists(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def size(self, name):
+        return self._get_storage(name).size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def get_accessed_time(self, name):
+        return self._get_storage(name).get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self._get_storage(name).get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self._get_storage(name).get_modified_time(name)